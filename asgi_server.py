@@ -0,0 +1,253 @@
+from services import startup
+# record import cost per module for the startup report (GET /stats)
+startup.timed_imports('starlette.applications', 'chromadb', 'numpy', 'octoai.client', 'config', 'services.rag_service')
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route, Match
+from starlette.background import BackgroundTask
+from services.rag_service import (process_rag_query_text_async, process_rag_query_image_async,
+                                  stream_rag_query_text_async, get_cache_stats, meme_jobs, get_meme_image, warm_up,
+                                  process_rag_query_batch_async)
+from config import WARM_UP, BATCH_MAX_QUERIES, UPSTREAM_RETRY_AFTER
+from services.jobs import job_view, job_gone, FINISHED, EVENTS_POLL_INTERVAL
+from services.sse import format_sse, SSE_HEADERS, SSE_KEEP_ALIVE
+from services import metrics, admission
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+'''
+ASGI version of the same API (see router.py for the flask one). Everything runs on one long-lived
+event loop, so a single process can hold hundreds of in-flight requests while they wait on chroma,
+octo or glif. Run with: uvicorn asgi_server:app --host 0.0.0.0 --port 8080
+Admission control bounds how many of those run at once, as in router.py.
+'''
+
+# the upstream calls failed or ran out of time; worth retrying
+def unavailable(message):
+    return JSONResponse(message, 503, headers={'Retry-After': str(UPSTREAM_RETRY_AFTER)})
+
+# turned away by admission control before doing any work
+async def rejected(request, e):
+    return JSONResponse({"error": e.reason}, e.status, headers={'Retry-After': str(e.retry_after)})
+
+async def process_query_text(request):
+    data = await request.json()
+    query = data.get('query')
+
+    if not query:
+        return JSONResponse({"error": "No query provided"}, 400)
+
+    async with admission.text_gate.admit_async():
+        try:
+            response = await process_rag_query_text_async(query)
+            return JSONResponse(response, 200)
+        except Exception as e:
+            logger.error(f"Error processing text query: {str(e)}")
+            return unavailable("Couldn't process query!")
+
+async def process_query_text_batch(request):
+    data = await request.json()
+    queries = data.get('queries')
+
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return JSONResponse({"error": "No queries provided"}, 400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return JSONResponse({"error": f"At most {BATCH_MAX_QUERIES} queries per batch"}, 400)
+
+    async with admission.text_gate.admit_async():
+        try:
+            return JSONResponse({"results": await process_rag_query_batch_async(queries)}, 200)
+        except Exception as e:
+            logger.error(f"Error processing batch query: {str(e)}")
+            return unavailable("Couldn't process query!")
+
+async def process_query_text_stream(request):
+    data = await request.json()
+    query = data.get('query')
+
+    if not query:
+        return JSONResponse({"error": "No query provided"}, 400)
+
+    # the slot is held until the stream ends, not just until this returns
+    slot = await admission.text_gate.acquire_async()
+
+    async def generate():
+        try:
+            with admission.within(slot.deadline):
+                async for event, payload in stream_rag_query_text_async(query):
+                    yield format_sse(event, payload)
+        except Exception as e:
+            logger.error(f"Error streaming text query: {str(e)}")
+            yield format_sse("error", {"error": "Couldn't process query!"})
+        finally:
+            slot.release()
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS,
+                             background=BackgroundTask(slot.release))
+
+async def process_query_image(request):
+    data = await request.json()
+    query = data.get('query')
+    red_context = data.get('red_context')
+    blue_context = data.get('blue_context')
+
+    if not red_context or not blue_context:
+        return JSONResponse({"error": "No query provided"}, 400)
+
+    async with admission.image_gate.admit_async():
+        try:
+            response = await process_rag_query_image_async(query, red_context, blue_context)
+            # glif failed or ran out of the request's deadline
+            if response.get('meme') is None:
+                return unavailable("Couldn't generate meme:(")
+            return JSONResponse(response, 200)
+        except Exception as e:
+            logger.error(f"Error generating image: {str(e)}")
+            return unavailable("Couldn't generate meme:(")
+
+async def stats(request):
+    return JSONResponse(get_cache_stats(), 200)
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+async def submit_image_job(request):
+    data = await request.json()
+    query = data.get('query')
+    red_context = data.get('red_context')
+    blue_context = data.get('blue_context')
+
+    if not red_context or not blue_context:
+        return JSONResponse({"error": "No query provided"}, 400)
+
+    try:
+        job = await asyncio.to_thread(meme_jobs.submit, query, red_context, blue_context, data.get('callback_url'))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, 400)
+    return JSONResponse(job_view(job), 202, headers={'Location': f"/jobs/{job['id']}"})
+
+async def get_job(request):
+    job = await asyncio.to_thread(meme_jobs.store.get, request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({"error": "No such job"}, 404)
+    return JSONResponse(job_view(job), 200)
+
+# push status changes until the job finishes; polls instead of parking a thread per listener
+async def job_events(request):
+    job_id = request.path_params['job_id']
+    job = await asyncio.to_thread(meme_jobs.store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "No such job"}, 404)
+
+    async def generate(job):
+        yield format_sse(job['status'], job_view(job))
+        last_sent = time.time()
+        while job['status'] not in FINISHED:
+            status = job['status']
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+            job = await asyncio.to_thread(meme_jobs.store.get, job_id)
+            if job is None:
+                yield format_sse("gone", job_gone(job_id))
+                return
+            if job['status'] != status:
+                yield format_sse(job['status'], job_view(job))
+                last_sent = time.time()
+            elif time.time() - last_sent > 15:
+                yield SSE_KEEP_ALIVE
+                last_sent = time.time()
+
+    return StreamingResponse(generate(job), media_type='text/event-stream', headers=SSE_HEADERS)
+
+# meme ids are content hashes, so a given url never changes
+async def get_meme(request):
+    meme_id = request.path_params['meme_id']
+    etag = f'"{meme_id}"'
+    headers = {'ETag': etag, 'Cache-Control': 'public, max-age=31536000, immutable'}
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+
+    data, content_type = await asyncio.to_thread(get_meme_image, meme_id)
+    if data is None:
+        return JSONResponse({"error": "No such meme"}, 404)
+    return Response(data, media_type=content_type, headers=headers)
+
+routes = [
+    Route('/query/text', process_query_text, methods=['POST']),
+    Route('/query/text/batch', process_query_text_batch, methods=['POST']),
+    Route('/query/text/stream', process_query_text_stream, methods=['POST']),
+    Route('/query/image', process_query_image, methods=['POST']),
+    Route('/stats', stats, methods=['GET']),
+    Route('/metrics', prometheus_metrics, methods=['GET']),
+    Route('/jobs/image', submit_image_job, methods=['POST']),
+    Route('/jobs/{job_id}', get_job, methods=['GET']),
+    Route('/jobs/{job_id}/events', job_events, methods=['GET']),
+    Route('/memes/{meme_id}', get_meme, methods=['GET']),
+]
+
+# connect to chroma/octo off the request path; requests before it finishes connect lazily. also resume
+# meme jobs left behind by processes that died
+@asynccontextmanager
+async def lifespan(app):
+    loop = asyncio.get_running_loop()
+    if WARM_UP:
+        loop.run_in_executor(None, warm_up)
+    await loop.run_in_executor(None, meme_jobs.start)
+    yield
+
+# route template for metric labels, so /jobs/<id> doesn't make a new series per job
+def route_path(scope):
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return 'unmatched'
+
+# times every request; spans recorded while handling it go out in a Server-Timing header
+class TimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        timer = metrics.start_request(scope['path'])
+        finished = False
+
+        async def send_with_timing(message):
+            nonlocal finished
+            if message['type'] == 'http.response.start' and not finished:
+                finished = True
+                header = metrics.finish_request(timer, scope['method'], route_path(scope), message['status'])
+                message = dict(message, headers=list(message.get('headers', [])) + [(b'server-timing', header.encode('latin-1'))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if not finished:
+                metrics.finish_request(timer, scope['method'], route_path(scope), 500)
+
+def create_app():
+    return Starlette(
+        routes=routes,
+        middleware=[
+            Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+            Middleware(TimingMiddleware)
+        ],
+        exception_handlers={admission.Rejected: rejected},
+        lifespan=lifespan
+    )
+
+app = create_app()
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 8080)))
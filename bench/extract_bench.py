@@ -0,0 +1,115 @@
+# micro-benchmark for article extractors: throughput and peak memory on saved html
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest.extract import EXTRACTORS, extract_article
+
+'''
+Each extractor runs in its own subprocess so peak RSS isn't shared between them. Pages come from
+bench/fixtures/*.html, or from an ingestion fetch cache (--fetch-cache cache/fetch) to measure on the
+real corpus. Prints a table, and the raw numbers as JSON with --json. --check instead runs every
+page through every extractor once and fails if one comes back empty where the soup baseline found
+article text (the fixtures include pages that used to trip the stream extractor's skip rules).
+
+    python bench/extract_bench.py --iterations 20
+    python bench/extract_bench.py --check
+'''
+
+def load_pages(fixtures, fetch_cache=None):
+    if fetch_cache:
+        from ingest.fetch_cache import FetchCache
+        return [body for _, body in FetchCache(fetch_cache, offline=True).iter_pages()]
+    pages = []
+    for path in sorted(glob.glob(os.path.join(fixtures, '*.html'))):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+# runs inside the subprocess
+def measure(method, pages, iterations, max_chars):
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    chars = 0
+    for _ in range(iterations):
+        for page in pages:
+            chars += len(extract_article(page, method, max_chars))
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    docs = iterations * len(pages)
+    return {
+        "method": method,
+        "docs": docs,
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(docs / elapsed, 1),
+        "mb_per_sec": round(iterations * sum(len(page) for page in pages) / elapsed / 1e6, 2),
+        "avg_chars_out": chars // docs,
+        "python_peak_kb": traced_peak // 1024,
+        "rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss # linux reports kb
+    }
+
+# pages (by index) where a method returned nothing but the original soup extractor found text
+def check(pages, methods, max_chars):
+    failures = []
+    for i, page in enumerate(pages):
+        if not extract_article(page, 'soup', max_chars):
+            continue
+        failures.extend((i, method) for method in methods if not extract_article(page, method, max_chars))
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fixtures', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+    parser.add_argument('--fetch-cache')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--max-chars', type=int, default=20000)
+    parser.add_argument('--methods', default=','.join(EXTRACTORS))
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('--check', action='store_true', help="only check that no extractor drops a page")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    pages = load_pages(args.fixtures, args.fetch_cache)
+    if not pages:
+        sys.exit("No pages to benchmark")
+
+    if args.check:
+        failures = check(pages, args.methods.split(','), args.max_chars)
+        for i, method in failures:
+            print(f"{method} extracted nothing from page {i}")
+        sys.exit(1 if failures else 0)
+
+    if args.child:
+        print(json.dumps(measure(args.child, pages, args.iterations, args.max_chars)))
+        return
+
+    results = []
+    for method in args.methods.split(','):
+        command = [sys.executable, os.path.abspath(__file__), '--child', method, '--fixtures', args.fixtures,
+                   '--iterations', str(args.iterations), '--max-chars', str(args.max_chars)]
+        if args.fetch_cache:
+            command += ['--fetch-cache', args.fetch_cache]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output))
+
+    if args.json:
+        print(json.dumps({"pages": len(pages), "results": results}, indent=2))
+        return
+    print(f"{len(pages)} pages x {args.iterations} iterations")
+    print(f"{'method':<10}{'docs/s':>10}{'MB/s':>8}{'py peak KB':>12}{'RSS +KB':>10}{'chars out':>11}")
+    for r in results:
+        print(f"{r['method']:<10}{r['docs_per_sec']:>10}{r['mb_per_sec']:>8}{r['python_peak_kb']:>12}"
+              f"{r['rss_growth_kb']:>10}{r['avg_chars_out']:>11}")
+
+if __name__ == '__main__':
+    main()
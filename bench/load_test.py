@@ -0,0 +1,221 @@
+# load test for /query/text and /query/image against local stubs: latency percentiles, throughput, errors, cache hits
+import argparse
+import glob
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stubs import add_stub_arguments, stubs_from_args, stub_env
+
+'''
+Starts the chroma/octo/glif stubs (bench/stubs.py), launches the app against them with fresh caches in a
+temp dir (flask by default, --server asgi for uvicorn), then replays the questions in
+queries/queries-v*.txt at each concurrency level. Each level sends --requests requests, sampling
+questions with replacement so later requests can hit the caches; cache hit rates come from the
+difference in GET /stats before and after the level. Prints one JSON document.
+
+    python bench/load_test.py --concurrency 1,8,32 --requests 200 --octo-latency 0.8
+    python bench/load_test.py --app-url http://localhost:8080 --endpoint text   # an already running app
+
+The app still embeds queries locally, so the default embedding model has to be in ~/.cache/chroma
+already (run the app once online). Levels run in order against the same app, so caches warm up
+across levels; use --fresh to restart the app for every level.
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_queries(pattern):
+    queries = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'r') as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    return queries
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return round(values[index] * 1000, 1)
+
+# every stats section that counts hits and misses, e.g. embedding, llm, semantic, meme results
+def hit_counts(stats, prefix=''):
+    counts = {}
+    for name, section in stats.items():
+        if not isinstance(section, dict):
+            continue
+        if 'hits' in section and 'misses' in section:
+            counts[prefix + name] = (section['hits'], section['misses'])
+        elif name != 'tiers':
+            counts.update(hit_counts(section, f"{prefix}{name}."))
+    return counts
+
+def hit_rates(before, after):
+    before, after = hit_counts(before), hit_counts(after)
+    rates = {}
+    for name, (hits, misses) in after.items():
+        hits -= before.get(name, (0, 0))[0]
+        misses -= before.get(name, (0, 0))[1]
+        if hits + misses:
+            rates[name] = {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3)}
+    return rates
+
+class App:
+    def __init__(self, server, port, env, log):
+        self.url = f"http://127.0.0.1:{port}"
+        if server == 'asgi':
+            command = [sys.executable, 'asgi_server.py']
+        else:
+            command = [sys.executable, '-m', 'flask', '--app', 'server', 'run', '--port', str(port), '--with-threads']
+        self.process = subprocess.Popen(command, cwd=ROOT, env=dict(os.environ, PORT=str(port), **env),
+                                        stdout=log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"App exited with {self.process.returncode}, see the app log")
+            try:
+                if requests.get(f"{self.url}/stats", timeout=2).ok:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError("App didn't come up in time")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def app_env(stubs, directory):
+    env = stub_env(stubs)
+    env.update({
+        "LLM_CACHE_PATH": os.path.join(directory, 'llm_cache.db'),
+        "MEME_CACHE_PATH": os.path.join(directory, 'meme_cache.db'),
+        "MEME_BLOB_DIR": os.path.join(directory, 'memes'),
+        "MEME_JOBS_PATH": os.path.join(directory, 'jobs.db'),
+        "LOCAL_INDEX_DIR": os.path.join(directory, 'local_index'),
+        "ANSWER_INDEX_DIR": os.path.join(directory, 'answer_index'),
+        "WARM_UP": "true"
+    })
+    return env
+
+def request_body(endpoint, query):
+    if endpoint == 'image':
+        return {"query": query, "red_context": f"- Trump position on {query}", "blue_context": f"- Harris position on {query}"}
+    return {"query": query}
+
+def run_level(url, endpoint, queries, concurrency, total, timeout, seed):
+    rng = random.Random(seed)
+    sample = [rng.choice(queries) for _ in range(total)]
+    sessions = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def send(query):
+        session = getattr(sessions, 'session', None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(f"{url}/query/{endpoint}", json=request_body(endpoint, query), timeout=timeout)
+            status = response.status_code
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            results.append((elapsed, status))
+
+    before = requests.get(f"{url}/stats", timeout=10).json()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, sample))
+    wall = time.perf_counter() - start
+    after = requests.get(f"{url}/stats", timeout=10).json()
+
+    latencies = [elapsed for elapsed, status in results if status == 200]
+    errors = {}
+    for _, status in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(wall, 2),
+        "throughput_rps": round(total / wall, 2),
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                       "p99": percentile(latencies, 99), "max": percentile(latencies, 100)},
+        "error_rate": round(sum(errors.values()) / total, 4),
+        "errors": errors,
+        "cache": hit_rates(before, after)
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint', choices=['text', 'image'], action='append',
+                        help="endpoint(s) to load, default text")
+    parser.add_argument('--concurrency', default='1,4,16,32', help="comma separated levels")
+    parser.add_argument('--requests', type=int, default=100, help="requests per level")
+    parser.add_argument('--queries', default=os.path.join(ROOT, 'queries', 'queries-v*.txt'))
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--app-url', help="load an already running app instead of starting stubs and the app")
+    parser.add_argument('--fresh', action='store_true', help="restart the app with empty caches for every level")
+    parser.add_argument('--app-log', default=os.devnull, help="file for the app's output")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    levels = [int(level) for level in args.concurrency.split(',')]
+    endpoints = args.endpoint or ['text']
+    report = {"config": {key: value for key, value in vars(args).items() if key != 'app_log'},
+              "queries": len(queries), "results": []}
+
+    if args.app_url:
+        for endpoint in endpoints:
+            for level in levels:
+                report["results"].append(run_level(args.app_url, endpoint, queries, level, args.requests,
+                                                   args.timeout, args.seed))
+        print(json.dumps(report, indent=2))
+        return
+
+    stubs = stubs_from_args(args)
+    app = None
+    with open(args.app_log, 'a') as log, tempfile.TemporaryDirectory() as directory:
+        try:
+            for i, (endpoint, level) in enumerate((e, l) for e in endpoints for l in levels):
+                if app is None or args.fresh:
+                    if app is not None:
+                        app.stop()
+                    level_dir = os.path.join(directory, str(i))
+                    os.makedirs(level_dir)
+                    app = App(args.server, args.port, app_env(stubs, level_dir), log)
+                    app.wait_ready()
+                report["results"].append(run_level(app.url, endpoint, queries, level, args.requests,
+                                                   args.timeout, args.seed + i))
+        finally:
+            if app is not None:
+                app.stop()
+            for stub in stubs.values():
+                stub.stop()
+    report["stubs"] = {name: stub.counts for name, stub in stubs.items()}
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+# local stand-ins for the chroma http api, octoai chat completions and the glif simple api
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+Each stub is a threaded stdlib http server with a Behaviour: a median latency with lognormal jitter
+(sigma 0 makes it fixed) and a fraction of requests that fail with error_status. They answer just
+enough of each api for the app's clients:
+    chroma  - heartbeat/version/pre-flight, get collection, count, query (synthetic documents), get
+    octo    - /v1/chat/completions, plain and streamed (one sse chunk per word, token_latency apart)
+    glif    - POST to any path returns {"output": <image url>}; errors are 5xx or {"error": ...}
+
+Run standalone to point a dev server at them (prints the env to export):
+    python bench/stubs.py --chroma-latency 0.03 --octo-latency 0.8 --glif-errors 0.1
+'''
+
+class Behaviour:
+    def __init__(self, latency=0.0, jitter=0.3, error_rate=0.0, error_status=503):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        if self.latency <= 0:
+            return 0.0
+        with self._lock:
+            return self.latency * self._random.lognormvariate(0, self.jitter) if self.jitter else self.latency
+
+    def fails(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else {}
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # sleep for the stub's latency; True when this request should fail (the error is already sent)
+    def simulate(self):
+        behaviour = self.server.behaviour
+        time.sleep(behaviour.delay())
+        self.server.count('requests')
+        if behaviour.fails():
+            self.server.count('errors')
+            self.read_json()
+            self.send_json({"error": "stub failure"}, behaviour.error_status)
+            return True
+        return False
+
+    def do_GET(self):
+        self.handle_stub('GET')
+
+    def do_POST(self):
+        self.handle_stub('POST')
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, behaviour, port=0, **options):
+        super().__init__(('127.0.0.1', port), handler)
+        self.behaviour = behaviour
+        self.options = options
+        self.counts = {"requests": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name=self.RequestHandlerClass.__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class ChromaHandler(StubHandler):
+    # answered without latency or errors; the app's clients only call these while connecting
+    STATIC = {"heartbeat": {"nanosecond heartbeat": 1}, "version": "0.4.14",
+              "pre-flight-checks": {"max_batch_size": 41666}}
+
+    def collection(self, name):
+        return {"name": name, "id": hashlib.md5(name.encode('utf-8')).hexdigest(), "metadata": None}
+
+    def document(self, i):
+        return json.dumps({"summary": f"- Stub policy summary {i} " + "lorem ipsum " * 40})
+
+    # n pseudo-random documents, the same ones every time for the same collection and query vector
+    def query_result(self, collection_id, embedding, n):
+        rng = random.Random(f"{collection_id}:{embedding[:8]}")
+        picks = [rng.randrange(self.server.options['documents']) for _ in range(n)]
+        return {
+            "ids": [f"doc-{i}" for i in picks],
+            "distances": sorted(round(rng.random(), 4) for _ in picks),
+            "documents": [self.document(i) for i in picks],
+            "metadatas": [{"source": f"https://example.com/article/{i}"} for i in picks]
+        }
+
+    # a page of the whole collection, with 384-d embeddings when asked for (local index snapshots)
+    def page(self, collection_id, offset, limit, include):
+        indices = range(offset, min(offset + limit, self.server.options['documents']))
+        embeddings = None
+        if 'embeddings' in include:
+            embeddings = []
+            for i in indices:
+                rng = random.Random(f"{collection_id}:{i}")
+                embeddings.append([rng.gauss(0, 1) for _ in range(384)])
+        return {
+            "ids": [f"doc-{i}" for i in indices],
+            "documents": [self.document(i) for i in indices],
+            "metadatas": [{"source": f"https://example.com/article/{i}"} for i in indices],
+            "embeddings": embeddings
+        }
+
+    def handle_stub(self, method):
+        path = self.path.split('?')[0].rstrip('/')
+        parts = path.split('/')[3:] # after /api/v1/
+        if len(parts) == 1 and parts[0] in self.STATIC:
+            return self.send_json(self.STATIC[parts[0]])
+        if self.simulate():
+            return
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'collections':
+            return self.send_json(self.collection(parts[1]))
+        if len(parts) == 3 and parts[0] == 'collections':
+            collection_id, action = parts[1], parts[2]
+            if action == 'count':
+                return self.send_json(self.server.options['documents'])
+            body = self.read_json()
+            if action == 'query':
+                results = [self.query_result(collection_id, embedding, body.get('n_results', 10))
+                           for embedding in body.get('query_embeddings') or []]
+                response = {key: [result[key] for result in results] for key in ("ids", "distances", "documents", "metadatas")}
+                response["embeddings"] = None
+                return self.send_json(response)
+            if action == 'get':
+                return self.send_json(self.page(collection_id, body.get('offset') or 0, body.get('limit') or 100,
+                                                body.get('include') or []))
+            if action in ('upsert', 'add', 'delete'):
+                return self.send_json(True)
+        self.send_json({"error": f"stub doesn't handle {method} {path}"}, 404)
+
+class OctoHandler(StubHandler):
+    def handle_stub(self, method):
+        if method != 'POST' or not self.path.rstrip('/').endswith('/chat/completions'):
+            return self.send_json({"error": f"stub doesn't handle {method} {self.path}"}, 404)
+        if self.simulate():
+            return
+        body = self.read_json()
+        question = body.get('messages', [{}])[-1].get('content', '').split('Query:')[-1].replace('Response:', '')
+        words = f"- Stub answer about {question.strip()}".split()
+        words = words[:max(body.get('max_tokens', 128) // 2, 1)]
+        created = int(time.time())
+        if not body.get('stream'):
+            return self.send_json({
+                "id": "stub", "object": "chat.completion", "created": created, "model": body.get('model', 'stub'),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ' '.join(words)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+            })
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        token_latency = self.server.options.get('token_latency', 0.0)
+        for i, word in enumerate(words):
+            time.sleep(token_latency)
+            self.write_chunk({
+                "id": "stub", "object": "chat.completion.chunk", "created": created, "model": body.get('model', 'stub'),
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": word if i == 0 else f" {word}"},
+                             "finish_reason": "stop" if i == len(words) - 1 else None}]
+            })
+        self.write_chunk('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        event = f"data: {data}\n\n".encode('utf-8')
+        self.wfile.write(f"{len(event):x}\r\n".encode('ascii') + event + b"\r\n")
+        self.wfile.flush()
+
+class GlifHandler(StubHandler):
+    def handle_stub(self, method):
+        if method != 'POST':
+            return self.send_json({"error": f"stub doesn't handle {method} {self.path}"}, 404)
+        if self.simulate():
+            return
+        body = self.read_json()
+        digest = hashlib.sha1(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()
+        self.send_json({"id": digest, "inputs": body.get('inputs'), "output": f"{self.server.url}/memes/{digest}.png"})
+
+def start_stubs(chroma=None, octo=None, glif=None, documents=200, token_latency=0.0):
+    return {
+        "chroma": StubServer(ChromaHandler, chroma or Behaviour(), documents=documents).start(),
+        "octo": StubServer(OctoHandler, octo or Behaviour(), token_latency=token_latency).start(),
+        "glif": StubServer(GlifHandler, glif or Behaviour()).start()
+    }
+
+# environment that points the app (config.py / rag_service.py) at the stubs
+def stub_env(stubs):
+    chroma_port = stubs['chroma'].server_address[1]
+    return {
+        "CHROMA_HOST_IP_ADDRESS": "127.0.0.1",
+        "CHROMA_PORT": str(chroma_port),
+        "OCTO_API": "stub",
+        "OCTO_BASE_URL": stubs['octo'].url,
+        "GLIF_API_URL": stubs['glif'].url,
+        "GLIF_API_KEY_1": "stub-1",
+        "GLIF_API_KEY_2": "stub-2",
+        "GLIF_API_KEY_3": "stub-3"
+    }
+
+def add_stub_arguments(parser):
+    for name, latency in (('chroma', 0.02), ('octo', 0.5), ('glif', 2.0)):
+        parser.add_argument(f'--{name}-latency', type=float, default=latency, help="median seconds")
+        parser.add_argument(f'--{name}-jitter', type=float, default=0.3, help="lognormal sigma, 0 for fixed")
+        parser.add_argument(f'--{name}-errors', type=float, default=0.0, help="fraction of requests that fail")
+        parser.add_argument(f'--{name}-error-status', type=int, default=503)
+    parser.add_argument('--token-latency', type=float, default=0.02, help="seconds between streamed tokens")
+    parser.add_argument('--documents', type=int, default=200, help="documents per stub collection")
+
+def stubs_from_args(args):
+    def behaviour(name):
+        return Behaviour(getattr(args, f'{name}_latency'), getattr(args, f'{name}_jitter'),
+                         getattr(args, f'{name}_errors'), getattr(args, f'{name}_error_status'))
+    return start_stubs(behaviour('chroma'), behaviour('octo'), behaviour('glif'), args.documents, args.token_latency)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_stub_arguments(parser)
+    stubs = stubs_from_args(parser.parse_args())
+    for key, value in stub_env(stubs).items():
+        print(f"export {key}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
@@ -1,7 +1,12 @@
 import os
+import tempfile
+import threading
+from functools import partial
 from dotenv import load_dotenv
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
+from services import startup
 
 '''
 Configuration of all db/clients: Chroma, embedding models, image gen
@@ -9,17 +14,159 @@ Configuration of all db/clients: Chroma, embedding models, image gen
 
 load_dotenv()
 
+CHROMA_PORT = int(os.getenv('CHROMA_PORT', 8000))
+
 settings = Settings(
     chroma_server_host=os.getenv('CHROMA_HOST_IP_ADDRESS'),
 )
 
+# clients and collections are created on first use (or by warm-up), so importing this module
+# never touches the network and startup doesn't fail when chroma is unreachable
+_lock = threading.RLock()
+_client = None
+_embedding_function = None
+_collections = {}
+
 # Initialize ChromaDB client
-client = chromadb.HttpClient(
-        host=os.getenv('CHROMA_HOST_IP_ADDRESS'),
-        port=8000,
-        ssl=False,
-        headers=None,
-        settings=settings,
-    )
-red_collection = client.get_collection(name="Red")
-blue_collection = client.get_collection(name="Blue")
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                with startup.timed("chroma client"):
+                    _client = chromadb.HttpClient(
+                        host=os.getenv('CHROMA_HOST_IP_ADDRESS'),
+                        port=CHROMA_PORT,
+                        ssl=False,
+                        headers=None,
+                        settings=settings,
+                    )
+                    _bound_timeout(_client, CHROMA_TIMEOUT)
+    return _client
+
+# chroma 0.4's http client (the FastAPI api object itself) sends every request without a timeout, so a
+# hung connection would hold its worker thread long after the caller gave up; give its requests session
+# a default one
+def _bound_timeout(client, timeout):
+    session = getattr(client, '_session', None)
+    if session is not None:
+        session.request = partial(session.request, timeout=timeout)
+
+# same default model the collections were built with; shared so a query is embedded once for both
+def get_embedding_function():
+    global _embedding_function
+    if _embedding_function is None:
+        with _lock:
+            if _embedding_function is None:
+                _embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    return _embedding_function
+
+# the collection is fetched outside the lock, so a slow chroma only holds up callers of that lookup;
+# if two threads race, the first one published wins
+def get_collection(name):
+    collection = _collections.get(name)
+    if collection is None:
+        with startup.timed(f"{name} collection"):
+            collection = get_client().get_collection(name=name, embedding_function=get_embedding_function())
+        with _lock:
+            collection = _collections.setdefault(name, collection)
+    return collection
+
+RED = "Red"
+BLUE = "Blue"
+
+# create clients and load the embedding model in a background thread at startup
+WARM_UP = os.getenv('WARM_UP', 'true').lower() == 'true'
+
+# send octo requests to another host with the same api, e.g. the stub in bench/stubs.py
+OCTO_BASE_URL = os.getenv('OCTO_BASE_URL')
+
+# worker pools for blocking calls, one for chroma/embedding and one for llm calls so slow llm calls can't
+# starve retrieval, and per-call timeouts (seconds), which the clients themselves are also created with
+RAG_MAX_WORKERS = int(os.getenv('RAG_MAX_WORKERS', 16))
+LLM_MAX_WORKERS = int(os.getenv('LLM_MAX_WORKERS', 16))
+CHROMA_TIMEOUT = float(os.getenv('CHROMA_TIMEOUT', 5))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 20))
+EMBED_TIMEOUT = float(os.getenv('EMBED_TIMEOUT', 5))
+
+# coalesce identical in-flight text queries and glif calls; followers wait at most this long
+SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', 'true').lower() == 'true'
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', EMBED_TIMEOUT + CHROMA_TIMEOUT + LLM_TIMEOUT))
+
+# /query/text/batch: most questions per request, and questions answered concurrently per batch
+BATCH_MAX_QUERIES = int(os.getenv('BATCH_MAX_QUERIES', 32))
+BATCH_LLM_CONCURRENCY = int(os.getenv('BATCH_LLM_CONCURRENCY', 8))
+
+# query text -> vector cache size
+EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', 1024))
+
+# optional in-process snapshot of the collections (see services/local_index.py)
+LOCAL_INDEX = os.getenv('LOCAL_INDEX', 'false').lower() == 'true'
+LOCAL_INDEX_DIR = os.getenv('LOCAL_INDEX_DIR', 'local_index')
+LOCAL_INDEX_REFRESH = float(os.getenv('LOCAL_INDEX_REFRESH', 300))
+
+# precomputed answers for the query corpus (see precompute.py and services/answer_index.py)
+ANSWER_INDEX = os.getenv('ANSWER_INDEX', 'true').lower() == 'true'
+ANSWER_INDEX_DIR = os.getenv('ANSWER_INDEX_DIR', 'answer_index')
+ANSWER_INDEX_THRESHOLD = float(os.getenv('ANSWER_INDEX_THRESHOLD', 0.95))
+ANSWER_INDEX_CHECK = float(os.getenv('ANSWER_INDEX_CHECK', 300))
+
+# sqlite files and blobs the server writes while it runs. the default is under the system temp dir, since
+# the working directory may be read-only (e.g. on lambda, where only /tmp is writable)
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'meme-generator'))
+
+# llm response cache: memory, sqlite or tiered (memory in front of a sqlite file shared by workers)
+LLM_CACHE_BACKEND = os.getenv('LLM_CACHE_BACKEND', 'tiered')
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(CACHE_DIR, 'llm_cache.db'))
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', 10000))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 24 * 3600))
+
+# whole-answer cache matched on query embedding similarity (cosine, 0-1)
+SEMANTIC_CACHE = os.getenv('SEMANTIC_CACHE', 'true').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 2048))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', 3600))
+
+# background meme jobs (see services/jobs.py)
+MEME_JOBS_PATH = os.getenv('MEME_JOBS_PATH', os.path.join(CACHE_DIR, 'jobs.db'))
+MEME_WORKERS = int(os.getenv('MEME_WORKERS', 4))
+MEME_JOB_DEADLINE = float(os.getenv('MEME_JOB_DEADLINE', 120))
+# seconds a process's claim on its jobs lasts without renewal; other processes take over after that
+MEME_JOB_LEASE = float(os.getenv('MEME_JOB_LEASE', 30))
+# comma separated hosts job callbacks may go to; when unset, any host resolving to public addresses only
+MEME_CALLBACK_HOSTS = [host.strip().lower() for host in os.getenv('MEME_CALLBACK_HOSTS', '').split(',') if host.strip()]
+
+# glif image generation (see services/glif_client.py); hedging is off unless GLIF_HEDGE_AFTER is set
+GLIF_API_URL = os.getenv('GLIF_API_URL', 'https://simple-api.glif.app')
+GLIF_ID = os.getenv('GLIF_ID', 'clz4xb23q00071120ixtlgzr9') # custom glif
+GLIF_CONNECT_TIMEOUT = float(os.getenv('GLIF_CONNECT_TIMEOUT', 3))
+GLIF_READ_TIMEOUT = float(os.getenv('GLIF_READ_TIMEOUT', 90))
+GLIF_FAILURE_THRESHOLD = int(os.getenv('GLIF_FAILURE_THRESHOLD', 3))
+GLIF_KEY_COOLDOWN = float(os.getenv('GLIF_KEY_COOLDOWN', 600))
+GLIF_HEDGE_AFTER = float(os.getenv('GLIF_HEDGE_AFTER')) if os.getenv('GLIF_HEDGE_AFTER') else None
+
+# admission control (see services/admission.py): requests handled at once per route group, how many
+# more may wait for a slot, and each request's deadline (seconds), which upstream calls are cut to
+TEXT_CONCURRENCY = int(os.getenv('TEXT_CONCURRENCY', 16))
+TEXT_QUEUE = int(os.getenv('TEXT_QUEUE', 64))
+TEXT_DEADLINE = float(os.getenv('TEXT_DEADLINE', EMBED_TIMEOUT + CHROMA_TIMEOUT + LLM_TIMEOUT))
+IMAGE_CONCURRENCY = int(os.getenv('IMAGE_CONCURRENCY', 4))
+IMAGE_QUEUE = int(os.getenv('IMAGE_QUEUE', 8))
+IMAGE_DEADLINE = float(os.getenv('IMAGE_DEADLINE', GLIF_CONNECT_TIMEOUT + GLIF_READ_TIMEOUT))
+# Retry-After (seconds) sent with a 503 when an upstream call failed
+UPSTREAM_RETRY_AFTER = int(os.getenv('UPSTREAM_RETRY_AFTER', 5))
+
+# glif results keyed by normalized inputs; MEME_MIRROR also keeps the image bytes locally
+MEME_CACHE = os.getenv('MEME_CACHE', 'true').lower() == 'true'
+MEME_CACHE_PATH = os.getenv('MEME_CACHE_PATH', os.path.join(CACHE_DIR, 'meme_cache.db'))
+MEME_CACHE_SIZE = int(os.getenv('MEME_CACHE_SIZE', 5000))
+MEME_CACHE_TTL = float(os.getenv('MEME_CACHE_TTL', 7 * 24 * 3600))
+MEME_MIRROR = os.getenv('MEME_MIRROR', 'false').lower() == 'true'
+MEME_BLOB_DIR = os.getenv('MEME_BLOB_DIR', os.path.join(CACHE_DIR, 'memes'))
+MEME_BLOB_MAX_BYTES = int(os.getenv('MEME_BLOB_MAX_BYTES', 512 * 1024 * 1024))
+
+# profile this fraction of requests with cProfile, keeping those slower than PROFILE_MIN_SECONDS
+# (see services/metrics.py)
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_MIN_SECONDS = float(os.getenv('PROFILE_MIN_SECONDS', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(CACHE_DIR, 'profiles'))
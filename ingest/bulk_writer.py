@@ -0,0 +1,119 @@
+# buffered collection writes: embed and upsert summaries in batches instead of one request per article
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+'''
+Documents are buffered until the batch hits max_docs or roughly max_tokens (estimated at ~4 chars per
+token), then embedded with a single embedding call and written with a single upsert. Failed calls are
+retried. When the error points at a document (chroma's validation raises ValueError) the batch is
+split in half and each half tried again with the embeddings already computed, so one bad document
+doesn't cost the whole batch or a second round of embedding. Any other error (chroma down, a timeout)
+would fail every half the same way, so the whole batch is failed without bisecting.
+'''
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+# errors caused by the documents themselves; retrying the same payload won't help, splitting it might.
+# requests' JSONDecodeError is also a ValueError, but it's about the response, not the documents
+def document_error(error):
+    return isinstance(error, (ValueError, TypeError)) and not isinstance(error, OSError)
+
+class BulkWriter:
+    # on_written(items) / on_failed(item, error) report the outcome for each added item
+    def __init__(self, collection, embedding_function, max_docs=64, max_tokens=8000, retries=3,
+                 on_written=None, on_failed=None):
+        self.collection = collection
+        self.embedding_function = embedding_function
+        self.max_docs = max_docs
+        self.max_tokens = max_tokens
+        self.retries = retries
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self._buffer = []
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, doc_id, document, metadata, item=None):
+        tokens = estimate_tokens(document)
+        with self._lock:
+            # flush first if this document would push the batch over its token budget
+            batch = None
+            if self._buffer and self._tokens + tokens > self.max_tokens:
+                batch = self._take()
+            self._buffer.append((doc_id, document, metadata, item))
+            self._tokens += tokens
+            if batch is None and len(self._buffer) >= self.max_docs:
+                batch = self._take()
+        if batch:
+            self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._take()
+        if batch:
+            self._write(batch)
+
+    def _take(self):
+        batch, self._buffer, self._tokens = self._buffer, [], 0
+        return batch
+
+    def _retry(self, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == self.retries or document_error(e):
+                    raise
+                logger.warning(f"Retrying {func.__name__} after error: {str(e)}")
+                time.sleep(2 ** attempt)
+
+    def _embed(self, documents):
+        return [list(map(float, vector)) for vector in self.embedding_function(documents)]
+
+    def _upsert(self, batch, embeddings):
+        self.collection.upsert(
+            ids=[doc_id for doc_id, _, _, _ in batch],
+            documents=[document for _, document, _, _ in batch],
+            metadatas=[metadata for _, _, metadata, _ in batch],
+            embeddings=embeddings
+        )
+
+    def _write(self, batch, embeddings=None):
+        try:
+            if embeddings is None:
+                embeddings = self._retry(self._embed, [document for _, document, _, _ in batch])
+            self._retry(self._upsert, batch, embeddings)
+        except Exception as e:
+            if len(batch) > 1 and document_error(e):
+                # isolate the bad document without re-embedding anything
+                middle = len(batch) // 2
+                if embeddings is None:
+                    self._write(batch[:middle])
+                    self._write(batch[middle:])
+                else:
+                    self._write(batch[:middle], embeddings[:middle])
+                    self._write(batch[middle:], embeddings[middle:])
+                return
+            with self._lock:
+                self.failed += len(batch)
+            for doc_id, _, _, item in batch:
+                logger.error(f"Couldn't write {doc_id}: {str(e)}")
+                if self.on_failed is not None:
+                    self.on_failed(item, e)
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.written += len(batch)
+        if self.on_written is not None:
+            self.on_written([item for _, _, _, item in batch])
+
+    def stats(self):
+        return {"batches": self.batches, "written": self.written, "failed": self.failed}
@@ -0,0 +1,218 @@
+# article text extraction: the text of every <p>, minus boilerplate, capped in length
+import codecs
+from html.parser import HTMLParser
+import re
+
+'''
+Extractors take raw html (bytes or str) and return a list of paragraph strings; extract_article()
+cleans and joins them, so every extractor has the same output contract as the original
+' '.join(p.text for p in soup.find_all('p')), which "soup" still returns as is. "stream" is the default: a single pass over the
+document with html.parser's tokenizer, no tree, skipping nav/footer/cookie-banner style containers,
+and it stops reading once it has enough text. Bytes are decoded with the encoding a BOM or <meta>
+charset declares, else utf-8, else windows-1252, so non-utf-8 pages read as they do through soup. A skipped container that is never closed ends where
+its parent does, as it would in a browser, so one missing </div> can't drop the rest of the page.
+'''
+
+# containers whose paragraphs are never article text
+SKIP_TAGS = {'script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside', 'form', 'template', 'svg', 'button'}
+# a class/id/role token that marks a boilerplate container: one of these words, alone or as the first or
+# last -/_ separated part ("cookie-banner", "site_footer"), never a substring ("tag-social-security", "navy").
+# the ad words only count as the whole token: "ad-free-article" and an "ads-container" wrapping the
+# story are article markup
+SKIP_WORDS = (r'cookies?|consent|newsletter|subscribe|subscription|promo|promotions?'
+              r'|related|share|sharing|social|footer|nav|navbar|navigation|modal|banner')
+AD_WORDS = r'ads?|adverts?|advertisements?'
+SKIP_ATTR = re.compile(rf'(?:{SKIP_WORDS})(?:[-_].*)?|.*[-_](?:{SKIP_WORDS})|{AD_WORDS}', re.I)
+# the only tags the class/id/role heuristic applies to: containers that always get an end tag, since a
+# skipped region ends at the matching one. void tags (<link>, <img>) have none, <p> and <li> may leave it
+# out, and <article>/<main>/<body> are never boilerplate whatever their classes say (wordpress puts the
+# post's tags on <article>)
+MARKED_CONTAINERS = {'div', 'section', 'aside', 'ul', 'ol', 'table', 'figure', 'details', 'dialog', 'span'}
+# tags that never get an end tag, or whose end tag may be left out; neither can be relied on to end a
+# skipped region, so they aren't tracked as open ancestors
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+OPTIONAL_END_TAGS = {'p', 'li', 'dt', 'dd', 'option', 'optgroup', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot', 'colgroup',
+                     'caption', 'rb', 'rt', 'rp'}
+# tags that implicitly close an open <p>
+BLOCK_TAGS = {'div', 'section', 'article', 'ul', 'ol', 'table', 'blockquote', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre',
+              'figure', 'hr'}
+# whole phrases, not words: articles do say "sign up for coverage" and "a cookie-cutter approach"
+BOILERPLATE = re.compile(
+    r'\b(?:(?:we|this (?:site|website)) uses? cookies|accept (?:all )?cookies|cookie (?:policy|settings|preferences)'
+    r'|(?:enable|turn on) javascript|javascript is (?:disabled|required)|your browser (?:is|does)'
+    r'|sign up (?:for|to) (?:our|the) newsletter|subscribe (?:now|today|to (?:our|the) newsletter)'
+    r'|all rights reserved|click here|terms of (?:use|service)|(?:our|read the|view the|see our) privacy policy'
+    r'|log ?in to (?:continue|comment|read)|^advertisement$)|copyright ©',
+    re.I
+)
+MAX_BOILERPLATE = 200 # chars; a longer paragraph is article text even if it has a boilerplate phrase in it
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="text/html; charset=...">, looked for in the
+# first few kb as browsers do
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([-\w.:]+)', re.I)
+BOMS = ((b'\xef\xbb\xbf', 'utf-8'), (b'\xff\xfe', 'utf-16-le'), (b'\xfe\xff', 'utf-16-be'))
+# labels browsers decode as something else: latin-1 and ascii pages are really windows-1252, and a
+# page that got as far as a meta tag in ascii-compatible bytes isn't utf-16
+ENCODING_ALIASES = {'iso-8859-1': 'cp1252', 'latin-1': 'cp1252', 'latin1': 'cp1252', 'us-ascii': 'cp1252',
+                    'ascii': 'cp1252', 'utf-16': 'utf-8', 'utf-16le': 'utf-8', 'utf-16be': 'utf-8'}
+
+# the encoding a BOM or meta tag declares, or None
+def declared_encoding(data):
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    match = META_CHARSET.search(data[:4096])
+    if match is None:
+        return None
+    label = match.group(1).decode('ascii', errors='ignore').lower()
+    label = ENCODING_ALIASES.get(label, label)
+    try:
+        return codecs.lookup(label).name
+    except LookupError:
+        return None
+
+# bytes -> str the way the soup extractors see it: the declared encoding, else utf-8, else windows-1252
+def _decode(html):
+    if not isinstance(html, bytes):
+        return html
+    encoding = declared_encoding(html)
+    if encoding is not None:
+        return html.decode(encoding, errors='replace').lstrip('\ufeff')
+    try:
+        return html.decode('utf-8')
+    except UnicodeDecodeError:
+        return html.decode('cp1252', errors='replace')
+
+# original implementation: full BeautifulSoup tree
+def soup_paragraphs(html, max_chars=None):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    return [p.text for p in soup.find_all('p')]
+
+# BeautifulSoup, but only <p> elements are built into the tree
+def strainer_paragraphs(html, max_chars=None):
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('p'))
+    return [p.text for p in soup.find_all('p')]
+
+# close the innermost open element named tag, and any left open inside it
+def _pop_to(stack, tag):
+    while stack.pop() != tag:
+        pass
+
+class _ParagraphParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self.chars = 0
+        self._current = None
+        self._skip_tag = None
+        self._skip_open = [] # elements open inside the skipped region
+        self._open = [] # open elements outside skipped regions, so a skip can end when its parent closes
+
+    def _close_paragraph(self):
+        if self._current is not None:
+            text = ' '.join(''.join(self._current).split())
+            if text:
+                self.paragraphs.append(text)
+                self.chars += len(text)
+            self._current = None
+
+    # whether a container's class, id or role marks it as boilerplate
+    @staticmethod
+    def _skip_marker(tag, attrs):
+        if tag not in MARKED_CONTAINERS:
+            return False
+        tokens = ' '.join(value or '' for name, value in attrs if name in ('class', 'id', 'role')).split()
+        return any(SKIP_ATTR.fullmatch(token) for token in tokens)
+
+    def handle_starttag(self, tag, attrs):
+        tracked = tag not in VOID_TAGS and tag not in OPTIONAL_END_TAGS
+        if self._skip_tag is not None:
+            if tracked:
+                self._skip_open.append(tag)
+            return
+        if tag in SKIP_TAGS or self._skip_marker(tag, attrs):
+            self._close_paragraph()
+            self._skip_tag = tag
+            self._skip_open = []
+            return
+        if tracked:
+            self._open.append(tag)
+        if tag == 'p':
+            self._close_paragraph()
+            self._current = []
+        elif tag in BLOCK_TAGS:
+            self._close_paragraph()
+        elif tag == 'br' and self._current is not None:
+            self._current.append(' ')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == 'br' and self._current is not None and self._skip_tag is None:
+            self._current.append(' ')
+
+    def handle_endtag(self, tag):
+        if self._skip_tag is not None:
+            if tag in self._skip_open:
+                _pop_to(self._skip_open, tag)
+                return
+            if tag == self._skip_tag:
+                self._skip_tag = None
+                return
+            if tag not in self._open:
+                return
+            # an ancestor closed, so the skipped container was left unclosed: it ends here
+            self._skip_tag = None
+        if tag in self._open:
+            _pop_to(self._open, tag)
+        if tag == 'p':
+            self._close_paragraph()
+
+    def handle_data(self, data):
+        if self._current is not None and self._skip_tag is None:
+            self._current.append(data)
+
+# single pass, no tree; stops early once it has about twice max_chars of paragraph text
+def stream_paragraphs(html, max_chars=None, chunk_size=64 * 1024):
+    html = _decode(html)
+    parser = _ParagraphParser()
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        if max_chars and parser.chars >= 2 * max_chars:
+            break
+    else:
+        parser.close()
+    parser._close_paragraph()
+    return parser.paragraphs
+
+EXTRACTORS = {
+    'soup': soup_paragraphs,
+    'strainer': strainer_paragraphs,
+    'stream': stream_paragraphs
+}
+
+# drop boilerplate and repeated paragraphs, then join and cap at max_chars (on a word boundary). short
+# paragraphs are kept: every paragraph is a <p>'s text, and one-line quotes are article text
+def clean_paragraphs(paragraphs, max_chars=None):
+    seen = set()
+    kept = []
+    for paragraph in paragraphs:
+        paragraph = ' '.join(paragraph.split())
+        if not paragraph or paragraph in seen:
+            continue
+        if len(paragraph) <= MAX_BOILERPLATE and BOILERPLATE.search(paragraph):
+            continue
+        seen.add(paragraph)
+        kept.append(paragraph)
+    return _cap(' '.join(kept), max_chars)
+
+def _cap(text, max_chars):
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars].rsplit(' ', 1)[0]
+    return text
+
+# "soup" stays the unfiltered baseline the other extractors are checked against
+def extract_article(html, method='stream', max_chars=None):
+    if method == 'soup':
+        return _cap(' '.join(soup_paragraphs(html, max_chars)), max_chars)
+    return clean_paragraphs(EXTRACTORS[method](html, max_chars), max_chars)
@@ -0,0 +1,122 @@
+# on-disk http cache for article fetches: conditional GETs, keep-alive sessions per host, offline replay
+import gzip
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ingest.manifest import canonicalize_url
+from services.files import atomic_write
+
+'''
+Bodies are stored gzipped under <dir>/bodies/, indexed by canonical url in <dir>/index.db along with
+their ETag/Last-Modified. A cached page is revalidated with If-None-Match/If-Modified-Since, so an
+unchanged article costs a 304 instead of a download; pages fetched within max_age aren't revalidated
+at all. In offline mode only the cache is consulted and a miss raises OfflineMiss.
+'''
+
+class OfflineMiss(Exception):
+    pass
+
+class FetchCache:
+    def __init__(self, directory, offline=False, max_age=0, timeout=15, pool_size=4):
+        self.directory = directory
+        self.offline = offline
+        self.max_age = max_age
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.hits = 0 # served from cache without a request
+        self.revalidated = 0 # 304 not modified
+        self.downloads = 0
+        self.bytes_downloaded = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'bodies'), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body TEXT NOT NULL, fetched_at REAL NOT NULL)""")
+
+    # one pooled keep-alive session per host
+    def _session(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers['User-Agent'] = 'Mozilla/5.0 (compatible; meme-generator-ingest)'
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+        return session
+
+    def _lookup(self, key):
+        with self._lock:
+            return self._conn.execute("SELECT etag, last_modified, body, fetched_at FROM pages WHERE url = ?",
+                                      (key,)).fetchone()
+
+    def _read_body(self, name):
+        with gzip.open(os.path.join(self.directory, 'bodies', name), 'rb') as f:
+            return f.read()
+
+    def _store(self, key, response):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.gz'
+        path = os.path.join(self.directory, 'bodies', name)
+        # red and blue share urls, so two workers can store the same page at once
+        with atomic_write(path) as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            f.write(response.content)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, body, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (key, response.headers.get('ETag'), response.headers.get('Last-Modified'), name, time.time())
+            )
+
+    def _touch(self, key):
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), key))
+
+    # page body as bytes, from cache when it's still valid
+    def fetch(self, url):
+        key = canonicalize_url(url)
+        entry = self._lookup(key)
+        if entry is not None and (self.offline or time.time() - entry[3] < self.max_age):
+            self.hits += 1
+            return self._read_body(entry[2])
+        if self.offline:
+            raise OfflineMiss(f"Not cached: {url}")
+
+        headers = {}
+        if entry is not None:
+            if entry[0]:
+                headers['If-None-Match'] = entry[0]
+            if entry[1]:
+                headers['If-Modified-Since'] = entry[1]
+        response = self._session(url).get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            self._touch(key)
+            return self._read_body(entry[2])
+
+        response.raise_for_status()
+        self.downloads += 1
+        self.bytes_downloaded += len(response.content)
+        self._store(key, response)
+        return response.content
+
+    # every cached (canonical url, body) pair, e.g. to rerun extraction offline
+    def iter_pages(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT url, body FROM pages").fetchall()
+        for url, name in rows:
+            yield url, self._read_body(name)
+
+    def stats(self):
+        return {"hits": self.hits, "revalidated": self.revalidated, "downloads": self.downloads,
+                "bytes_downloaded": self.bytes_downloaded}
@@ -0,0 +1,149 @@
+# url identity and run state for ingestion: canonical urls, deterministic doc ids, and a resumable manifest
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+'''
+The manifest records, per (collection, canonical url), the last status ("stored", "skipped" or
+"failed"), the hash of the extracted article text, and when that happened. A rerun skips anything
+already stored, and with refresh on, still skips articles whose text hash hasn't changed.
+
+Collections written before ids came from urls hold each article under a random uuid, once per run
+that stored it. migrate_collection() rewrites those rows under their doc_id (keeping one per url),
+and records each url as stored, the first time a collection is seen, so the first incremental run
+neither duplicates nor resummarizes them.
+'''
+
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'mc_cid', 'mc_eid', 'cmpid', 'smid', 'ocid', 'taid', 'ref', 'ref_src',
+                   'sr_share'}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# one spelling per article: https, lowercase host without www, no fragment/default port/tracking params,
+# sorted query. a url without a scheme ("example.com/path") is read as a host and path; raises
+# ValueError if there's no host at all
+def canonicalize_url(url):
+    url = url.strip()
+    parts = urlsplit(url)
+    if not parts.netloc and '://' not in url:
+        parts = urlsplit('//' + url)
+    scheme = parts.scheme.lower() or 'https'
+    host = (parts.hostname or '').lower()
+    if not host or any(c.isspace() for c in host):
+        raise ValueError(f"Not an article url: {url!r}")
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    )
+    if scheme == 'http':
+        scheme = 'https'
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+# same article -> same chroma id, so re-ingesting overwrites instead of duplicating
+def doc_id(canonical_url):
+    return hashlib.sha1(canonical_url.encode('utf-8')).hexdigest()
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# drop repeats (after canonicalization), keeping the first spelling seen; lines that aren't urls are left out
+def dedupe_links(links):
+    seen = {}
+    for link in links:
+        try:
+            seen.setdefault(canonicalize_url(link), link)
+        except ValueError:
+            continue
+    return [(canonical, link) for canonical, link in seen.items()]
+
+class Manifest:
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS manifest (
+            collection TEXT NOT NULL, url TEXT NOT NULL, status TEXT NOT NULL, content_hash TEXT, doc_id TEXT,
+            error TEXT, updated_at REAL, PRIMARY KEY (collection, url))""")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS migrations (collection TEXT PRIMARY KEY, migrated_at REAL)")
+
+    def get(self, collection, url):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM manifest WHERE collection = ? AND url = ?",
+                                     (collection, url)).fetchone()
+        return dict(row) if row else None
+
+    def mark(self, collection, url, status, content_hash=None, doc_id=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO manifest (collection, url, status, content_hash, doc_id, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (collection, url) DO UPDATE SET status = excluded.status,
+                    content_hash = COALESCE(excluded.content_hash, manifest.content_hash),
+                    doc_id = COALESCE(excluded.doc_id, manifest.doc_id), error = excluded.error,
+                    updated_at = excluded.updated_at""",
+                (collection, url, status, content_hash, doc_id, error, time.time())
+            )
+
+    # rewrite the collection's uuid rows under doc ids and seed the manifest from them, once per
+    # collection; returns how many rows were rewritten and how many duplicates were deleted
+    def migrate_collection(self, name, collection, page_size=1000):
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM migrations WHERE collection = ?", (name,)).fetchone():
+                return {"rewritten": 0, "deleted": 0}
+        ids, documents, metadatas, embeddings = [], [], [], []
+        for offset in range(0, collection.count(), page_size):
+            page = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+            ids.extend(page['ids'])
+            documents.extend(page['documents'])
+            metadatas.extend(page['metadatas'])
+            embeddings.extend(page['embeddings'])
+
+        existing = set(ids)
+        rewrite, stale, canonicals = {}, [], {}
+        for row in zip(ids, documents, metadatas, embeddings):
+            metadata = row[2] or {}
+            # chunk documents (with a parent) were never written under uuids
+            if not metadata.get('source') or 'parent' in metadata:
+                continue
+            canonical = canonicalize_url(metadata['source'])
+            new_id = doc_id(canonical)
+            if row[0] == new_id:
+                continue
+            stale.append(row[0])
+            canonicals[new_id] = canonical
+            if new_id not in existing and new_id not in rewrite:
+                rewrite[new_id] = row
+
+        # write the new rows before deleting the old ones, so an interrupted migration loses nothing and
+        # simply runs again
+        new_ids = list(rewrite)
+        for start in range(0, len(new_ids), page_size):
+            batch = [rewrite[new_id] for new_id in new_ids[start:start + page_size]]
+            collection.upsert(ids=new_ids[start:start + page_size], documents=[row[1] for row in batch],
+                              metadatas=[row[2] for row in batch], embeddings=[row[3] for row in batch])
+        for start in range(0, len(stale), page_size):
+            collection.delete(ids=stale[start:start + page_size])
+        for new_id, canonical in canonicals.items():
+            if self.get(name, canonical) is None:
+                self.mark(name, canonical, 'stored', doc_id=new_id)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO migrations (collection, migrated_at) VALUES (?, ?)",
+                               (name, time.time()))
+        return {"rewritten": len(rewrite), "deleted": len(stale) - len(rewrite)}
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT collection, status, COUNT(*) FROM manifest GROUP BY collection, status").fetchall()
+        return {f"{row[0]}/{row[1]}": row[2] for row in rows}
@@ -0,0 +1,125 @@
+# staged ingestion pipeline: fetch -> summarize -> store, each stage a worker pool joined by bounded queues
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+'''
+Items are plain dicts that each stage adds to (e.g. {"source", "url"} -> + "text" -> + "summary").
+A stage function returns the item to pass on, or None to drop it (skipped, nothing to summarize, ...);
+exceptions are logged and counted against the stage. Bounded queues keep a fast stage from running
+arbitrarily far ahead of a slow one.
+'''
+
+_STOP = object()
+
+class Stage:
+    # on_error(item, error) is called for items the stage failed on
+    def __init__(self, name, func, workers, queue_size=64, on_error=None):
+        self.name = name
+        self.func = func
+        self.on_error = on_error
+        self.workers = workers
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.outbox = None
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                return
+            try:
+                result = self.func(item)
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"{self.name} failed for {item.get('url') or item.get('query')}: {str(e)}")
+                if self.on_error is not None:
+                    self.on_error(item, e)
+                continue
+            if result is None:
+                self._count('dropped')
+                continue
+            self._count('processed')
+            if self.outbox is not None:
+                self.outbox.put(result)
+
+    # wait for every worker to see the stop signal
+    def stop(self):
+        for _ in self._threads:
+            self.inbox.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        return {"processed": self.processed, "dropped": self.dropped, "failed": self.failed,
+                "queued": self.inbox.qsize()}
+
+class Pipeline:
+    def __init__(self, stages, report_every=15):
+        self.stages = stages
+        self.report_every = report_every
+        for stage, following in zip(stages, stages[1:]):
+            stage.outbox = following.inbox
+        self._done = threading.Event()
+
+    # run items through every stage; returns per-stage counts
+    def run(self, items):
+        start = time.time()
+        for stage in self.stages:
+            stage.start()
+        reporter = threading.Thread(target=self._report, args=(start,), name="progress", daemon=True)
+        reporter.start()
+
+        fed = 0
+        for item in items:
+            self.stages[0].inbox.put(item)
+            fed += 1
+
+        # drain front to back: a stage only stops once everything upstream has finished
+        for stage in self.stages:
+            stage.stop()
+        self._done.set()
+        reporter.join()
+
+        elapsed = time.time() - start
+        stats = {"items": fed, "elapsed": round(elapsed, 1), "stages": {s.name: s.stats() for s in self.stages}}
+        logger.info(f"Ingestion finished: {stats}")
+        return stats
+
+    def _report(self, start):
+        while not self._done.wait(self.report_every):
+            elapsed = time.time() - start
+            last = self.stages[-1]
+            rate = (last.processed + last.dropped) / elapsed if elapsed else 0
+            progress = ', '.join(
+                f"{s.name} {s.processed} ok/{s.dropped} skipped/{s.failed} failed/{s.inbox.qsize()} queued"
+                for s in self.stages
+            )
+            logger.info(f"[{elapsed:.0f}s] {progress} ({rate:.2f} docs/s)")
+
+# interleave several item lists so every source makes progress at the same time
+def round_robin(*item_lists):
+    iterators = [iter(items) for items in item_lists]
+    while iterators:
+        for iterator in list(iterators):
+            try:
+                yield next(iterator)
+            except StopIteration:
+                iterators.remove(iterator)
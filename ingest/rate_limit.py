@@ -0,0 +1,88 @@
+# rate limiting for ingestion: a token bucket that backs off on 429s, and per-domain politeness
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import random
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate # tokens per second
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # block until a token is available
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+# token bucket whose rate halves on every 429 and creeps back up while calls succeed (AIMD)
+class AdaptiveLimiter(TokenBucket):
+    def __init__(self, rate, min_rate=0.1, max_rate=None, increase=0.05):
+        super().__init__(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.increase = increase
+        self.throttled = 0
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+            self.throttled += 1
+
+    # call func under the limiter, retrying 429s with exponential backoff (plus jitter)
+    def call(self, func, *args, retries=5, **kwargs):
+        for attempt in range(retries + 1):
+            self.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == retries:
+                    raise
+                self.throttle()
+                time.sleep(min(60, 2 ** attempt) * (0.5 + random.random() / 2))
+                continue
+            self.success()
+            return result
+
+# octo/openai/requests errors all carry the status somewhere different
+def is_rate_limited(error):
+    status = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status == 429 or '429' in str(error) or 'rate limit' in str(error).lower()
+
+# at most `concurrency` requests in flight per host, spaced at least `interval` seconds apart
+class DomainLimiter:
+    def __init__(self, concurrency=2, interval=1.0):
+        self.interval = interval
+        self._slots = defaultdict(lambda: threading.BoundedSemaphore(concurrency))
+        self._next_time = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            semaphore = self._slots[host]
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_time[host])
+                self._next_time[host] = start + self.interval
+            time.sleep(start - now)
+            yield
@@ -0,0 +1,135 @@
+# serper search stage for link discovery: concurrent, rate limited, every raw response cached by query
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ingest.manifest import canonicalize_url
+
+'''
+Raw Serper responses are stored in <dir>/search.db keyed by the normalized query (case and whitespace
+folded), so a query that was already run is never paid for again, however the query files grow. Link
+files are rebuilt from the cache alone: each query's top organic results go to the red or blue list,
+deduped by canonical url within each list (first query to find a link wins), with the title, query and
+rank written to a .meta.jsonl file next to the plain link list.
+'''
+
+SERPER_URL = "https://google.serper.dev/search"
+
+class OfflineMiss(Exception):
+    pass
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+class SearchCache:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'search.db'), timeout=10, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS searches (
+            key TEXT PRIMARY KEY, query TEXT NOT NULL, response TEXT NOT NULL, fetched_at REAL NOT NULL)""")
+
+    def get(self, query):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM searches WHERE key = ?",
+                                     (normalize_query(query),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, query, response):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO searches (key, query, response, fetched_at) VALUES (?, ?, ?, ?)",
+                               (normalize_query(query), query, json.dumps(response), time.time()))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+
+class SerperClient:
+    # limiter is an AdaptiveLimiter (or anything with .call(func, *args)); 429s slow every worker down
+    def __init__(self, api_key, cache, limiter, offline=False, timeout=15, pool_size=8):
+        self.api_key = api_key
+        self.cache = cache
+        self.limiter = limiter
+        self.offline = offline
+        self.timeout = timeout
+        self.hits = 0
+        self.searches = 0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+
+    def _post(self, query):
+        response = self._session.post(SERPER_URL, json={"q": query}, timeout=self.timeout,
+                                      headers={'X-API-KEY': self.api_key})
+        response.raise_for_status()
+        return response.json()
+
+    # raw serper response for the query, from cache when we've run it before
+    def search(self, query):
+        cached = self.cache.get(query)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached
+        if self.offline:
+            raise OfflineMiss(f"Not cached: {query}")
+        response = self.limiter.call(self._post, query)
+        with self._lock:
+            self.searches += 1
+        self.cache.put(query, response)
+        return response
+
+    def stats(self):
+        return {"hits": self.hits, "searches": self.searches, "cached queries": len(self.cache)}
+
+def read_queries(file_paths):
+    queries, seen = [], set()
+    for file_path in file_paths:
+        with open(file_path, 'r') as f:
+            for line in f:
+                query = line.strip()
+                if query and normalize_query(query) not in seen:
+                    seen.add(normalize_query(query))
+                    queries.append(query)
+    return queries
+
+def organic_results(response, top_n=5):
+    results = []
+    for position, result in enumerate(response.get('organic', [])[:top_n], 1):
+        if result.get('link'):
+            results.append({"url": result['link'], "title": result.get('title', ''), "position": position})
+    return results
+
+# group each cached query's top results by label (e.g. red/blue), deduped by canonical url
+def collect_links(queries, cache, label, top_n=5):
+    links, seen, missing = {}, set(), 0
+    for query in queries:
+        response = cache.get(query)
+        if response is None:
+            missing += 1
+            continue
+        name = label(query)
+        for result in organic_results(response, top_n):
+            canonical = canonicalize_url(result['url'])
+            if (name, canonical) in seen:
+                continue
+            seen.add((name, canonical))
+            links.setdefault(name, []).append(dict(result, canonical=canonical, query=query))
+    return links, missing
+
+# <path> keeps the one-url-per-line format the ingester reads; <path minus .txt>.meta.jsonl has the metadata
+def write_links(path, links):
+    with open(path, 'w') as f:
+        for link in links:
+            f.write(link['url'] + '\n')
+    with open(os.path.splitext(path)[0] + '.meta.jsonl', 'w') as f:
+        for link in links:
+            f.write(json.dumps(link) + '\n')
@@ -0,0 +1,129 @@
+# token-budgeted chunking and map-reduce summarization for long articles
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest.bulk_writer import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+'''
+Article text is split into chunks of at most chunk_tokens (estimated at ~4 chars per token, same as the
+bulk writer), on sentence boundaries where possible. Each chunk is summarized concurrently (map), then
+the chunk summaries are combined into one prompt and summarized again (reduce). If the combined
+summaries are themselves over budget the reduce runs again over groups of them, so every prompt stays
+bounded. At most max_chunks chunks are summarized, which keeps per-article latency at roughly one map
+round plus one reduce round however long the page is. Short articles that fit in one chunk take a
+single call, exactly like before.
+'''
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+REDUCE_PROMPT = """The following are bullet point summaries of consecutive parts of one article. Merge them
+                    into a few brief bullet points, dropping duplicates and any N/A entries. If every part is N/A,
+                    respond with N/A:
+                """
+
+# split a piece that's over budget on whitespace; a single huge "word" is cut by characters
+def _split_words(text, max_chars):
+    pieces, current = [], ''
+    for word in text.split():
+        while len(word) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(word[:max_chars])
+            word = word[max_chars:]
+        if current and len(current) + 1 + len(word) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return pieces
+
+def chunk_text(text, max_tokens=1000):
+    max_chars = max_tokens * 4
+    chunks, current = [], ''
+    for sentence in SENTENCE_END.split(text.strip()):
+        pieces = [sentence] if len(sentence) <= max_chars else _split_words(sentence, max_chars)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+# group summaries so each group's combined size stays within max_tokens
+def group_texts(texts, max_tokens):
+    groups, current, tokens = [], [], 0
+    for text in texts:
+        size = estimate_tokens(text)
+        if current and tokens + size > max_tokens:
+            groups.append(current)
+            current, tokens = [], 0
+        current.append(text)
+        tokens += size
+    if current:
+        groups.append(current)
+    return groups
+
+def is_empty(summary):
+    return not summary or summary.strip().strip('.').upper() == 'N/A'
+
+class MapReduceSummarizer:
+    # call(system_message, user_message) -> str is the (rate limited) llm call; workers is shared by
+    # every article being summarized, so it bounds the total number of chunk calls in flight
+    def __init__(self, call, chunk_tokens=1000, max_chunks=8, workers=8, reduce_prompt=REDUCE_PROMPT):
+        self.call = call
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max_chunks
+        self.reduce_prompt = reduce_prompt
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summarize")
+        self.articles = 0
+        self.calls = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+
+    def _call(self, system_message, user_message):
+        with self._lock:
+            self.calls += 1
+        return self.call(system_message=system_message, user_message=user_message)
+
+    def _map(self, system_message, texts):
+        return list(self.executor.map(lambda text: self._call(system_message, text), texts))
+
+    # returns (summary, chunk summaries); the chunk summaries are empty when the article fit in one chunk
+    def summarize(self, text, prompt):
+        chunks = chunk_text(text, self.chunk_tokens)
+        with self._lock:
+            self.articles += 1
+            self.truncated += len(chunks) > self.max_chunks
+        if len(chunks) > self.max_chunks:
+            logger.info(f"Summarizing the first {self.max_chunks} of {len(chunks)} chunks")
+            chunks = chunks[:self.max_chunks]
+        if len(chunks) <= 1:
+            return self._call(prompt, chunks[0] if chunks else text), []
+
+        chunk_summaries = self._map(prompt, chunks)
+        summaries = [summary for summary in chunk_summaries if not is_empty(summary)]
+        if not summaries:
+            return 'N/A', chunk_summaries
+        return self.reduce(summaries), chunk_summaries
+
+    def reduce(self, summaries):
+        while True:
+            groups = group_texts(summaries, self.chunk_tokens)
+            if len(groups) == 1 and len(summaries) == 1:
+                return summaries[0]
+            summaries = self._map(self.reduce_prompt, ['\n\n'.join(group) for group in groups])
+            if len(groups) == 1:
+                return summaries[0]
+
+    def stats(self):
+        return {"articles": self.articles, "llm calls": self.calls, "truncated": self.truncated}
@@ -0,0 +1,101 @@
+# precompute answers (and optionally memes) for the question corpus into the answer index the server loads
+import argparse
+import asyncio
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import get_collection, RED, BLUE, ANSWER_INDEX_DIR
+from services.answer_index import AnswerIndex, collections_fingerprint
+from services.embeddings import embed_queries
+from services.response_cache import normalize_text
+from services.rag_service import retrieve_results_async, extract_contexts, generate_answers_async, generate_meme
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+'''
+Answers every distinct question in queries/queries.txt and queries/queries-v*.txt the same way
+/query/text/batch does (one embedding call and one query per collection per batch, llm calls fanned
+out), optionally generates each answer's meme, and writes services/answer_index.py's files to
+ANSWER_INDEX_DIR. The collections are fingerprinted before and after; if they changed mid-run the
+index isn't written. Rerunning is cheap for unchanged questions thanks to the llm response cache.
+
+    python precompute.py --memes
+'''
+
+def read_questions(patterns):
+    questions, seen = [], set()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'r') as f:
+                for line in f:
+                    question = line.strip()
+                    if question and normalize_text(question) not in seen:
+                        seen.add(normalize_text(question))
+                        questions.append(question)
+    return questions
+
+async def answer_batch(questions, embeddings, concurrency):
+    red_results_raw, blue_results_raw = await retrieve_results_async(embeddings)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def answer(i, question):
+        async with limit:
+            try:
+                return await generate_answers_async(question, extract_contexts(red_results_raw, blue_results_raw, i))
+            except Exception as e:
+                logger.error(f"Couldn't answer '{question}': {str(e)}")
+                return None
+
+    return await asyncio.gather(*(answer(i, question) for i, question in enumerate(questions)))
+
+def main():
+    queries_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', nargs='+', default=[os.path.join(queries_dir, 'queries.txt'),
+                                                         os.path.join(queries_dir, 'queries-v*.txt')])
+    parser.add_argument('--output', default=ANSWER_INDEX_DIR)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--concurrency', type=int, default=8, help="questions answered at once")
+    parser.add_argument('--memes', action='store_true', help="also generate each answer's meme")
+    parser.add_argument('--meme-workers', type=int, default=4)
+    parser.add_argument('--limit', type=int, help="only the first N questions")
+    args = parser.parse_args()
+
+    questions = read_questions(args.queries)[:args.limit]
+    fingerprint = collections_fingerprint(get_collection, [RED, BLUE])
+    logger.info(f"Precomputing {len(questions)} questions against {fingerprint}")
+
+    start = time.time()
+    kept_questions, answers, embeddings = [], [], []
+    for offset in range(0, len(questions), args.batch_size):
+        batch = questions[offset:offset + args.batch_size]
+        batch_embeddings = embed_queries(batch)
+        results = asyncio.run(answer_batch(batch, batch_embeddings, args.concurrency))
+        for question, embedding, result in zip(batch, batch_embeddings, results):
+            if result is not None:
+                kept_questions.append(question)
+                answers.append(result)
+                embeddings.append(embedding)
+        logger.info(f"[{time.time() - start:.0f}s] {offset + len(batch)}/{len(questions)} questions")
+
+    if args.memes:
+        def add_meme(item):
+            question, answer = item
+            meme = generate_meme(question, answer['red_response'], answer['blue_response'])
+            if meme.get('meme'):
+                answer['meme'] = meme['meme']
+        with ThreadPoolExecutor(max_workers=args.meme_workers) as pool:
+            list(pool.map(add_meme, zip(kept_questions, answers)))
+        logger.info(f"Generated {sum('meme' in answer for answer in answers)} memes")
+
+    if collections_fingerprint(get_collection, [RED, BLUE]) != fingerprint:
+        raise SystemExit("Collections changed while precomputing; run again once ingestion has finished")
+    AnswerIndex(kept_questions, answers, embeddings, fingerprint).save(args.output)
+    logger.info(f"Wrote {len(answers)}/{len(questions)} answers to {args.output} in {time.time() - start:.0f}s")
+
+if __name__ == '__main__':
+    main()
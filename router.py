@@ -1,16 +1,52 @@
-from flask import request, jsonify
-from services.rag_service import process_rag_query_text, process_rag_query_image
+from flask import request, jsonify, Response, stream_with_context, g
+from services.rag_service import (process_rag_query_text, process_rag_query_image, stream_rag_query_text, get_cache_stats,
+                                  meme_jobs, get_meme_image, process_rag_query_batch)
+from config import BATCH_MAX_QUERIES, UPSTREAM_RETRY_AFTER
+from services.jobs import job_view, job_gone, FINISHED, EVENTS_POLL_INTERVAL
+from services.sse import format_sse, SSE_HEADERS, SSE_KEEP_ALIVE
+from services import metrics, admission
 import logging
+import time
 
 logger = logging.getLogger(__name__) #instead of printing errors
 
 '''
 Define all API calls- runs/set up when server created. Routes defined for:
     - query (post): get user input and respond with RAG enhanced GPT. 
+    - query/text/stream (post): same, as server-sent events (links, token deltas, done)
+    - query/text/batch (post): answers for a list of queries in one round trip, with per-item errors
     - genImage (post): create memes based on prompt and return
+    - jobs/image (post): queue a meme and return a job id; poll jobs/<id> or stream jobs/<id>/events
+    - memes/<meme_id> (get): locally mirrored meme image, immutable and cacheable
+    - stats (get): cache hit/miss counters
+    - metrics (get): prometheus metrics; every response also carries a Server-Timing header
+The query routes go through admission control (services/admission.py): when they're saturated
+they answer 429/503 with Retry-After straight away, and a failed upstream call is a 503 as well.
 '''
 
+# the upstream calls failed or ran out of time; worth retrying
+def unavailable(message):
+    return jsonify(message), 503, {'Retry-After': str(UPSTREAM_RETRY_AFTER)}
+
 def setup_routes(app):
+    @app.before_request
+    def start_timing():
+        g.request_timer = metrics.start_request(request.path)
+
+    @app.after_request
+    def finish_timing(response):
+        timer = g.pop('request_timer', None)
+        if timer is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            response.headers['Server-Timing'] = metrics.finish_request(timer, request.method, route,
+                                                                       response.status_code)
+        return response
+
+    # turned away by admission control before doing any work
+    @app.errorhandler(admission.Rejected)
+    def rejected(e):
+        return jsonify({"error": e.reason}), e.status, {'Retry-After': str(e.retry_after)}
+
     @app.route('/query/text', methods=['POST'])
     def process_query_text():
         data = request.json
@@ -19,13 +55,55 @@ def setup_routes(app):
         if not query:
             return jsonify({"error": "No query provided"}), 400
         
-        try:
-            response = process_rag_query_text(query)
-            return jsonify(response), 200
-        except Exception as e:
-            logger.error(f"Error processing text query: {str(e)}")
-            return jsonify("Couldn't process query!"), 401
+        with admission.text_gate.admit():
+            try:
+                response = process_rag_query_text(query)
+                return jsonify(response), 200
+            except Exception as e:
+                logger.error(f"Error processing text query: {str(e)}")
+                return unavailable("Couldn't process query!")
         
+    @app.route('/query/text/batch', methods=['POST'])
+    def process_query_text_batch():
+        data = request.json
+        queries = data.get('queries')
+
+        if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+            return jsonify({"error": "No queries provided"}), 400
+        if len(queries) > BATCH_MAX_QUERIES:
+            return jsonify({"error": f"At most {BATCH_MAX_QUERIES} queries per batch"}), 400
+
+        with admission.text_gate.admit():
+            try:
+                return jsonify({"results": process_rag_query_batch(queries)}), 200
+            except Exception as e:
+                logger.error(f"Error processing batch query: {str(e)}")
+                return unavailable("Couldn't process query!")
+
+    @app.route('/query/text/stream', methods=['POST'])
+    def process_query_text_stream():
+        data = request.json
+        query = data.get('query')
+
+        if not query:
+            return jsonify({"error": "No query provided"}), 400
+
+        # the slot is held until the stream is closed, not just until this returns
+        slot = admission.text_gate.acquire()
+
+        def generate():
+            try:
+                with admission.within(slot.deadline):
+                    for event, payload in stream_rag_query_text(query):
+                        yield format_sse(event, payload)
+            except Exception as e:
+                logger.error(f"Error streaming text query: {str(e)}")
+                yield format_sse("error", {"error": "Couldn't process query!"})
+
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+        response.call_on_close(slot.release)
+        return response
+
     @app.route('/query/image', methods=['POST'])
     def process_query_image():
         data = request.json
@@ -36,9 +114,84 @@ def setup_routes(app):
         if not red_context or not blue_context:
             return jsonify({"error": "No query provided"}), 400
         
+        with admission.image_gate.admit():
+            try:
+                response = process_rag_query_image(query, red_context, blue_context)
+                # glif failed or ran out of the request's deadline
+                if response.get('meme') is None:
+                    return unavailable("Couldn't generate meme:(")
+                return jsonify(response), 200
+            except Exception as e:
+                logger.error(f"Error generating image: {str(e)}")
+                return unavailable("Couldn't generate meme:(")
+
+    @app.route('/stats', methods=['GET'])
+    def stats():
+        return jsonify(get_cache_stats()), 200
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    @app.route('/jobs/image', methods=['POST'])
+    def submit_image_job():
+        data = request.json
+        query = data.get('query')
+        red_context = data.get('red_context')
+        blue_context = data.get('blue_context')
+
+        if not red_context or not blue_context:
+            return jsonify({"error": "No query provided"}), 400
+
         try:
-            response = process_rag_query_image(query, red_context, blue_context)
-            return jsonify(response), 200
-        except Exception as e:
-            logger.error(f"Error generating image: {str(e)}")
-            return jsonify("Couldn't generate meme:("), 401
\ No newline at end of file
+            job = meme_jobs.submit(query, red_context, blue_context, data.get('callback_url'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(job_view(job)), 202, {'Location': f"/jobs/{job['id']}"}
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        job = meme_jobs.store.get(job_id)
+        if job is None:
+            return jsonify({"error": "No such job"}), 404
+        return jsonify(job_view(job)), 200
+
+    # push status changes until the job finishes; polls the store like the asgi server, so a job finished by
+    # another worker is seen as soon as it's written
+    @app.route('/jobs/<job_id>/events', methods=['GET'])
+    def job_events(job_id):
+        job = meme_jobs.store.get(job_id)
+        if job is None:
+            return jsonify({"error": "No such job"}), 404
+
+        def generate(job):
+            yield format_sse(job['status'], job_view(job))
+            last_sent = time.time()
+            while job['status'] not in FINISHED:
+                status = job['status']
+                time.sleep(EVENTS_POLL_INTERVAL)
+                job = meme_jobs.store.get(job_id)
+                if job is None:
+                    yield format_sse("gone", job_gone(job_id))
+                    return
+                if job['status'] != status:
+                    yield format_sse(job['status'], job_view(job))
+                    last_sent = time.time()
+                elif time.time() - last_sent > 15:
+                    yield SSE_KEEP_ALIVE
+                    last_sent = time.time()
+
+        return Response(stream_with_context(generate(job)), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    # meme ids are content hashes, so a given url never changes
+    @app.route('/memes/<meme_id>', methods=['GET'])
+    def get_meme(meme_id):
+        etag = f'"{meme_id}"'
+        headers = {'ETag': etag, 'Cache-Control': 'public, max-age=31536000, immutable'}
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers=headers)
+
+        data, content_type = get_meme_image(meme_id)
+        if data is None:
+            return jsonify({"error": "No such meme"}), 404
+        return Response(data, mimetype=content_type, headers=headers)
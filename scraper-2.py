@@ -1,103 +1,215 @@
-import requests
-from bs4 import BeautifulSoup
-import openai
-import os
-import json
-import time
-from dotenv import load_dotenv
-import uuid
-import chromadb
-from chromadb.config import Settings
-from octoai.text_gen import ChatMessage
-from octoai.client import OctoAI
-
-load_dotenv()
-openai.api_key = os.getenv('OPENAI_API_KEY')
-client_octo = OctoAI(api_key=os.environ['OCTO_API'])
-
-# use beautiful soup to get all p tags and extract as raw text
-def scrape_article(url):
-    response = requests.get(url, timeout=15)  # Set timeout to 15 seconds
-    response.raise_for_status()  # Raise an exception for HTTP errors
-    soup = BeautifulSoup(response.content, 'html.parser')
-    
-    # Extract the main content of the article
-    article_text = ' '.join([p.text for p in soup.find_all('p')])
-    
-    return article_text
-
-def llm_call(system_message='If there is no context, respond with N/A', user_message='Respond with N/A'):
-    time.sleep(4)
-    completion = client_octo.text_gen.create_chat_completion(
-        max_tokens=128,
-        messages=[
-            ChatMessage(content=system_message, role="system"),
-            ChatMessage(content=user_message, role="user")
-        ],
-        model="meta-llama-3.1-8b-instruct",
-        presence_penalty=0,
-        temperature=0.3, # low to be factual
-        top_p=1
-    )
-    return completion.choices[0].message.content
-
-def run_scraper(url, prompt):
-    article_text = scrape_article(url)
-    summary = llm_call(system_message=prompt, user_message=article_text)
-    return json.dumps({"summary": summary}, indent=2)
-
-if __name__ == '__main__':
-    client = chromadb.HttpClient(
-        host=os.getenv('CHROMA_HOST_IP_ADDRESS'),
-        port=8000,
-        ssl=False,
-        headers=None,
-        settings=Settings(),
-    )
-    red_collection = client.get_or_create_collection(name="Red")
-    blue_collection = client.get_or_create_collection(name="Blue")
-
-    red_prompt ="""You are a political reporter, skilled in answering questions based on the context of campaign
-                    policies. Clearly describe Donald Trump's political stances on topics covered in this article
-                    in a few brief bullet points. Do not say anything based on general knowledge. If there is no relevant information in the context, respond with N/A:
-                """
-    blue_prompt = """You are a political reporter, skilled in answering questions based on the context of campaign
-                    policies. Clearly describe Kamala Harris's political stances on topics covered in this article
-                    in a few briefbullet points. Do not say anything based on general knowledge. If there is no relevant information or link in the context, respond with N/A:
-      """
-
-    def process_links(file_path, collection, prompt):
-        with open(file_path, 'r') as f:
-            links = f.readlines()
-            for link in links:
-                link = link.strip()
-                if link:
-                    try:
-                        summary = run_scraper(url=link, prompt=prompt)
-                        if summary:
-                            collection.add(
-                                documents=[summary],
-                                metadatas={'source': link},
-                                ids=[str(uuid.uuid4())]
-                            )
-                            print(f"Added doc: {link}")
-                        else:
-                            print(f"Couldn't summarize {link}")
-                            time.sleep(10)
-                    except Exception as e:
-                        print(f"Error processing: {link}")
-                        print(f"Error: {str(e)}")
-                        print("Waiting 10s to restart")
-                        time.sleep(3) # wait a minute to restart scraping in case of API limits
-
-    print("Starting RED links")
-    # process_links('red_links.txt', red_collection, red_prompt)
-    process_links('red_links-v1.txt', red_collection, red_prompt)
-    process_links('red_links-v2.txt', red_collection, red_prompt)
-    print("FINISHED RED LINKS")
-
-    print("Starting BLUE links")
-    # process_links('blue_links.txt', blue_collection, blue_prompt)
-    process_links('blue_links-v1.txt', blue_collection, blue_prompt)
-    process_links('blue_links-v2.txt', blue_collection, blue_prompt)
-    print("FINISHED BLUE LINKS")
\ No newline at end of file
+import openai
+import os
+import json
+import logging
+from dotenv import load_dotenv
+import chromadb
+from chromadb.config import Settings
+from chromadb.utils import embedding_functions
+from octoai.text_gen import ChatMessage
+from octoai.client import OctoAI
+from ingest.pipeline import Pipeline, Stage, round_robin
+from ingest.rate_limit import AdaptiveLimiter, DomainLimiter
+from ingest.manifest import Manifest, dedupe_links, doc_id, content_hash
+from ingest.bulk_writer import BulkWriter
+from ingest.fetch_cache import FetchCache
+from ingest.extract import extract_article
+from ingest.summarize import MapReduceSummarizer, is_empty
+
+load_dotenv()
+openai.api_key = os.getenv('OPENAI_API_KEY')
+client_octo = OctoAI(api_key=os.environ['OCTO_API'])
+
+logging.basicConfig(level=logging.INFO)
+
+# concurrency and politeness settings
+FETCH_WORKERS = int(os.getenv('INGEST_FETCH_WORKERS', 16))
+SUMMARIZE_WORKERS = int(os.getenv('INGEST_SUMMARIZE_WORKERS', 8))
+PER_DOMAIN = int(os.getenv('INGEST_PER_DOMAIN', 2)) # concurrent requests per host
+DOMAIN_INTERVAL = float(os.getenv('INGEST_DOMAIN_INTERVAL', 1.0)) # seconds between requests to a host
+LLM_RATE = float(os.getenv('INGEST_LLM_RATE', 2)) # llm calls per second, halved on every 429
+
+# resumable runs: stored urls are skipped; with INGEST_REFRESH they're refetched but only
+# resummarized when the article text changed
+MANIFEST_PATH = os.getenv('INGEST_MANIFEST', 'cache/ingest_manifest.db')
+REFRESH = os.getenv('INGEST_REFRESH', 'false').lower() == 'true'
+
+# summaries are embedded and upserted in batches of up to this many docs / estimated tokens
+BATCH_DOCS = int(os.getenv('INGEST_BATCH_DOCS', 64))
+BATCH_TOKENS = int(os.getenv('INGEST_BATCH_TOKENS', 8000))
+
+# pages are cached on disk and revalidated with conditional GETs; INGEST_OFFLINE serves only from cache
+FETCH_CACHE_DIR = os.getenv('INGEST_FETCH_CACHE', 'cache/fetch')
+OFFLINE = os.getenv('INGEST_OFFLINE', 'false').lower() == 'true'
+FETCH_MAX_AGE = float(os.getenv('INGEST_FETCH_MAX_AGE', 0)) # seconds a page is used without revalidating
+
+# article text extractor (stream, strainer or soup, see ingest/extract.py) and its output cap
+EXTRACTOR = os.getenv('INGEST_EXTRACTOR', 'stream')
+MAX_ARTICLE_CHARS = int(os.getenv('INGEST_MAX_ARTICLE_CHARS', 20000))
+
+# long articles are split into chunks of this many (estimated) tokens, summarized concurrently and the
+# summaries merged; INGEST_INDEX_CHUNKS also stores each chunk summary as its own document
+CHUNK_TOKENS = int(os.getenv('INGEST_CHUNK_TOKENS', 1000))
+MAX_CHUNKS = int(os.getenv('INGEST_MAX_CHUNKS', 8))
+CHUNK_WORKERS = int(os.getenv('INGEST_CHUNK_WORKERS', 16))
+INDEX_CHUNKS = os.getenv('INGEST_INDEX_CHUNKS', 'false').lower() == 'true'
+
+domain_limiter = DomainLimiter(PER_DOMAIN, DOMAIN_INTERVAL)
+fetch_cache = FetchCache(FETCH_CACHE_DIR, offline=OFFLINE, max_age=FETCH_MAX_AGE, timeout=15, pool_size=PER_DOMAIN)
+llm_limiter = AdaptiveLimiter(LLM_RATE)
+manifest = Manifest(MANIFEST_PATH)
+
+# get all p tags and extract as raw text, without nav/cookie/newsletter boilerplate
+def scrape_article(url):
+    content = fetch_cache.fetch(url)  # cached, 15 second timeout, raises for HTTP errors
+    return extract_article(content, EXTRACTOR, MAX_ARTICLE_CHARS)
+
+def llm_call(system_message='If there is no context, respond with N/A', user_message='Respond with N/A'):
+    completion = client_octo.text_gen.create_chat_completion(
+        max_tokens=128,
+        messages=[
+            ChatMessage(content=system_message, role="system"),
+            ChatMessage(content=user_message, role="user")
+        ],
+        model="meta-llama-3.1-8b-instruct",
+        presence_penalty=0,
+        temperature=0.3, # low to be factual
+        top_p=1
+    )
+    return completion.choices[0].message.content
+
+# every llm call goes through the shared limiter so chunk calls back off on 429s too
+def limited_llm_call(system_message, user_message):
+    return llm_limiter.call(llm_call, system_message=system_message, user_message=user_message)
+
+summarizer = MapReduceSummarizer(limited_llm_call, CHUNK_TOKENS, MAX_CHUNKS, CHUNK_WORKERS)
+
+def run_scraper(url, prompt):
+    article_text = scrape_article(url)
+    summary, _ = summarizer.summarize(article_text, prompt)
+    return json.dumps({"summary": summary}, indent=2)
+
+# pipeline stages: each takes the item dict and returns it (with more filled in), or None to drop it
+def fetch_stage(item):
+    if OFFLINE:
+        item['text'] = scrape_article(item['url'])
+    else:
+        with domain_limiter.slot(item['url']):
+            item['text'] = scrape_article(item['url'])
+    if not item['text'].strip():
+        manifest.mark(item['source']['name'], item['canonical'], 'skipped', error='No article text')
+        return None
+
+    # unchanged since it was last stored: nothing to summarize or embed
+    item['content_hash'] = content_hash(item['text'])
+    previous = manifest.get(item['source']['name'], item['canonical'])
+    if previous and previous['status'] == 'stored' and previous['content_hash'] == item['content_hash']:
+        return None
+    return item
+
+def summarize_stage(item):
+    summary, chunk_summaries = summarizer.summarize(item['text'], item['source']['prompt'])
+    if not summary:
+        return None
+    item['summary'] = json.dumps({"summary": summary}, indent=2)
+    item['chunk_summaries'] = chunk_summaries
+    return item
+
+# hand the summary to its collection's bulk writer; the manifest is updated once the batch lands
+def store_stage(item):
+    item['doc_id'] = doc_id(item['canonical'])
+    writer = item['source']['writer']
+    if INDEX_CHUNKS:
+        # drop chunk documents from an earlier version of the article, which may have had more chunks
+        if REFRESH:
+            writer.collection.delete(where={'parent': item['doc_id']})
+        for i, chunk_summary in enumerate(item['chunk_summaries']):
+            if not is_empty(chunk_summary):
+                metadata = {'source': item['url'], 'parent': item['doc_id'], 'chunk': i}
+                writer.add(f"{item['doc_id']}-c{i}", json.dumps({"summary": chunk_summary}, indent=2), metadata)
+    writer.add(item['doc_id'], item['summary'], {'source': item['url']}, item)
+    return item
+
+# chunk documents are added without an item, so only the article summary updates the manifest
+def mark_stored(items):
+    for item in items:
+        if item is not None:
+            manifest.mark(item['source']['name'], item['canonical'], 'stored', item['content_hash'], item['doc_id'])
+
+def mark_failed(item, error):
+    if item is None:
+        return
+    manifest.mark(item['source']['name'], item['canonical'], 'failed', error=str(error))
+
+# canonicalize and dedupe a source's links, leaving out anything a previous run already stored
+def pending_items(source, links):
+    items = []
+    for canonical, link in dedupe_links(links):
+        previous = manifest.get(source['name'], canonical)
+        if previous and previous['status'] == 'stored' and not REFRESH:
+            continue
+        items.append({"source": source, "url": link, "canonical": canonical})
+    return items
+
+def read_links(file_paths):
+    links = []
+    for file_path in file_paths:
+        with open(file_path, 'r') as f:
+            links.extend(link.strip() for link in f if link.strip())
+    return links
+
+if __name__ == '__main__':
+    client = chromadb.HttpClient(
+        host=os.getenv('CHROMA_HOST_IP_ADDRESS'),
+        port=8000,
+        ssl=False,
+        headers=None,
+        settings=Settings(),
+    )
+    embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    red_collection = client.get_or_create_collection(name="Red", embedding_function=embedding_function)
+    blue_collection = client.get_or_create_collection(name="Blue", embedding_function=embedding_function)
+
+    red_prompt ="""You are a political reporter, skilled in answering questions based on the context of campaign
+                    policies. Clearly describe Donald Trump's political stances on topics covered in this article
+                    in a few brief bullet points. Do not say anything based on general knowledge. If there is no relevant information in the context, respond with N/A:
+                """
+    blue_prompt = """You are a political reporter, skilled in answering questions based on the context of campaign
+                    policies. Clearly describe Kamala Harris's political stances on topics covered in this article
+                    in a few briefbullet points. Do not say anything based on general knowledge. If there is no relevant information or link in the context, respond with N/A:
+      """
+
+    # red and blue links go through one pipeline, interleaved, so both collections fill at once
+    def writer(collection):
+        return BulkWriter(collection, embedding_function, BATCH_DOCS, BATCH_TOKENS,
+                          on_written=mark_stored, on_failed=mark_failed)
+
+    red = {"name": "Red", "writer": writer(red_collection), "prompt": red_prompt}
+    blue = {"name": "Blue", "writer": writer(blue_collection), "prompt": blue_prompt}
+    queries_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries')
+    red_links = read_links([os.path.join(queries_dir, f) for f in ('red_links-v1.txt', 'red_links-v2.txt')])
+    blue_links = read_links([os.path.join(queries_dir, f) for f in ('blue_links-v1.txt', 'blue_links-v2.txt')])
+
+    # collections from before ids were derived from urls: move their rows to doc ids first
+    for source, collection in ((red, red_collection), (blue, blue_collection)):
+        migrated = manifest.migrate_collection(source['name'], collection)
+        if migrated['rewritten'] or migrated['deleted']:
+            print(f"Migrated {source['name']}: {json.dumps(migrated)}")
+
+    red_items = pending_items(red, red_links)
+    blue_items = pending_items(blue, blue_links)
+
+    pipeline = Pipeline([
+        Stage("fetch", fetch_stage, FETCH_WORKERS, on_error=mark_failed),
+        Stage("summarize", summarize_stage, SUMMARIZE_WORKERS, on_error=mark_failed),
+        Stage("store", store_stage, 2, on_error=mark_failed)
+    ])
+    print(f"Starting {len(red_items)}/{len(red_links)} RED and {len(blue_items)}/{len(blue_links)} BLUE links")
+    stats = pipeline.run(round_robin(red_items, blue_items))
+    for source in (red, blue):
+        source['writer'].flush()
+        stats[f"{source['name']} writes"] = source['writer'].stats()
+    stats["summarizer"] = summarizer.stats()
+    stats["fetch cache"] = fetch_cache.stats()
+    print(f"FINISHED: {json.dumps(stats, indent=2)}")
+    print(f"Manifest: {json.dumps(manifest.counts(), indent=2)}")
@@ -1,12 +1,14 @@
 import os
 import json
 import re
-import requests
 
 from crewai import Agent, Task, Crew, Process #TODO: run with a different venv
 from crewai_tools import SerperDevTool
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from ingest.pipeline import Pipeline, Stage
+from ingest.rate_limit import AdaptiveLimiter
+from ingest.search import SearchCache, SerperClient, read_queries, collect_links, write_links
 
 import uuid
 
@@ -32,10 +34,17 @@ os.environ['SERPER_API_KEY'] = os.getenv('SERPER_API_KEY')
 # Initialize the tool for internet searching capabilities
 search_tool = SerperDevTool(api_key=os.getenv('SERPER_API_KEY'))
 
-#querys to scrape from google
-queries = [
-    "Joe Biden 2024 economic policies",
-]
+# search settings: query files to run, concurrency, serper calls per second (halved on every 429),
+# raw response cache; SEARCH_OFFLINE rebuilds the link files from the cache without any requests
+SEARCH_QUERIES = os.getenv('SEARCH_QUERIES', 'queries.txt').split(',')
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', 8))
+SEARCH_RATE = float(os.getenv('SEARCH_RATE', 5))
+SEARCH_CACHE_DIR = os.getenv('SEARCH_CACHE', 'cache/serper')
+SEARCH_OFFLINE = os.getenv('SEARCH_OFFLINE', 'false').lower() == 'true'
+SEARCH_TOP_N = int(os.getenv('SEARCH_TOP_N', 5))
+
+serper_client = SerperClient(os.getenv('SERPER_API_KEY'), SearchCache(SEARCH_CACHE_DIR), AdaptiveLimiter(SEARCH_RATE),
+                             offline=SEARCH_OFFLINE, pool_size=SEARCH_WORKERS)
 
 # agent to summarize info from articles parsed online
 writer_agent = Agent(
@@ -50,28 +59,10 @@ writer_agent = Agent(
     # tools=[search_tool] # uses serper to search internet for answers
 )
 
-# get raw api results for online query to google- gets top 10 results 
-def get_serper_api_results(prompt):
-    url = "https://google.serper.dev/search" #TODO: get title too
-    payload = json.dumps({"q": prompt})
-    headers = {
-        'X-API-KEY': os.getenv('SERPER_API_KEY'),
-        'Content-Type': 'application/json'
-    }
-    response = requests.request("POST", url, headers=headers, data=payload)
-    
-    if response.status_code != 200:
-        print(f"Error: Received status code {response.status_code}")
-        print(f"Response body: {response.text}")
-        return None
-    
-    return response.json()
-
-# metadata to include sources for vector db; generate links to scrape
-def get_top_5_links_with_metadata(response_data):
-    organic_results = response_data.get('organic', []) # TODO: get title as well
-    top_5_links = [result.get('link', '') for result in organic_results[:5]]
-    return top_5_links 
+# pipeline stage: run one query, cached responses cost nothing
+def search_stage(item):
+    item['response'] = serper_client.search(item['query'])
+    return item
 
 # use agent(s) created before. runs faster without delegation agent
 def get_summary(query):
@@ -128,59 +119,25 @@ if __name__ == '__main__':
     # red_collection = client.create_collection(name="Red")
     
     '''
-    process data by reading queries generated by gpt to scrape internet for relevant info. run serper tool to 
-    get links and agents to summarize articles, creating entries with question-summary answer pairs and sources 
-    for each.
+    process data by reading queries generated by gpt to scrape internet for relevant info. run serper tool
+    (concurrently, skipping queries already in the search cache) to get links, then rebuild the link files
+    for each candidate from the cache, deduped, with titles kept alongside in .meta.jsonl files.
     '''
-    red_links = [] 
-    blue_links = []
-    test = 3
-    with open('queries.txt', 'r') as file:
-        for line in file:
-            if test == 0:
-                break
-            test -= 1
-            query = str(line.strip())
-            if query: 
-                try:
-                    response_data = get_serper_api_results(query)
-                    summary = get_summary(query)
-                    candidate = extract_info_from_query(query)
-
-                    # document = {
-                    #     "query": query,
-                    #     "summary": summary,
-                    # }
-                    top_5_links = get_top_5_links_with_metadata(response_data)
-                except Exception as e:
-                    print(f"Error during function calls: {e}")
-
-                try:
-                    # TODO: Use custom embed class.
-                    if candidate == "Donald Trump":
-                        # red_collection.upsert(
-                        #     documents=[str(document)],
-                        #     metadatas={'source': top_5_links[0]},
-                        #     ids=[str(uuid.uuid4())]
-                        # )
-                        red_links.extend(top_5_links)
-                        print("Added red doc")
-                    else:
-                        # blue_collection.upsert(
-                        #     documents=[str(document)],
-                        #     metadatas={'source': top_5_links[0]},
-                        #     ids=[str(uuid.uuid4())]  # must be unique ids
-                        # )
-                        blue_links.extend(top_5_links)
-                        print("Added blue doc")
-                except Exception as e:
-                    print(f"Error adding document to the database: {e}")
-
-    # Write all the links to a new text file
-    with open('blue_links.txt', 'w') as file:
-        for link in blue_links:
-            file.write(link + '\n')
-
-    with open('red_links.txt', 'w') as file:
-        for link in red_links:
-            file.write(link + '\n')
\ No newline at end of file
+    queries = read_queries(SEARCH_QUERIES)
+    if not SEARCH_OFFLINE:
+        pipeline = Pipeline([Stage("search", search_stage, SEARCH_WORKERS)])
+        stats = pipeline.run({"query": query} for query in queries)
+        stats["search"] = serper_client.stats()
+        print(f"Searched: {json.dumps(stats, indent=2)}")
+
+    def label(query):
+        return 'red' if extract_info_from_query(query) == "Donald Trump" else 'blue'
+
+    links, missing = collect_links(queries, serper_client.cache, label, SEARCH_TOP_N)
+    if missing:
+        print(f"{missing} of {len(queries)} queries aren't in the search cache")
+
+    # Write all the links to new text files
+    for name in ('red', 'blue'):
+        write_links(f'{name}_links.txt', links.get(name, []))
+        print(f"Wrote {len(links.get(name, []))} {name} links")
@@ -1,11 +1,20 @@
+from services import startup
+# record import cost per module for the startup report (GET /stats)
+startup.timed_imports('flask', 'flask_cors', 'chromadb', 'numpy', 'octoai.client', 'config', 'services.rag_service', 'router')
+
 from flask import Flask
 from flask_cors import CORS
 from router import setup_routes
+from config import WARM_UP
+from services.rag_service import warm_up, meme_jobs
+import os
+import threading
 
 '''
 Create and run server on AWS Lambda, since we don't expect much traffic.
 logging flask_cors octoai
 chromadb==0.4.14 asyncio dotenv
+For high-concurrency deployments, serve asgi_server.py with uvicorn instead.
 '''
 
 def create_app():
@@ -13,15 +22,24 @@ def create_app():
     CORS(app)
     
     setup_routes(app)
+
+    # resume meme jobs left behind by processes that died
+    meme_jobs.start()
+
+    # connect to chroma/octo off the request path; requests before it finishes connect lazily
+    if WARM_UP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
     
     return app
 
 app = create_app()
 
-# Uncomment the following if you decide to deploy on AWS Lambda
+# Uncomment the following if you decide to deploy on AWS Lambda. Set WARM_UP=false and call
+# warm_up() here instead, so the work happens in the init phase rather than a first request
+# warm_up()
 # def lambda_handler(event, context):
 #     return awsgi.response(app, event, context, base64_content_types={"image/png"})
 
 if __name__ == '__main__':
     # Ensure the app listens on all interfaces and port 8080, as required by AWS App Runner
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    app.run(host='0.0.0.0', port=8080, debug=os.getenv('FLASK_DEBUG', 'false').lower() == 'true')
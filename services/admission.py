@@ -0,0 +1,228 @@
+# admission control for the query routes: bounded concurrency and queues per route group, and a
+# per-request deadline that the upstream calls made for the request are cut to
+import asyncio
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+import contextvars
+import math
+import threading
+import time
+
+from config import TEXT_CONCURRENCY, TEXT_QUEUE, TEXT_DEADLINE, IMAGE_CONCURRENCY, IMAGE_QUEUE, IMAGE_DEADLINE
+from services import metrics
+
+'''
+Each gate lets `limit` requests run at once; up to `queue_size` more wait for a slot in arrival order,
+and anything beyond that is turned away straight away with 429. A request's deadline starts when it
+arrives, so queueing eats into it: if the expected wait (its queue position over the limit, times the
+recent average time a request holds a slot) would already take it past the deadline it gets 503
+instead of queueing, and a request still queued at its deadline gets 503 too. Both carry a
+Retry-After of the expected wait. Handlers run with the deadline in a contextvar; remaining() cuts
+the chroma/octo/embedding waits in rag_service to it and glif gets it as its deadline, so a slow
+upstream can't hold a slot past the deadline either. Gates work from threads (flask) and coroutines
+(asgi) alike.
+'''
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+# epoch deadline of the current request, or None outside one
+def deadline():
+    return _deadline.get()
+
+# run the block (and the tasks and run_blocking calls it starts) under a deadline
+@contextmanager
+def within(deadline):
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+# timeout for a call made now: the given one, cut to what's left of the request's deadline
+def remaining(timeout=None):
+    current = _deadline.get()
+    if current is None:
+        return timeout
+    left = current - time.time()
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline passed")
+    return left if timeout is None else min(timeout, left)
+
+# a queued request: woken by an event (thread) or a future on its event loop (coroutine)
+class _Waiter:
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+class Slot:
+    def __init__(self, gate, deadline):
+        self.gate = gate
+        self.deadline = deadline
+        self.start = time.time()
+        self._released = False
+
+    # safe to call more than once
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.gate._release(time.time() - self.start)
+
+class Gate:
+    def __init__(self, name, limit, queue_size, deadline):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.active = 0
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "deadline": 0, "timeout": 0}
+        self.avg_seconds = None # moving average of time a slot is held
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _reject(self, reason, status, message, wait):
+        self.shed[reason] += 1
+        return Rejected(status, message, max(1, math.ceil(wait or 1)))
+
+    # take a free slot (returns None) or join the queue (returns the waiter); raises Rejected
+    def _enter(self, deadline, loop=None):
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return None
+            position = len(self._waiters) + 1
+            wait = None if self.avg_seconds is None else math.ceil(position / self.limit) * self.avg_seconds
+            if len(self._waiters) >= self.queue_size:
+                raise self._reject("queue_full", 429, "Too many requests, try again later", wait)
+            if wait is not None and time.time() + wait > deadline:
+                raise self._reject("deadline", 503, "Server busy, try again later", wait)
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            return waiter
+
+    # a waiter stopped waiting: True if it left the queue, False if it was handed a slot meanwhile
+    def _leave(self, waiter, timed_out):
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                return False
+            if timed_out:
+                self.shed["timeout"] += 1
+            return True
+
+    # free a slot, handing it straight to the longest waiting request
+    def _release(self, held=None):
+        with self._lock:
+            if held is not None:
+                self.avg_seconds = held if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * held
+            if not self._waiters:
+                self.active -= 1
+                return
+            waiter = self._waiters.popleft()
+            self.admitted += 1
+        waiter.grant()
+
+    def _timed_out(self):
+        with self._lock:
+            wait = self.avg_seconds
+        return Rejected(503, "Server busy, try again later", max(1, math.ceil(wait or 1)))
+
+    # blocking version, for code running in threads
+    def acquire(self):
+        deadline = time.time() + self.deadline
+        waiter = self._enter(deadline)
+        if waiter is not None and not waiter.event.wait(max(deadline - time.time(), 0)):
+            if self._leave(waiter, timed_out=True):
+                raise self._timed_out()
+        return Slot(self, deadline)
+
+    async def acquire_async(self):
+        deadline = time.time() + self.deadline
+        waiter = self._enter(deadline, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                if self._leave(waiter, timed_out=True):
+                    raise self._timed_out()
+            except asyncio.CancelledError:
+                if not self._leave(waiter, timed_out=False):
+                    self._release()
+                raise
+        return Slot(self, deadline)
+
+    # hold a slot for the block, with the request's deadline set
+    @contextmanager
+    def admit(self):
+        slot = self.acquire()
+        try:
+            with within(slot.deadline):
+                yield slot
+        finally:
+            slot.release()
+
+    @asynccontextmanager
+    async def admit_async(self):
+        slot = await self.acquire_async()
+        try:
+            with within(slot.deadline):
+                yield slot
+        finally:
+            slot.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "queued": len(self._waiters),
+                "queue_size": self.queue_size,
+                "deadline": self.deadline,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "avg_seconds": None if self.avg_seconds is None else round(self.avg_seconds, 3)
+            }
+
+text_gate = Gate("text", TEXT_CONCURRENCY, TEXT_QUEUE, TEXT_DEADLINE)
+image_gate = Gate("image", IMAGE_CONCURRENCY, IMAGE_QUEUE, IMAGE_DEADLINE)
+gates = (text_gate, image_gate)
+
+def stats():
+    return {gate.name: gate.stats() for gate in gates}
+
+# queue depth and shed counts for /metrics
+def admission_metrics():
+    current = stats()
+    return [
+        ("rag_admission_active", "gauge", "Requests holding a slot",
+         [((("gate", name),), s["active"]) for name, s in current.items()]),
+        ("rag_admission_queued", "gauge", "Requests waiting for a slot",
+         [((("gate", name),), s["queued"]) for name, s in current.items()]),
+        ("rag_admission_shed_total", "counter", "Requests turned away with 429/503",
+         [((("gate", name), ("reason", reason)), count) for name, s in current.items() for reason, count in s["shed"].items()])
+    ]
+
+metrics.register_collector(admission_metrics)
@@ -0,0 +1,201 @@
+# precomputed answers for the known question corpus (built by precompute.py), served without upstream calls
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from services.local_index import normalize_rows, collection_version
+from services.files import atomic_write
+from services.response_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+'''
+The index is <dir>/answers.npy (unit-length float32 question embeddings, memory-mapped on load) and
+<dir>/answers.json: format version, when it was built, the collection fingerprint it was built
+against, and per question its text and the answer (responses, links, and the meme url when one was
+pregenerated). A question is answered by exact normalized match, else by its nearest
+neighbour if the cosine similarity clears the threshold.
+
+The fingerprint is each collection's content hash (ids, documents and metadata; see local_index), so
+refresh ingests that re-summarize an article in place invalidate it as well as new or removed rows.
+The server only answers from the index once the live collections have been checked against it,
+and re-checks every check_interval seconds, so re-ingesting stops it serving until precompute.py
+is run again. A check that finds the collections changed reloads the files if they were rebuilt
+since, so the server picks up the new index without a restart; with no index at startup the files
+are looked for every few seconds until precompute.py writes one.
+'''
+
+FORMAT = 1
+
+# what /query/text returns; a stored answer may also carry its meme
+TEXT_KEYS = ("blue_response", "red_response", "blue_link", "red_link")
+
+def collections_fingerprint(get_collection, names):
+    return {name: collection_version(get_collection(name)) for name in names}
+
+class AnswerIndex:
+    def __init__(self, questions, answers, embeddings, fingerprint, built_at=None):
+        self.questions = questions
+        self.answers = answers
+        self.embeddings = embeddings
+        self.fingerprint = fingerprint
+        self.built_at = built_at or time.time()
+        self._positions = {normalize_text(question): i for i, question in enumerate(questions)}
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, 'answers')
+        with atomic_write(f"{base}.npy") as f:
+            np.save(f, normalize_rows(self.embeddings))
+        meta = {
+            "format": FORMAT,
+            "built_at": self.built_at,
+            "fingerprint": self.fingerprint,
+            "questions": self.questions,
+            "answers": self.answers
+        }
+        with atomic_write(f"{base}.json") as f:
+            f.write(json.dumps(meta).encode('utf-8'))
+
+    @classmethod
+    def load(cls, directory):
+        base = os.path.join(directory, 'answers')
+        with open(f"{base}.json", 'r') as f:
+            meta = json.load(f)
+        if meta.get('format') != FORMAT:
+            raise ValueError(f"Answer index format {meta.get('format')} isn't supported")
+        embeddings = np.load(f"{base}.npy", mmap_mode='r')
+        if embeddings.shape[0] != len(meta['questions']):
+            raise ValueError("Answer index is inconsistent")
+        return cls(meta['questions'], meta['answers'], embeddings, meta['fingerprint'], meta['built_at'])
+
+    def exact(self, query):
+        i = self._positions.get(normalize_text(query))
+        return None if i is None else self.answers[i]
+
+    def nearest(self, embedding, threshold):
+        if len(self.questions) == 0:
+            return None
+        scores = self.embeddings @ normalize_rows(embedding)
+        best = int(np.argmax(scores))
+        return self.answers[best] if scores[best] >= threshold else None
+
+# loads the index at startup (no network) and only serves it once, and while, it matches the live collections
+class AnswerIndexLoader:
+    def __init__(self, directory, names, get_collection, threshold=0.95, check_interval=300):
+        self.directory = directory
+        self.names = names
+        self.get_collection = get_collection
+        self.threshold = threshold
+        self.check_interval = check_interval
+        self.index = None
+        self.valid = False
+        self.exact_hits = 0
+        self.nearest_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    # the check thread starts even without an index, so one precompute.py writes later is picked up
+    def start(self):
+        try:
+            self.index = AnswerIndex.load(self.directory)
+            logger.info(f"Loaded answer index with {len(self.index.questions)} answers")
+        except FileNotFoundError:
+            logger.info(f"No answer index in {self.directory} yet")
+        except Exception as e:
+            logger.warning(f"Couldn't load answer index: {str(e)}")
+        threading.Thread(target=self._run, name="answer-index-check", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    # the first check runs here too, so loading never waits on chroma; until it passes nothing is served,
+    # and it's retried every few seconds while chroma can't be reached or there's no index yet
+    def _run(self):
+        while not self._stop.is_set():
+            checked = self.check()
+            self._stop.wait(self.check_interval if checked else min(self.check_interval, 5))
+
+    # compare the index's fingerprint with the live collections, reloading the files first if they no
+    # longer match and precompute.py has rebuilt them; keep the last verdict if chroma is down. returns
+    # whether the comparison could be made
+    def check(self):
+        if self.index is None:
+            self._reload()
+            if self.index is None:
+                return False
+        try:
+            current = collections_fingerprint(self.get_collection, self.names)
+        except Exception as e:
+            logger.error(f"Error checking answer index: {str(e)}")
+            return False
+        if current != self.index.fingerprint:
+            self._reload()
+        valid = current == self.index.fingerprint
+        if self.valid and not valid:
+            logger.warning(f"Collections changed ({self.index.fingerprint} -> {current}), answer index disabled")
+        elif valid and not self.valid:
+            logger.info("Answer index matches the collections, serving it")
+        self.valid = valid
+        return True
+
+    # swap in the index on disk if it's new or was rebuilt; a half-written or unreadable one is ignored until the
+    # next check
+    def _reload(self):
+        try:
+            index = AnswerIndex.load(self.directory)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Couldn't reload answer index: {str(e)}")
+            return
+        if (self.index is None or index.built_at != self.index.built_at
+                or index.fingerprint != self.index.fingerprint):
+            logger.info(f"Loaded answer index with {len(index.questions)} answers")
+            self.index = index
+
+    def _count(self, answer, counter):
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                setattr(self, counter, getattr(self, counter) + 1)
+        return answer
+
+    # text answer for the question (exact match, else nearest neighbour), or None
+    def lookup(self, query, embedding):
+        if not self.valid:
+            return None
+        answer = self.index.exact(query)
+        if answer is not None:
+            self._count(answer, 'exact_hits')
+        else:
+            answer = self._count(self.index.nearest(embedding, self.threshold), 'nearest_hits')
+        return {key: answer[key] for key in TEXT_KEYS} if answer is not None else None
+
+    # a pregenerated meme, if the texts are the ones the index answered the question with
+    def meme(self, query, red_response, blue_response):
+        # /query/image and meme jobs don't require a query, and the index only has answers for questions
+        if not query:
+            return None
+        answer = self.index.exact(query) if self.valid else None
+        if (answer is None or not answer.get('meme') or answer['red_response'] != red_response
+                or answer['blue_response'] != blue_response):
+            return None
+        return {"meme": answer['meme']}
+
+    def stats(self):
+        return {
+            "answers": len(self.index.questions) if self.index else 0,
+            "valid": self.valid,
+            "built_at": self.index.built_at if self.index else None,
+            "hits": self.exact_hits + self.nearest_hits,
+            "exact_hits": self.exact_hits,
+            "nearest_hits": self.nearest_hits,
+            "misses": self.misses
+        }
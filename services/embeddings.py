@@ -0,0 +1,70 @@
+# embed user queries once per request, and remember vectors for repeated questions
+from config import get_embedding_function, EMBED_CACHE_SIZE
+from services.metrics import span
+from services.response_cache import normalize_text
+from collections import OrderedDict
+import threading
+
+
+# thread-safe LRU of normalized query text -> embedding, with hit/miss counters
+class EmbeddingCache:
+    def __init__(self, maxsize=EMBED_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._vectors.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, key, vector):
+        with self._lock:
+            self._vectors[key] = vector
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.maxsize:
+                self._vectors.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._vectors),
+                "maxsize": self.maxsize
+            }
+
+embedding_cache = EmbeddingCache()
+
+# the same key the llm cache and single-flight use (case, whitespace and trailing punctuation folded), so
+# questions that share an answer also share a vector
+def normalize_query(query):
+    return normalize_text(query)
+
+# embed a batch of queries, only sending cache misses to the model (in one call). a miss embeds the first
+# spelling seen for its key, with whitespace collapsed, rather than the folded key itself
+def embed_queries(queries):
+    keys = [normalize_query(query) for query in queries]
+    texts = {}
+    for key, query in zip(keys, queries):
+        texts.setdefault(key, ' '.join(query.split()))
+    vectors = {key: embedding_cache.get(key) for key in texts}
+    missing = [key for key, vector in vectors.items() if vector is None]
+    if missing:
+        with span("embed_model", upstream="embedding"):
+            computed = get_embedding_function()([texts[key] for key in missing])
+        for key, vector in zip(missing, computed):
+            vector = [float(x) for x in vector]
+            embedding_cache.put(key, vector)
+            vectors[key] = vector
+    return [vectors[key] for key in keys]
+
+def embed_query(query):
+    return embed_queries([query])[0]
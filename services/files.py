@@ -0,0 +1,17 @@
+# file helpers shared by the caches and indexes that write to disk
+from contextlib import contextmanager
+import os
+import tempfile
+
+# write path through a temp file in the same directory: readers never see a half-written file, and
+# the temp name is unique, so threads or server workers writing the same path don't trip over each other
+@contextmanager
+def atomic_write(path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,207 @@
+# glif simple-api client: one pooled keep-alive session, per-key circuit breakers, optional hedging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import logging
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+'''
+Keys are tried in order, skipping any whose breaker is open. A key's breaker opens after
+failure_threshold consecutive failures (connection errors, timeouts, 5xx), or right away when the
+problem is the key itself: a 401/402/429, or an error body about credits or the key. It closes again
+after cooldown seconds. A read timeout that was shortened to the caller's deadline doesn't count
+either way. Any other error body (or a response without an output) means the workflow
+failed on these inputs; that doesn't count against the key and isn't retried on another key, since
+every key would fail the same way. With hedge_after set, a request that hasn't answered within that
+many seconds gets a second key racing it; the first success wins.
+'''
+
+# responses that mean this key can't be used right now
+KEY_STATUSES = {401, 402, 429}
+KEY_ERROR = re.compile(r'credit|quota|balance|unauthori[sz]ed|invalid (api )?(key|token)', re.I)
+
+class GlifError(Exception):
+    pass
+
+# the key is out of credits, rate limited or rejected
+class GlifKeyError(GlifError):
+    pass
+
+# glif ran but failed on these inputs
+class GlifInputError(GlifError):
+    pass
+
+class KeyState:
+    def __init__(self, name, api_key):
+        self.name = name
+        self.api_key = api_key
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.successes = 0
+        self.failures = 0
+        self.input_errors = 0
+        self.cut_short = 0
+        self.latency_total = 0.0
+
+    def available(self, now):
+        return self.open_until <= now
+
+    def stats(self, now):
+        calls = self.successes + self.failures + self.input_errors + self.cut_short
+        return {
+            "state": "closed" if self.available(now) else "open",
+            "successes": self.successes,
+            "failures": self.failures,
+            "input_errors": self.input_errors,
+            "cut_short": self.cut_short,
+            "avg_latency": self.latency_total / calls if calls else None
+        }
+
+class GlifClient:
+    def __init__(self, api_keys, glif_id, url="https://simple-api.glif.app", connect_timeout=3, read_timeout=90,
+                 failure_threshold=3, cooldown=600, hedge_after=None, pool_size=16):
+        self.glif_id = glif_id
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.failovers = 0
+        self.hedges = 0
+        self.keys = [KeyState(f"key_{i + 1}", key) for i, key in enumerate(api_keys) if key]
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="glif")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # ok=None: an input error, or a timeout the caller's deadline cut short (cut_short), neither of which
+    # says anything about the key's health
+    def _record(self, key, ok, latency, trip=False, cut_short=False):
+        with self._lock:
+            key.latency_total += latency
+            if ok is None:
+                if cut_short:
+                    key.cut_short += 1
+                else:
+                    key.input_errors += 1
+                return
+            if ok:
+                key.successes += 1
+                key.consecutive_failures = 0
+                return
+            key.failures += 1
+            key.consecutive_failures += 1
+            if trip or key.consecutive_failures >= self.failure_threshold:
+                key.open_until = time.time() + self.cooldown
+                logger.warning(f"Glif {key.name} disabled for {self.cooldown}s")
+
+    # one request with one key; returns the image url or raises GlifError
+    def _attempt(self, key, payload, deadline):
+        read_timeout = self.read_timeout
+        if deadline is not None:
+            read_timeout = min(read_timeout, max(deadline - time.time(), 0.1))
+        start = time.perf_counter()
+        try:
+            with metrics.span(f"glif_{key.name}", upstream="glif"):
+                response = self.session.post(
+                    self.url,
+                    json=payload,
+                    headers={"Authorization": f"Bearer {key.api_key}"},
+                    timeout=(self.connect_timeout, read_timeout)
+                )
+                if response.status_code in KEY_STATUSES:
+                    raise GlifKeyError(f"Glif rejected {key.name}: HTTP {response.status_code}")
+                response.raise_for_status()
+                response_json = response.json()
+                error = response_json.get('error')
+                if error and KEY_ERROR.search(str(error)):
+                    raise GlifKeyError(f"Glif rejected {key.name}: {error}")
+                if error or not response_json.get('output'):
+                    raise GlifInputError(f"Glif couldn't generate with {key.name}: {error or 'no output'}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            # a read timeout shorter than the key's own only means the caller ran out of time
+            if isinstance(e, requests.exceptions.ReadTimeout) and read_timeout < self.read_timeout:
+                self._record(key, None, time.perf_counter() - start, cut_short=True)
+            else:
+                self._record(key, False, time.perf_counter() - start)
+            raise GlifError(f"Glif request failed with {key.name}: {e}")
+        except GlifKeyError:
+            self._record(key, False, time.perf_counter() - start, trip=True)
+            raise
+        except GlifInputError:
+            self._record(key, None, time.perf_counter() - start)
+            raise
+        self._record(key, True, time.perf_counter() - start)
+        return response_json['output']
+
+    # image url for the inputs, or None if every usable key failed or the deadline passed
+    def generate(self, context, query, deadline=None):
+        payload = {"id": self.glif_id, "inputs": {"context": context, "query": query}}
+        now = time.time()
+        candidates = iter([key for key in self.keys if key.available(now)])
+        pending = set()
+
+        def launch():
+            key = next(candidates, None)
+            if key is None:
+                return False
+            if pending:
+                self.hedges += 1
+                metrics.glif_hedges.inc()
+            # attempts see the caller's contextvars, so their spans land on its request
+            pending.add(self._executor.submit(contextvars.copy_context().run, self._attempt, key, payload, deadline))
+            return True
+
+        if not launch():
+            logger.error("No healthy Glif keys")
+            return None
+        attempts = 1
+        failed = 0
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            if self.hedge_after is not None:
+                timeout = self.hedge_after if timeout is None else min(timeout, self.hedge_after)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    url = future.result()
+                except GlifInputError as e:
+                    logger.warning(str(e))
+                    return None
+                except GlifError as e:
+                    logger.warning(str(e))
+                    failed += 1
+                    continue
+                # a hedge that beat a still-healthy first attempt isn't a failover
+                if failed:
+                    self.failovers += 1
+                    metrics.glif_failovers.inc()
+                return url
+            if deadline is not None and time.time() >= deadline:
+                logger.warning("Glif deadline exceeded")
+                return None
+            # a key failed, or the hedge timer fired: bring in the next key
+            if (done or self.hedge_after is not None) and launch():
+                attempts += 1
+                if done:
+                    metrics.retries.inc(upstream="glif")
+        return None
+
+    def stats(self):
+        now = time.time()
+        return {
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "keys": {key.name: key.stats(now) for key in self.keys}
+        }
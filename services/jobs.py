@@ -0,0 +1,224 @@
+# background meme generation: jobs are queued, run on a bounded pool with a deadline, and polled by id
+from concurrent.futures import ThreadPoolExecutor
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+'''
+Job state lives in sqlite so queued/running jobs are picked back up after a restart. A job goes
+queued -> running -> done | failed. Clients poll it with get(); /jobs/<id>/events does the polling
+for them every EVENTS_POLL_INTERVAL seconds, which also sees jobs finished by another process.
+
+Several processes can share the database (server workers, precompute.py, the load test). Every
+unfinished job is leased to the queue that will run it: the owner renews its leases every lease/3
+seconds, and a queue only takes over jobs whose lease has expired, i.e. whose owner died. So a
+running job is never started twice while its owner is alive.
+
+Callback urls come from clients, so they're checked when the job is submitted and again right before
+the post: http(s) only, and either on the configured allow-list of hosts or, without one, resolving
+only to public addresses (no loopback, private, link-local or metadata endpoints). Redirects aren't
+followed.
+'''
+
+FINISHED = ("done", "failed")
+
+# seconds between status reads for a job's event stream
+EVENTS_POLL_INTERVAL = 0.5
+
+class JobStore:
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, status TEXT NOT NULL, query TEXT, red_context TEXT, blue_context TEXT,
+            callback_url TEXT, result TEXT, error TEXT, deadline REAL, created_at REAL, updated_at REAL,
+            owner TEXT, lease_until REAL)""")
+        # databases created before leases
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (('owner', 'TEXT'), ('lease_until', 'REAL')):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._lock = threading.Lock()
+
+    def create(self, query, red_context, blue_context, deadline, callback_url=None, owner=None, lease_until=None):
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO jobs (id, status, query, red_context, blue_context, callback_url, deadline, created_at,
+                updated_at, owner, lease_until) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, query, red_context, blue_context, callback_url, deadline, now, now, owner, lease_until)
+            )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    # take over unfinished jobs whose lease ran out (their owner is gone); returns their ids
+    def claim_expired(self, owner, lease_until):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """SELECT id FROM jobs WHERE status NOT IN ('done', 'failed')
+                    AND (lease_until IS NULL OR lease_until < ?)""", (now,)
+                ).fetchall()
+                self._conn.executemany("UPDATE jobs SET status = 'queued', owner = ?, lease_until = ? WHERE id = ?",
+                                       [(owner, lease_until, row['id']) for row in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [row['id'] for row in rows]
+
+    # extend the leases on every unfinished job this owner holds
+    def renew(self, owner, lease_until):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status NOT IN ('done', 'failed')",
+                               (lease_until, owner))
+
+    # drop finished jobs older than retention seconds
+    def prune(self, retention):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                               (time.time() - retention,))
+
+# raises ValueError unless the server may post to url
+def check_callback_url(url, allowed_hosts=()):
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise ValueError("callback_url must be an http(s) url")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise ValueError("callback_url host isn't allowed")
+        return
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, ValueError):
+        raise ValueError("callback_url host doesn't resolve")
+    if not all(ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+        raise ValueError("callback_url must not point at a private address")
+
+# the last event of a stream whose job was pruned while it was being watched
+def job_gone(job_id):
+    return {"job_id": job_id, "status": "gone", "error": "No such job"}
+
+# what clients see for a job
+def job_view(job):
+    result = json.loads(job['result']) if job['result'] else {}
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "meme": result.get('meme'),
+        "meme_id": result.get('meme_id'),
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at']
+    }
+
+class JobQueue:
+    # worker(query, red_context, blue_context, deadline) returns the job's result dict
+    def __init__(self, store, worker, max_workers=4, deadline=120, retention=24 * 3600, lease=30, callback_hosts=()):
+        self.store = store
+        self.callback_hosts = callback_hosts
+        self.worker = worker
+        self.deadline = deadline
+        self.retention = retention
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._lock = threading.Lock()
+        self._heartbeat = None
+
+    # called by the server at startup (not at import): prune, take over jobs left by dead processes, and
+    # keep renewing this queue's leases
+    def start(self):
+        self.store.prune(self.retention)
+        self._recover()
+        self._start_heartbeat()
+
+    def _recover(self):
+        for job_id in self.store.claim_expired(self.owner, time.time() + self.lease):
+            logger.info(f"Resuming meme job {job_id}")
+            self._executor.submit(self._run, job_id)
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._renew_leases, name="jobs-heartbeat", daemon=True)
+                self._heartbeat.start()
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                self.store.renew(self.owner, time.time() + self.lease)
+                self._recover()
+            except Exception as e:
+                logger.error(f"Error renewing meme job leases: {str(e)}")
+
+    # raises ValueError for a callback url the server won't post to
+    def submit(self, query, red_context, blue_context, callback_url=None):
+        if callback_url:
+            check_callback_url(callback_url, self.callback_hosts)
+        self._start_heartbeat()
+        job = self.store.create(query, red_context, blue_context, time.time() + self.deadline, callback_url,
+                                self.owner, time.time() + self.lease)
+        self._executor.submit(self._run, job['id'])
+        return job
+
+    def _run(self, job_id):
+        job = self.store.get(job_id)
+        # finished, or taken over by another queue while this one wasn't renewing
+        if job is None or job['status'] in FINISHED or job['owner'] != self.owner:
+            return
+        if time.time() >= job['deadline']:
+            self.store.update(job_id, "failed", error="Deadline exceeded before the job started")
+        else:
+            self.store.update(job_id, "running")
+            try:
+                result = self.worker(job['query'], job['red_context'], job['blue_context'], job['deadline'])
+                if result.get('meme') is None:
+                    self.store.update(job_id, "failed", result=result, error="Couldn't generate meme")
+                else:
+                    self.store.update(job_id, "done", result=result)
+            except Exception as e:
+                logger.error(f"Error in meme job {job_id}: {str(e)}")
+                self.store.update(job_id, "failed", error=str(e))
+        self._notify(self.store.get(job_id))
+
+    # optional webhook once the job finishes; best effort
+    def _notify(self, job):
+        if not job['callback_url']:
+            return
+        try:
+            check_callback_url(job['callback_url'], self.callback_hosts)
+            requests.post(job['callback_url'], json=job_view(job), timeout=5, allow_redirects=False)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Callback for job {job['id']} failed: {str(e)}")
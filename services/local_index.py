@@ -0,0 +1,172 @@
+# in-process copy of the Red/Blue collections, so retrieval doesn't need a round trip to the chroma host
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from services.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+'''
+Each collection is snapshotted to <dir>/<name>.npy (unit-length float32 embeddings, memory-mapped on load)
+and <dir>/<name>.json (ids, documents, sources, version: a hash of the collection's contents). Queries are a single matrix-vector product,
+and results come back in the same shape as collection.query so callers don't care which one answered.
+'''
+
+# scale rows to unit length so a dot product is cosine similarity
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+# a collection's rows, page by page
+def _pages(collection, include, page_size=1000):
+    for offset in range(0, collection.count(), page_size):
+        yield collection.get(include=include, limit=page_size, offset=offset)
+
+# hash of every row's id, document and metadata, independent of row order
+def content_hash(ids, documents, metadatas):
+    rows = sorted(zip(ids, documents, (json.dumps(metadata or {}, sort_keys=True) for metadata in metadatas)))
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(json.dumps(row).encode('utf-8'))
+    return digest.hexdigest()
+
+# chroma 0.4 has no change counter, and refresh ingests upsert changed articles under the same id (so the
+# row count doesn't move either); the version is a hash of the collection's contents, minus embeddings
+def collection_version(collection, page_size=1000):
+    ids, documents, metadatas = [], [], []
+    for page in _pages(collection, ["documents", "metadatas"], page_size):
+        ids.extend(page['ids'])
+        documents.extend(page['documents'])
+        metadatas.extend(page['metadatas'])
+    return content_hash(ids, documents, metadatas)
+
+class CollectionSnapshot:
+    def __init__(self, name, version, ids, documents, sources, embeddings):
+        self.name = name
+        self.version = version
+        self.ids = ids
+        self.documents = documents
+        self.sources = sources
+        self.embeddings = embeddings
+
+    # pull everything out of chroma, page by page
+    @classmethod
+    def from_collection(cls, collection, page_size=1000):
+        ids, documents, metadatas, embeddings = [], [], [], []
+        for page in _pages(collection, ["embeddings", "documents", "metadatas"], page_size):
+            ids.extend(page['ids'])
+            documents.extend(page['documents'])
+            metadatas.extend(page['metadatas'])
+            embeddings.extend(page['embeddings'])
+        sources = [(metadata or {}).get('source') for metadata in metadatas]
+        return cls(collection.name, content_hash(ids, documents, metadatas), ids, documents, sources,
+                   normalize_rows(embeddings))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.name)
+        # written through temp files: every server worker refreshes the same directory
+        with atomic_write(f"{base}.npy") as f:
+            np.save(f, self.embeddings)
+        meta = {
+            "version": self.version,
+            "ids": self.ids,
+            "documents": self.documents,
+            "sources": self.sources
+        }
+        with atomic_write(f"{base}.json") as f:
+            f.write(json.dumps(meta).encode('utf-8'))
+
+    @classmethod
+    def load(cls, directory, name):
+        base = os.path.join(directory, name)
+        with open(f"{base}.json", 'r') as f:
+            meta = json.load(f)
+        embeddings = np.load(f"{base}.npy", mmap_mode='r')
+        if embeddings.shape[0] != len(meta['ids']):
+            raise ValueError(f"Snapshot for {name} is inconsistent")
+        return cls(name, meta['version'], meta['ids'], meta['documents'], meta['sources'], embeddings)
+
+    # top-k by cosine similarity, shaped like collection.query's result
+    def query(self, query_embeddings, n_results=1):
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if len(self.ids) == 0:
+            for key in results:
+                results[key] = [[] for _ in query_embeddings]
+            return results
+
+        scores = normalize_rows(query_embeddings) @ self.embeddings.T
+        k = min(n_results, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for row, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-row[candidates])]
+            results["ids"].append([self.ids[i] for i in ranked])
+            results["documents"].append([self.documents[i] for i in ranked])
+            results["metadatas"].append([{"source": self.sources[i]} for i in ranked])
+            results["distances"].append([float(1 - row[i]) for i in ranked])
+        return results
+
+# keeps one snapshot per collection, checked against chroma on a timer and re-taken when its contents changed.
+# get_collection(name) is only called from the refresh thread, so chroma is never needed to start
+class LocalIndex:
+    def __init__(self, names, get_collection, directory, refresh_interval=300):
+        self.names = names
+        self.get_collection = get_collection
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._snapshots = {}
+        self._stop = threading.Event()
+
+    # serve whatever is on disk right away, then sync with chroma in the background
+    def start(self):
+        for name in self.names:
+            try:
+                self._snapshots[name] = CollectionSnapshot.load(self.directory, name)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Couldn't load local index for {name}: {str(e)}")
+        threading.Thread(target=self._run, name="local-index-refresh", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.refresh_interval)
+
+    # re-snapshot any collection whose contents changed; on failure keep serving the old copy
+    def refresh(self):
+        for name in self.names:
+            try:
+                collection = self.get_collection(name)
+                current = self._snapshots.get(name)
+                if current is not None and current.version == collection_version(collection):
+                    continue
+                snapshot = CollectionSnapshot.from_collection(collection)
+                snapshot.save(self.directory)
+                self._snapshots[name] = snapshot
+                self.refreshes += 1
+                logger.info(f"Local index for {name} refreshed ({len(snapshot.ids)} docs)")
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.error(f"Error refreshing local index for {name}: {str(e)}")
+
+    def get(self, name):
+        return self._snapshots.get(name)
+
+    def stats(self):
+        return {
+            "collections": {name: {"docs": len(s.ids), "version": s.version} for name, s in self._snapshots.items()},
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors
+        }
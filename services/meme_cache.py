@@ -0,0 +1,155 @@
+# content-addressed meme cache: glif inputs -> output url, plus an optional local mirror of the image bytes
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+from services.response_cache import make_key, normalize_text
+from services.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+'''
+Results are keyed by a hash of the normalized (query, red_context, blue_context). Images are stored
+once under blobs/<sha256[:2]>/<sha256>, so two prompts that happen to yield the same image share a
+file. The blob store keeps a running byte total, and once a put takes it over max_bytes it scans the
+directory and evicts by least recent access (file mtime is bumped on read) down to low_water of
+max_bytes, so the scan runs once per that much new data rather than on every put. Other workers write
+to the same directory, so the total is also recounted every rescan_every puts.
+'''
+
+def meme_key(query, red_context, blue_context):
+    return make_key(normalize_text(query or ''), normalize_text(red_context), normalize_text(blue_context))
+
+# sniff the few formats glif returns
+def guess_content_type(data):
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    if data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+class BlobStore:
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, low_water=0.9, rescan_every=256):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.rescan_every = rescan_every
+        self.evictions = 0
+        self._total = None # bytes on disk as of the last scan, plus what this process wrote since
+        self._puts = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # another thread or worker may be storing the same image
+            with atomic_write(path) as f:
+                f.write(data)
+            with self._lock:
+                self._puts += 1
+                if self._total is None or self._puts % self.rescan_every == 0:
+                    self._total = self._scan()[1]
+                else:
+                    self._total += len(data)
+                if self._total > self.max_bytes:
+                    self._trim()
+        return digest
+
+    def get(self, digest):
+        if not re.fullmatch(r'[0-9a-f]{64}', digest):
+            return None
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path) # mark as recently used
+        except FileNotFoundError:
+            pass # evicted by another thread or worker since the read; the bytes are still good
+        return data
+
+    # (mtime, size, path) of every blob and their total size; files removed mid-scan are skipped
+    def _scan(self):
+        blobs = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.tmp'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    blobs.append((stat.st_mtime, stat.st_size, path))
+        return blobs, sum(size for _, size, _ in blobs)
+
+    # evict least recently used blobs until under the low-water mark; called with the lock held
+    def _trim(self):
+        blobs, total = self._scan()
+        target = self.max_bytes * self.low_water
+        for _, size, path in sorted(blobs):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+    def stats(self):
+        return {"evictions": self.evictions}
+
+class MemeCache:
+    # results: a response_cache backend; blobs: a BlobStore, or None to only remember urls
+    def __init__(self, results, blobs=None, download_timeout=15):
+        self.results = results
+        self.blobs = blobs
+        self.download_timeout = download_timeout
+        self.session = requests.Session()
+
+    def get(self, query, red_context, blue_context):
+        return self.results.get(meme_key(query, red_context, blue_context))
+
+    # remember the url, and mirror the image locally when a blob store is configured
+    def put(self, query, red_context, blue_context, url):
+        entry = {"meme": url, "created_at": time.time()}
+        if self.blobs is not None:
+            try:
+                response = self.session.get(url, timeout=self.download_timeout)
+                response.raise_for_status()
+                entry["meme_id"] = self.blobs.put(response.content)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Couldn't mirror meme {url}: {str(e)}")
+        self.results.set(meme_key(query, red_context, blue_context), entry)
+        return entry
+
+    # image bytes and content type for a mirrored meme
+    def image(self, meme_id):
+        data = self.blobs.get(meme_id) if self.blobs is not None else None
+        if data is None:
+            return None, None
+        return data, guess_content_type(data)
+
+    def stats(self):
+        stats = {"results": self.results.stats()}
+        if self.blobs is not None:
+            stats["blobs"] = self.blobs.stats()
+        return stats
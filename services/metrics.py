@@ -0,0 +1,181 @@
+# request timing spans, prometheus-style metrics and an opt-in sampling profiler
+from contextlib import contextmanager
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+
+from config import PROFILE_SAMPLE_RATE, PROFILE_MIN_SECONDS, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+'''
+span(stage) times a block: it always lands in the rag_stage_seconds histogram (and in
+rag_upstream_seconds when it's a call to chroma, octo, glif or the embedding model), and, inside a
+request started with start_request(), in that request's list of spans for the Server-Timing header.
+The list lives in a contextvar, so spans recorded in asyncio tasks and in run_blocking()/to_thread
+calls made for the request end up on it. Streamed responses send their headers before any work is
+done, so they only show up in /metrics.
+
+With PROFILE_SAMPLE_RATE > 0 that fraction of requests runs under cProfile (one at a time per
+process); profiles of requests that took at least PROFILE_MIN_SECONDS are written to PROFILE_DIR as
+<timestamp>-<path>.prof, for `python -m pstats` or snakeviz. cProfile only sees the request's own
+thread: for flask that's the handler, for the asgi app it's the event loop (so other requests'
+callbacks are in the profile too).
+'''
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{str(value)}"'.replace('\n', ' ') for key, value in labels) + '}'
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {} # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {round(entry[-2], 6)}")
+                lines.append(f"{self.name}_count{_label_text(key)} {entry[-1]}")
+        return lines
+
+stage_seconds = Histogram('rag_stage_seconds', "Time spent in each pipeline stage", ('stage',))
+upstream_seconds = Histogram('rag_upstream_seconds', "Latency of calls to chroma, octo, glif and the embedding model",
+                             ('upstream', 'outcome'))
+request_seconds = Histogram('http_request_seconds', "Request latency by route and status",
+                            ('method', 'path', 'status'))
+retries = Counter('rag_upstream_retries_total', "Upstream calls retried, including with another key", ('upstream',))
+glif_failovers = Counter('glif_key_failovers_total', "Glif requests that only succeeded on a later key")
+glif_hedges = Counter('glif_hedged_requests_total', "Glif requests raced against a second key")
+
+registry = [stage_seconds, upstream_seconds, request_seconds, retries, glif_failovers, glif_hedges]
+
+# callables returning extra samples at scrape time: [(name, type, help, [(labels tuple, value)])]
+collectors = []
+
+def register_collector(collector):
+    collectors.append(collector)
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    for collector in collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            logger.error(f"Metrics collector failed: {str(e)}")
+            continue
+        for name, kind, help, values in samples:
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+            lines.extend(f"{name}{_label_text(labels)} {value}" for labels, value in values)
+    return '\n'.join(lines) + '\n'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_profile_lock = threading.Lock()
+
+class RequestTimer:
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.spans = []
+        self.profile = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE and _profile_lock.acquire(blocking=False):
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def server_timing(self, total):
+        entries = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.spans]
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(entries)
+
+    def _save_profile(self, total):
+        self.profile.disable()
+        _profile_lock.release()
+        if total < PROFILE_MIN_SECONDS:
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = self.path.strip('/').replace('/', '_') or 'root'
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{name}.prof")
+        self.profile.dump_stats(path)
+        logger.info(f"Profiled {self.path} ({total:.3f}s) to {path}")
+
+_current = contextvars.ContextVar('request_timer', default=None)
+
+# begin timing a request in this context (tasks and threads started from it inherit the timer)
+def start_request(path):
+    timer = RequestTimer(path)
+    _current.set(timer)
+    return timer
+
+# record the request and return its Server-Timing header value
+def finish_request(timer, method, route, status):
+    total = time.perf_counter() - timer.start
+    request_seconds.observe(total, method=method, path=route, status=status)
+    if timer.profile is not None:
+        timer._save_profile(total)
+    return timer.server_timing(total)
+
+@contextmanager
+def span(stage, upstream=None):
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        duration = time.perf_counter() - start
+        stage_seconds.observe(duration, stage=stage)
+        if upstream is not None:
+            upstream_seconds.observe(duration, upstream=upstream, outcome=outcome)
+        timer = _current.get()
+        if timer is not None:
+            timer.spans.append((stage, duration))
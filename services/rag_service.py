@@ -1,28 +1,113 @@
 # process all text and image generation, and vector db queries
-from config import red_collection, blue_collection
-import openai
+from config import (get_collection, RED, BLUE, RAG_MAX_WORKERS, LLM_MAX_WORKERS, CHROMA_TIMEOUT, LLM_TIMEOUT, EMBED_TIMEOUT,
+                    LOCAL_INDEX, LOCAL_INDEX_DIR, LOCAL_INDEX_REFRESH,
+                    LLM_CACHE_BACKEND, LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL,
+                    SEMANTIC_CACHE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL,
+                    MEME_JOBS_PATH, MEME_WORKERS, MEME_JOB_DEADLINE, MEME_JOB_LEASE, MEME_CALLBACK_HOSTS,
+                    GLIF_API_URL, GLIF_ID, GLIF_CONNECT_TIMEOUT, GLIF_READ_TIMEOUT, GLIF_FAILURE_THRESHOLD,
+                    GLIF_KEY_COOLDOWN, GLIF_HEDGE_AFTER,
+                    MEME_CACHE, MEME_CACHE_PATH, MEME_CACHE_SIZE, MEME_CACHE_TTL, MEME_MIRROR, MEME_BLOB_DIR,
+                    MEME_BLOB_MAX_BYTES, OCTO_BASE_URL, SINGLE_FLIGHT, SINGLE_FLIGHT_TIMEOUT,
+                    BATCH_MAX_QUERIES, BATCH_LLM_CONCURRENCY,
+                    ANSWER_INDEX, ANSWER_INDEX_DIR, ANSWER_INDEX_THRESHOLD, ANSWER_INDEX_CHECK)
+from services.embeddings import embed_query, embed_queries, embedding_cache
+from services.local_index import LocalIndex
+from services.answer_index import AnswerIndexLoader
+from services.response_cache import build_cache, make_key, hash_text, normalize_text
+from services.semantic_cache import SemanticCache
+from services.jobs import JobStore, JobQueue
+from services.glif_client import GlifClient
+from services.meme_cache import MemeCache, BlobStore, meme_key
+from services.single_flight import SingleFlight
+from services import admission
+from services import startup
+from services import metrics
+from services.metrics import span
 import os
-import json
-import requests
 from octoai.text_gen import ChatMessage
 from octoai.client import OctoAI
 
 import asyncio
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextvars
+from functools import partial
 import logging
+import threading
+import time
 
 
-client_openai = openai.Client(api_key=os.getenv('OPENAI_API_KEY'))
-client_octo = OctoAI(api_key=os.environ['OCTO_API'])
+# octo client is created on first use (or by warm_up), not at import
+_client_lock = threading.Lock()
+_client_octo = None
+
+# httpx client that sends every request to base_url, keeping the path; the sdk's hosts are fixed
+def rewrite_host_client(base_url):
+    import httpx
+
+    target = httpx.URL(base_url)
+
+    class RewriteTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            request.url = request.url.copy_with(scheme=target.scheme, host=target.host, port=target.port)
+            request.headers['Host'] = target.netloc.decode('ascii')
+            return super().handle_request(request)
+
+    return httpx.Client(transport=RewriteTransport(), timeout=LLM_TIMEOUT)
+
+def get_octo_client():
+    global _client_octo
+    if _client_octo is None:
+        with _client_lock:
+            if _client_octo is None:
+                with startup.timed("octo client"):
+                    if OCTO_BASE_URL:
+                        _client_octo = OctoAI(api_key=os.environ['OCTO_API'], httpx_client=rewrite_host_client(OCTO_BASE_URL))
+                    else:
+                        _client_octo = OctoAI(api_key=os.environ['OCTO_API'], timeout=LLM_TIMEOUT)
+    return _client_octo
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Implement caching for LLM calls - optimize for same inputs
-@lru_cache(maxsize=50)
-def cached_llm_call(system_message, user_message):
-    return llm_call(system_message, user_message)
+# chroma and octo clients are blocking, so run them on bounded pools shared by every request; llm calls
+# get their own, so a backlog of slow completions doesn't leave retrieval waiting for a thread
+executor = ThreadPoolExecutor(max_workers=RAG_MAX_WORKERS, thread_name_prefix="rag")
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm")
+
+# answer retrieval from a local snapshot when enabled, falling back to chroma until it's loaded
+local_index = None
+if LOCAL_INDEX:
+    local_index = LocalIndex([RED, BLUE], get_collection, LOCAL_INDEX_DIR, LOCAL_INDEX_REFRESH)
+    local_index.start()
+
+# answers precomputed for the known questions, served while they match the live collections
+answer_index = None
+if ANSWER_INDEX:
+    answer_index = AnswerIndexLoader(ANSWER_INDEX_DIR, [RED, BLUE], get_collection, ANSWER_INDEX_THRESHOLD,
+                                     ANSWER_INDEX_CHECK)
+    answer_index.start()
+
+# Implement caching for LLM calls - persists across restarts and is shared by workers on the host
+llm_cache = build_cache(LLM_CACHE_BACKEND, LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL)
+
+def build_user_message(context, query):
+    return f"Context: {context}\n\nQuery: {query}\n\nResponse:"
+
+# key on the normalized query plus a hash of the prompt and retrieved context, not the raw prompt
+def llm_cache_key(system_message, context, query):
+    return make_key(hash_text(system_message), hash_text(context), normalize_text(query))
+
+def cached_llm_call(system_message, context, query):
+    key = llm_cache_key(system_message, context, query)
+    response = llm_cache.get(key)
+    if response is None:
+        response = llm_call(system_message, build_user_message(context, query))
+        llm_cache.set(key, response)
+    return response
+
+# paraphrased questions ("trump tax plan" / "what is trump's tax policy?") reuse a whole answer
+semantic_cache = SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL) if SEMANTIC_CACHE else None
 
 # system prompts 
 system_prompt = f"""
@@ -58,119 +143,446 @@ All processing: query collections and generate outputs for server.py to use. Use
 to generate responses with GPT and image gen.
 '''
 
+# generation settings shared by llm_call and llm_stream
+llm_params = dict(
+    max_tokens=128,
+    model="meta-llama-3.1-8b-instruct",
+    presence_penalty=0,
+    temperature=0.8, # adjust based on humor
+    top_p=1
+)
+
+def llm_messages(system_message, user_message):
+    return [
+        ChatMessage(content=system_message, role="system"),
+        ChatMessage(content=user_message, role="user")
+    ]
+
 # call octo's llama 3.1 with context
 def llm_call(system_message=system_prompt, user_message=''):
-    completion = client_octo.text_gen.create_chat_completion(
-        max_tokens=128,
-        messages=[
-            ChatMessage(content=system_message, role="system"),
-            ChatMessage(content=user_message, role="user")
-        ],
-        model="meta-llama-3.1-8b-instruct",
-        presence_penalty=0,
-        temperature=0.8, # adjust based on humor
-        top_p=1
-    )
+    with span("octo", upstream="octo"):
+        completion = get_octo_client().text_gen.create_chat_completion(
+            messages=llm_messages(system_message, user_message),
+            **llm_params
+        )
     return completion.choices[0].message.content
 
-# Asynchronous processing for Chroma queries and LLM calls
-async def async_query_collection(collection, query_text):
-    return collection.query(query_texts=[query_text], n_results=1)
+# same call, but yield text deltas as octo generates them
+def llm_stream(system_message=system_prompt, user_message=''):
+    with span("octo_stream", upstream="octo"):
+        for chunk in get_octo_client().text_gen.create_chat_completion_stream(
+            messages=llm_messages(system_message, user_message),
+            **llm_params
+        ):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
-async def async_llm_call(system_message, user_message):
-    return cached_llm_call(system_message, user_message)
+# run a blocking call on a shared pool (retrieval's by default) without stalling the event loop. the
+# call sees this context's contextvars (like asyncio.to_thread), so its spans are attributed to the
+# request. the wait is cut to the request's deadline (the client libraries' own timeouts are fixed per
+# client). the budget is taken before submitting, so a request already past its deadline never starts
+# a call nobody will wait for
+async def run_blocking(func, *args, timeout=None, pool=None, **kwargs):
+    budget = admission.remaining(timeout)
+    loop = asyncio.get_running_loop()
+    call = partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await asyncio.wait_for(loop.run_in_executor(pool or executor, call), budget)
 
-# query rag db for context, then generate text content with it
-async def process_rag_query_text_async(query):
+# time an awaitable as one pipeline stage
+async def timed(stage, aw):
+    with span(stage):
+        return await aw
+
+# like asyncio.gather, but the first failure cancels the sibling calls instead of leaving them running
+async def gather_or_cancel(*aws):
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
     try:
-        red_results_raw, blue_results_raw = await asyncio.gather(
-            async_query_collection(red_collection, query),
-            async_query_collection(blue_collection, query)
-        )
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
 
-        # extract chroma results for context
-        red_str = red_results_raw['documents'][0][0]
-        blue_str = blue_results_raw['documents'][0][0]
-        red_link = red_results_raw['metadatas'][0][0]['source']
-        blue_link = blue_results_raw['metadatas'][0][0]['source']
+    for task in tasks:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
 
-        red_response, blue_response = await asyncio.gather(
-            async_llm_call(system_prompt, f"Context: {red_str}\n\nQuery: {query}\n\nResponse:"),
-            async_llm_call(system_prompt, f"Context: {blue_str}\n\nQuery: {query}\n\nResponse:")
-        )
+# Asynchronous processing for embeddings, Chroma queries and LLM calls
+async def async_embed_query(query_text):
+    return await timed("embed", run_blocking(embed_query, query_text, timeout=EMBED_TIMEOUT))
+
+# top match for each of the embeddings, in one request
+def query_collection(name, query_embeddings):
+    with span(f"chroma_{name.lower()}", upstream="chroma"):
+        return get_collection(name).query(query_embeddings=query_embeddings, n_results=1)
+
+async def async_query_collection(name, query_embeddings):
+    snapshot = local_index.get(name) if local_index else None
+    if snapshot is not None:
+        with span(f"local_index_{name.lower()}"):
+            return snapshot.query(query_embeddings, n_results=1)
+    return await run_blocking(query_collection, name, query_embeddings, timeout=CHROMA_TIMEOUT)
+
+async def async_llm_call(system_message, context, query):
+    return await run_blocking(cached_llm_call, system_message, context, query, timeout=LLM_TIMEOUT, pool=llm_executor)
+
+# embed once and reuse the vector for both collections; a semantic cache hit short-circuits retrieval
+async def retrieve_contexts_async(query):
+    query_embedding = await async_embed_query(query)
+    if answer_index:
+        with span("answer_index"):
+            answer = answer_index.lookup(query, query_embedding)
+        if answer is not None:
+            return query_embedding, None, answer
+    if semantic_cache:
+        with span("semantic_cache"):
+            cached = semantic_cache.get(query_embedding)
+        if cached is not None:
+            return query_embedding, None, dict(cached)
+
+    red_results_raw, blue_results_raw = await retrieve_results_async([query_embedding])
+    return query_embedding, extract_contexts(red_results_raw, blue_results_raw, 0), None
+
+# both collections' top matches for a list of embeddings, one query per collection
+async def retrieve_results_async(query_embeddings):
+    return await gather_or_cancel(
+        timed("retrieve_red", async_query_collection(RED, query_embeddings)),
+        timed("retrieve_blue", async_query_collection(BLUE, query_embeddings))
+    )
+
+# extract chroma results for context, for the i-th query embedding
+def extract_contexts(red_results_raw, blue_results_raw, i=0):
+    return {
+        "red_context": red_results_raw['documents'][i][0],
+        "blue_context": blue_results_raw['documents'][i][0],
+        "red_link": red_results_raw['metadatas'][i][0]['source'],
+        "blue_link": blue_results_raw['metadatas'][i][0]['source']
+    }
+
+# both candidates' answers for the query, with sources
+async def generate_answers_async(query, contexts):
+    red_response, blue_response = await gather_or_cancel(
+        timed("llm_red", async_llm_call(system_prompt, contexts["red_context"], query)),
+        timed("llm_blue", async_llm_call(system_prompt, contexts["blue_context"], query))
+    )
+    return {
+        "blue_response": blue_response,
+        "red_response": red_response,
+        "blue_link": contexts["blue_link"],
+        "red_link": contexts["red_link"]
+    }
+
+# concurrent requests for the same question (or the same glif inputs) share one computation
+text_flight = SingleFlight("text") if SINGLE_FLIGHT else None
+meme_flight = SingleFlight("meme") if SINGLE_FLIGHT else None
+
+# query rag db for context, then generate text content with it
+async def process_rag_query_text_async(query):
+    if not text_flight:
+        return await _process_rag_query_text_async(query)
+    result = await text_flight.do_async(normalize_text(query), _process_rag_query_text_async, query,
+                                        timeout=admission.remaining(SINGLE_FLIGHT_TIMEOUT))
+    return dict(result)
+
+async def _process_rag_query_text_async(query):
+    try:
+        query_embedding, contexts, cached = await retrieve_contexts_async(query)
+        if cached is not None:
+            return cached
 
         # return text with sources
-        return {
-            "blue_response": blue_response,
-            "red_response": red_response,
-            "blue_link": blue_link,
-            "red_link": red_link
-        }
+        result = await generate_answers_async(query, contexts)
+        if semantic_cache:
+            semantic_cache.put(query_embedding, result)
+        return dict(result)
+    except asyncio.TimeoutError:
+        logger.error("Timed out in process_rag_query_text_async")
+        raise
     except Exception as e:
         logger.error(f"Error in process_rag_query_text_async: {str(e)}")
         raise
     
-# call wojak glif. if api key runs out, fall back to another one
-def glif_call(context, query):
-    api_keys = [
+# wojak glif client. if an api key runs out, it falls back to another one
+glif_client = GlifClient(
+    api_keys=[
         os.getenv('GLIF_API_KEY_1'),
         os.getenv('GLIF_API_KEY_2'),
         os.getenv('GLIF_API_KEY_3')
+    ],
+    glif_id=GLIF_ID,
+    url=GLIF_API_URL,
+    connect_timeout=GLIF_CONNECT_TIMEOUT,
+    read_timeout=GLIF_READ_TIMEOUT,
+    failure_threshold=GLIF_FAILURE_THRESHOLD,
+    cooldown=GLIF_KEY_COOLDOWN,
+    hedge_after=GLIF_HEDGE_AFTER
+)
+
+# call wojak glif. gives up once past deadline (epoch secs)
+def glif_call(context, query, deadline=None):
+    return glif_client.generate(context, query, deadline)
+
+# create clients/collections and load the embedding model ahead of the first request.
+# each step is timed and independent, so one unreachable service doesn't stop the rest
+def warm_up():
+    steps = [
+        ("octo client", get_octo_client),
+        ("Red collection", lambda: get_collection(RED)),
+        ("Blue collection", lambda: get_collection(BLUE)),
+        ("embedding model", lambda: embed_query("warm up"))
     ]
-    
-    payload = {
-        "id": "clz4xb23q00071120ixtlgzr9", # custom glif
-        "inputs": {
-            "context": context,
-            "query": query
-        }
-    }
-    # in case on api key fails, roll back on others
-    for api_key in api_keys:
+    for name, step in steps:
         try:
-            response = requests.post(
-                "https://simple-api.glif.app",
-                json=payload,
-                headers={"Authorization": f"Bearer {api_key}"}, # paste key if error
-            )
-            
-            response.raise_for_status()
-            
-            response_json = response.json()
-            
-            if 'error' in response_json:
-                print(f"API Error with key: {response_json['error']}")
-                continue
-            
-            output_url = response_json.get('output') # extract the image url
-            return output_url
-        
-        except requests.exceptions.RequestException as e:
-            print(f"HTTP Request failed with key: {e}")
-        except json.JSONDecodeError as e:
-            print(f"JSON Decoding Error with key: {e}")
+            with startup.timed(f"warm up {name}"):
+                step()
         except Exception as e:
-            print(f"Unexpected Error with key: {e}")
-    
-    return None
-    # response = client_octo.image_gen.generate_sdxl(
+            logger.error(f"Warm up of {name} failed: {str(e)}")
+
+# cache counters for monitoring
+def get_cache_stats():
+    stats = {
+        "startup": startup.report(),
+        "embedding": embedding_cache.stats(),
+        "llm": llm_cache.stats()
+    }
+    stats["glif"] = glif_client.stats()
+    if meme_cache:
+        stats["meme"] = meme_cache.stats()
+    if semantic_cache:
+        stats["semantic"] = semantic_cache.stats()
+    if local_index:
+        stats["local_index"] = local_index.stats()
+    if answer_index:
+        stats["answer_index"] = answer_index.stats()
+    if SINGLE_FLIGHT:
+        stats["single_flight"] = {"text": text_flight.stats(), "meme": meme_flight.stats()}
+    stats["admission"] = admission.stats()
+    return stats
 
 # get context from chroma, query Llama with document context, generate output with source
 def process_rag_query_text(query):
     return asyncio.run(process_rag_query_text_async(query))
 
+# answer many questions at once: duplicates are answered once, cache hits are served first, the rest
+# are embedded in one call and looked up with one query per collection, then their llm calls fan out
+# at most BATCH_LLM_CONCURRENCY at a time. results line up with queries; a failed item gets "error"
+async def process_rag_query_batch_async(queries):
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise ValueError(f"At most {BATCH_MAX_QUERIES} queries per batch")
+    unique = list(dict.fromkeys(normalize_text(query) for query in queries))
+    originals = {}
+    for query in queries:
+        originals.setdefault(normalize_text(query), query)
+    answers = {}
+
+    embeddings = await timed("embed", run_blocking(embed_queries, [originals[key] for key in unique],
+                                                   timeout=EMBED_TIMEOUT))
+    misses = []
+    with span("cache_lookup"):
+        for key, embedding in zip(unique, embeddings):
+            cached = answer_index.lookup(originals[key], embedding) if answer_index else None
+            if cached is None and semantic_cache:
+                cached = semantic_cache.get(embedding)
+            if cached is not None:
+                answers[key] = dict(cached)
+            else:
+                misses.append((key, embedding))
+
+    if misses:
+        red_results_raw, blue_results_raw = await retrieve_results_async([embedding for _, embedding in misses])
+        limit = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def answer(i, key, embedding):
+            async with limit:
+                try:
+                    result = await generate_answers_async(originals[key], extract_contexts(red_results_raw, blue_results_raw, i))
+                except Exception as e:
+                    logger.error(f"Error answering batch query: {str(e) or type(e).__name__}")
+                    return key, {"error": "Couldn't process query!"}
+            if semantic_cache:
+                semantic_cache.put(embedding, result)
+            return key, result
+
+        answers.update(await asyncio.gather(*(answer(i, key, embedding) for i, (key, embedding) in enumerate(misses))))
+
+    return [dict(answers[normalize_text(query)], query=query) for query in queries]
+
+def process_rag_query_batch(queries):
+    return asyncio.run(process_rag_query_batch_async(queries))
+
+# stream one candidate's answer onto the loop's event queue, (side, None) when finished
+def _stream_side(loop, events, stop, side, context, query):
+    def emit(item):
+        loop.call_soon_threadsafe(events.put_nowait, item)
+    try:
+        key = llm_cache_key(system_prompt, context, query)
+        response = llm_cache.get(key)
+        if response is not None:
+            emit((side, response))
+        else:
+            parts = []
+            for delta in llm_stream(system_prompt, build_user_message(context, query)):
+                if stop.is_set():
+                    return
+                parts.append(delta)
+                emit((side, delta))
+            llm_cache.set(key, ''.join(parts))
+        emit((side, None))
+    except Exception as e:
+        emit((side, e))
+
+# same pipeline as process_rag_query_text_async, as (event, data) pairs: links once retrieval is done,
+# then red/blue token deltas interleaved as octo produces them, then the full result
+async def stream_rag_query_text_async(query):
+    query_embedding, contexts, cached = await retrieve_contexts_async(query)
+    if cached is not None:
+        yield "links", {"red_link": cached["red_link"], "blue_link": cached["blue_link"]}
+        yield "token", {"side": "red", "text": cached["red_response"]}
+        yield "token", {"side": "blue", "text": cached["blue_response"]}
+        yield "done", cached
+        return
+
+    yield "links", {"red_link": contexts["red_link"], "blue_link": contexts["blue_link"]}
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    stop = threading.Event()
+    llm_executor.submit(_stream_side, loop, events, stop, "red", contexts["red_context"], query)
+    llm_executor.submit(_stream_side, loop, events, stop, "blue", contexts["blue_context"], query)
+    responses = {"red": [], "blue": []}
+    try:
+        finished = 0
+        while finished < 2:
+            side, delta = await asyncio.wait_for(events.get(), admission.remaining(LLM_TIMEOUT))
+            if delta is None:
+                finished += 1
+            elif isinstance(delta, Exception):
+                raise delta
+            else:
+                responses[side].append(delta)
+                yield "token", {"side": side, "text": delta}
+    finally:
+        stop.set() # client went away or a side failed: stop reading the other stream
+
+    result = {
+        "blue_response": ''.join(responses["blue"]),
+        "red_response": ''.join(responses["red"]),
+        "blue_link": contexts["blue_link"],
+        "red_link": contexts["red_link"]
+    }
+    if semantic_cache:
+        semantic_cache.put(query_embedding, result)
+    yield "done", dict(result)
+
+# drive the async stream from sync code (flask), one event loop per stream
+def stream_rag_query_text(query):
+    loop = asyncio.new_event_loop()
+    events = stream_rag_query_text_async(query)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(events.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(events.aclose())
+        loop.close()
+
+# repeated (query, red, blue) inputs reuse the earlier glif result instead of generating again
+meme_cache = None
+if MEME_CACHE:
+    meme_cache = MemeCache(
+        build_cache('sqlite', MEME_CACHE_PATH, MEME_CACHE_SIZE, MEME_CACHE_TTL, table='memes'),
+        BlobStore(MEME_BLOB_DIR, MEME_BLOB_MAX_BYTES) if MEME_MIRROR else None
+    )
+
+# combine contexts from rag db and send as joint component to glif, along with query.
+# returns {"meme": url} plus "meme_id" when the image is mirrored locally. inside a request, the
+# request's deadline applies too
+def generate_meme(query, red_response, blue_response, deadline=None):
+    request_deadline = admission.deadline()
+    if request_deadline is not None:
+        deadline = request_deadline if deadline is None else min(deadline, request_deadline)
+    if answer_index:
+        precomputed = answer_index.meme(query, red_response, blue_response)
+        if precomputed is not None:
+            return precomputed
+    if meme_cache:
+        with span("meme_cache"):
+            cached = meme_cache.get(query, red_response, blue_response)
+        if cached is not None:
+            return cached
+    timeout = None if deadline is None else max(deadline - time.time(), 0)
+    try:
+        if not meme_flight:
+            return _generate_meme(query, red_response, blue_response, deadline)
+        return dict(meme_flight.do(meme_key(query, red_response, blue_response), _generate_meme,
+                                   query, red_response, blue_response, deadline, timeout=timeout))
+    except admission.DeadlineExceeded:
+        # glif gave up on this caller's deadline (and already logged it)
+        return {"meme": None}
+    except FutureTimeoutError:
+        logger.warning("Deadline passed waiting for an identical meme request")
+        return {"meme": None}
+
+# raises DeadlineExceeded rather than returning no meme when glif ran out of the caller's time, so
+# meme_flight doesn't hand that to followers whose deadlines are later
+def _generate_meme(query, red_response, blue_response, deadline=None):
+    context = f"Trump: {red_response}\nHarris: {blue_response}"
+    with span("glif"):
+        meme = glif_call(context=context, query=query, deadline=deadline)
+    if meme is None:
+        if deadline is not None and time.time() >= deadline:
+            raise admission.DeadlineExceeded("Glif deadline passed")
+        return {"meme": None}
+    if meme_cache:
+        return meme_cache.put(query, red_response, blue_response, meme)
+    return {"meme": meme}
+
+# local copy of a mirrored meme: (bytes, content type), or (None, None)
+def get_meme_image(meme_id):
+    if not meme_cache:
+        return None, None
+    return meme_cache.image(meme_id)
+
+# started by the server (create_app / on_startup), so scripts importing this module don't pick up jobs
+meme_jobs = JobQueue(JobStore(MEME_JOBS_PATH), generate_meme, MEME_WORKERS, MEME_JOB_DEADLINE, lease=MEME_JOB_LEASE,
+                     callback_hosts=MEME_CALLBACK_HOSTS)
+
+# cache hit/miss counters for /metrics, from the same numbers as /stats
+def cache_metrics():
+    caches = {"embedding": embedding_cache.stats(), "llm": llm_cache.stats()}
+    if semantic_cache:
+        caches["semantic"] = semantic_cache.stats()
+    if meme_cache:
+        caches["meme"] = meme_cache.results.stats()
+    if answer_index:
+        caches["answer_index"] = answer_index.stats()
+    samples = [
+        ("rag_cache_hits_total", "counter", "Cache hits", [((("cache", name),), c["hits"]) for name, c in caches.items()]),
+        ("rag_cache_misses_total", "counter", "Cache misses", [((("cache", name),), c["misses"]) for name, c in caches.items()])
+    ]
+    if SINGLE_FLIGHT:
+        flights = (text_flight, meme_flight)
+        samples.append(("rag_coalesced_requests_total", "counter", "Requests that waited on an identical in-flight one",
+                        [((("flight", flight.name),), flight.stats()["coalesced"]) for flight in flights]))
+    return samples
+
+metrics.register_collector(cache_metrics)
+
 # generate image based on text displayed
 async def process_rag_query_image_async(query, red_response, blue_response):
-    # combine contexts from rag db and send as joint component to glif, along with query
     try:
-        context = f"Trump: {red_response}\nHarris: {blue_response}"
-        meme = await asyncio.to_thread(glif_call, context=context, query=query)
-        if meme is None:
+        result = await asyncio.to_thread(generate_meme, query, red_response, blue_response)
+        if result["meme"] is None:
             logger.warning("Failed to generate meme")
-        return {"meme": meme}
+        return {key: result[key] for key in ("meme", "meme_id") if key in result}
     except Exception as e:
         logger.error(f"Error in process_rag_query_image_async: {str(e)}")
-        return f"Error in process_rag_query_image_async: {str(e)}"
+        raise
 
 # generate image async
 def process_rag_query_image(query, red_response, blue_response):
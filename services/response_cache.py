@@ -0,0 +1,164 @@
+# response caches for expensive upstream calls: an in-process LRU in front of a sqlite file shared by workers
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+'''
+Backends share get/get_with_expiry/set/stats, so they can be used alone or stacked in a TieredCache. Values must be
+JSON-serializable. Every entry has a TTL, and each tier evicts its least recently used entries once it
+holds more than maxsize.
+'''
+
+# lowercase, collapse whitespace and drop trailing punctuation so "Trump tax plan?" == "trump tax plan"
+def normalize_text(text):
+    return ' '.join(text.lower().split()).strip(' ?!.')
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# stable key from any number of string parts
+def make_key(*parts):
+    return hash_text('\x1f'.join(parts))
+
+class MemoryCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.get_with_expiry(key)
+        return None if entry is None else entry[0]
+
+    # (value, expires_at) or None
+    def get_with_expiry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+# survives restarts, and every worker on the host reads the same file
+class SqliteCache:
+    def __init__(self, path, maxsize=10000, ttl=86400, table='cache'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)")
+
+    def get(self, key):
+        entry = self.get_with_expiry(key)
+        return None if entry is None else entry[0]
+
+    # (value, expires_at) or None
+    def get_with_expiry(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + (self.ttl if ttl is None else ttl), now)
+            )
+            self._conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (now,))
+            evicted = self._conn.execute(
+                f"""DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)""",
+                (self.maxsize,)
+            ).rowcount
+            self.evictions += max(evicted, 0)
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": size}
+
+# check tiers in order; a hit in a slower tier is copied into the faster ones for only the time it has
+# left, so promotion never extends how long an entry lives
+class TieredCache:
+    def __init__(self, *tiers):
+        self.tiers = tiers
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.get_with_expiry(key)
+        return None if entry is None else entry[0]
+
+    def get_with_expiry(self, key):
+        for i, tier in enumerate(self.tiers):
+            entry = tier.get_with_expiry(key)
+            if entry is not None:
+                value, expires_at = entry
+                for faster in self.tiers[:i]:
+                    faster.set(key, value, max(expires_at - time.time(), 0))
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        for tier in self.tiers:
+            tier.set(key, value, ttl)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "tiers": {type(tier).__name__: tier.stats() for tier in self.tiers}
+        }
+
+# backend is one of memory, sqlite or tiered (memory in front of sqlite)
+def build_cache(backend, path, maxsize, ttl, table='cache'):
+    if backend == 'memory':
+        return MemoryCache(maxsize, ttl)
+    if backend == 'sqlite':
+        return SqliteCache(path, maxsize, ttl, table)
+    if backend == 'tiered':
+        return TieredCache(MemoryCache(min(maxsize, 1024), ttl), SqliteCache(path, maxsize, ttl, table))
+    raise ValueError(f"Unknown cache backend: {backend}")
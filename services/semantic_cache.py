@@ -0,0 +1,67 @@
+# answer cache keyed on query embeddings, so paraphrases of a hot question share one result
+import threading
+import time
+
+import numpy as np
+
+from services.local_index import normalize_rows
+
+'''
+Entries live in a fixed-size float32 matrix; lookup is one matrix-vector product over the live rows.
+When full, the least recently used slot is overwritten. Expired slots are ignored and reused first.
+'''
+
+class SemanticCache:
+    def __init__(self, capacity=2048, threshold=0.9, ttl=3600):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._vectors = None # allocated on first put, once the embedding size is known
+        self._values = [None] * capacity
+        self._expires = np.zeros(capacity)
+        self._last_used = np.zeros(capacity)
+        self._lock = threading.Lock()
+
+    # closest live entry at or above the similarity threshold, else None
+    def get(self, embedding):
+        query = normalize_rows(embedding)
+        with self._lock:
+            now = time.time()
+            live = self._expires > now
+            if self._vectors is None or not live.any():
+                self.misses += 1
+                return None
+            scores = self._vectors @ query
+            scores[~live] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            return self._values[best]
+
+    def put(self, embedding, value):
+        vector = normalize_rows(embedding)
+        with self._lock:
+            now = time.time()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            free = np.flatnonzero(self._expires <= now)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._vectors[slot] = vector
+            self._values[slot] = value
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+
+    def stats(self):
+        with self._lock:
+            size = int((self._expires > time.time()).sum())
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": size}
@@ -0,0 +1,103 @@
+# request coalescing: concurrent calls with the same key share one in-flight computation
+import asyncio
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import threading
+import time
+
+'''
+The first caller for a key (the leader) runs the computation; callers that arrive while it's in
+flight (followers) wait for its result instead of starting their own, and get its exception if it
+fails. The shared result is a concurrent.futures.Future, so followers can be threads or coroutines
+on any event loop (flask runs each request on its own loop). A follower's timeout or cancellation
+only gives up its own wait (asyncio.shield keeps it from cancelling the shared future). If the
+leader itself is cancelled (its client went away) or times out (its own request's deadline, which
+says nothing about the followers') the computation is abandoned and waiting followers start over
+with what's left of their own timeouts, one of them becoming the new leader. The key is released as
+soon as the computation finishes, so this never serves stale results; caching is left to the caches.
+'''
+
+TIMEOUTS = (TimeoutError, asyncio.TimeoutError, FutureTimeoutError)
+
+class Abandoned(Exception):
+    pass
+
+# seconds left until end (a time.monotonic() value), or None for no limit
+def _left(end):
+    return None if end is None else max(end - time.monotonic(), 0)
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # (future, True) for the leader, (the in-flight future, False) for a follower
+    def _join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            self.leaders += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        # nobody may be waiting; retrieving the exception keeps the future from logging it as unhandled
+        future.exception()
+
+    # what followers get when the leader's call raised e
+    @staticmethod
+    def _shared_error(e):
+        if isinstance(e, TIMEOUTS) or not isinstance(e, Exception):
+            return Abandoned()
+        return e
+
+    # blocking version, for code running in threads
+    def do(self, key, func, *args, timeout=None, **kwargs):
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return future.result(_left(end))
+                except Abandoned:
+                    continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                self._finish(key, future, error=self._shared_error(e))
+                raise
+            self._finish(key, future, result)
+            return result
+
+    # awaits coro_func(*args) once per key across every event loop in the process
+    async def do_async(self, key, coro_func, *args, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), _left(end))
+                except Abandoned:
+                    continue
+            try:
+                result = await asyncio.wait_for(coro_func(*args), _left(end))
+            except BaseException as e:
+                self._finish(key, future, error=self._shared_error(e))
+                raise
+            self._finish(key, future, result)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._calls)}
@@ -0,0 +1,10 @@
+# server-sent events framing, shared by the flask and asgi apps
+import json
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# sent while there's nothing new, so proxies don't drop the connection
+SSE_KEEP_ALIVE = ": keep-alive\n\n"
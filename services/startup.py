@@ -0,0 +1,36 @@
+# cold-start accounting: how long imports and client initialization took, step by step
+from contextlib import contextmanager
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+'''
+Steps are recorded in the order they ran. timed_imports() imports modules one at a time, so each
+entry is that module's own cost on top of whatever was imported before it (run `python -X importtime`
+for a full tree). Client and collection creation is recorded as it happens, on first use or in warm-up.
+'''
+
+process_start = time.time()
+timings = {}
+
+@contextmanager
+def timed(step):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[step] = round(time.perf_counter() - start, 4)
+        logger.info(f"startup: {step} took {timings[step]}s")
+
+def timed_imports(*modules):
+    for module in modules:
+        with timed(f"import {module}"):
+            importlib.import_module(module)
+
+def report():
+    return {
+        "uptime": round(time.time() - process_start, 1),
+        "steps": dict(timings)
+    }
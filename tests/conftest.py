@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# importing the app creates its sqlite stores and starts background checks; keep them out of the way
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='meme-generator-tests-'))
+os.environ.setdefault('WARM_UP', 'false')
+os.environ.setdefault('ANSWER_INDEX', 'false')
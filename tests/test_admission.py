@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import admission
+from services.admission import Gate, Rejected, DeadlineExceeded
+from services.rag_service import run_blocking
+
+
+def test_run_blocking_past_the_deadline_never_submits_the_call():
+    calls = []
+
+    async def main():
+        with admission.within(time.time() - 1):
+            await run_blocking(calls.append, "called")
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(main())
+    time.sleep(0.1)
+    assert calls == []
+
+
+def test_remaining_cuts_the_timeout_to_the_deadline():
+    assert admission.remaining(5) == 5
+    with admission.within(time.time() + 1):
+        assert admission.remaining(5) <= 1
+        assert admission.remaining(0.5) == 0.5
+
+
+def test_queued_request_gets_the_released_slot():
+    gate = Gate("test", 1, 1, 5)
+    first = gate.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(gate.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    assert gate.stats()["queued"] == 1
+    first.release()
+    waiter.join(1)
+    assert len(acquired) == 1
+    assert gate.stats()["active"] == 1
+    acquired[0].release()
+    assert gate.stats()["active"] == 0
+
+
+def test_full_queue_is_shed_with_429():
+    gate = Gate("test", 1, 0, 5)
+    slot = gate.acquire()
+    with pytest.raises(Rejected) as rejected:
+        gate.acquire()
+    assert rejected.value.status == 429
+    assert rejected.value.retry_after >= 1
+    assert gate.stats()["shed"]["queue_full"] == 1
+    slot.release()
+
+
+def test_expected_wait_past_the_deadline_is_shed_with_503():
+    gate = Gate("test", 1, 4, 1)
+    gate.avg_seconds = 3
+    slot = gate.acquire()
+    with pytest.raises(Rejected) as rejected:
+        gate.acquire()
+    assert rejected.value.status == 503
+    assert rejected.value.retry_after == 3
+    assert gate.stats()["shed"]["deadline"] == 1
+    slot.release()
+
+
+def test_request_still_queued_at_its_deadline_gets_503():
+    gate = Gate("test", 1, 1, 0.2)
+    slot = gate.acquire()
+    with pytest.raises(Rejected) as rejected:
+        gate.acquire()
+    assert rejected.value.status == 503
+    assert gate.stats()["shed"]["timeout"] == 1
+    assert gate.stats()["queued"] == 0
+    slot.release()
+    assert gate.stats()["active"] == 0
+
+
+def test_async_queue_and_timeout():
+    async def main():
+        gate = Gate("test", 1, 2, 0.2)
+        slot = await gate.acquire_async()
+        queued = asyncio.ensure_future(gate.acquire_async())
+        await asyncio.sleep(0.05)
+        slot.release()
+        (await queued).release()
+        async with gate.admit_async():
+            with pytest.raises(Rejected) as rejected:
+                await gate.acquire_async()
+        assert rejected.value.status == 503
+        return gate.stats()
+
+    stats = asyncio.run(main())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 3
+
+
+def test_shed_request_gets_its_status_and_retry_after(monkeypatch):
+    from flask import Flask
+    import router
+
+    gate = Gate("text", 1, 0, 5)
+    monkeypatch.setattr(admission, "text_gate", gate)
+    app = Flask(__name__)
+    router.setup_routes(app)
+    slot = gate.acquire()
+    try:
+        response = app.test_client().post("/query/text", json={"query": "what is the plan?"})
+    finally:
+        slot.release()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
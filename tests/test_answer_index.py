@@ -0,0 +1,55 @@
+import numpy as np
+
+from services import answer_index
+from services.answer_index import AnswerIndex, AnswerIndexLoader
+
+
+def answer(text):
+    return {"blue_response": text, "red_response": text, "blue_link": None, "red_link": None}
+
+
+def test_check_reloads_a_rebuilt_index(tmp_path, monkeypatch):
+    live = {"fingerprint": {"Red": "v1", "Blue": "v1"}}
+    monkeypatch.setattr(answer_index, "collections_fingerprint", lambda get_collection, names: live["fingerprint"])
+    embedding = np.ones((1, 4), dtype=np.float32)
+    AnswerIndex(["what is it?"], [answer("old")], embedding, {"Red": "v1", "Blue": "v1"}, 1).save(tmp_path)
+
+    loader = AnswerIndexLoader(str(tmp_path), ["Red", "Blue"], None)
+    loader.index = AnswerIndex.load(str(tmp_path))
+    assert loader.check()
+    assert loader.lookup("what is it?", embedding[0])["red_response"] == "old"
+
+    # re-ingest: the index stops serving
+    live["fingerprint"] = {"Red": "v2", "Blue": "v1"}
+    assert loader.check()
+    assert loader.lookup("what is it?", embedding[0]) is None
+
+    # precompute.py rebuilds it against the new collections
+    AnswerIndex(["what is it?"], [answer("new")], embedding, {"Red": "v2", "Blue": "v1"}, 2).save(tmp_path)
+    assert loader.check()
+    assert loader.stats()["valid"]
+    assert loader.lookup("what is it?", embedding[0])["red_response"] == "new"
+
+
+def test_index_written_after_start_is_picked_up(tmp_path, monkeypatch):
+    fingerprint = {"Red": "v1", "Blue": "v1"}
+    monkeypatch.setattr(answer_index, "collections_fingerprint", lambda get_collection, names: fingerprint)
+    loader = AnswerIndexLoader(str(tmp_path), ["Red", "Blue"], None)
+    # start() would run this loop on its thread
+    assert not loader.check()
+    assert loader.lookup("what is it?", np.ones(4, dtype=np.float32)) is None
+    assert loader.stats()["answers"] == 0
+
+    embedding = np.ones((1, 4), dtype=np.float32)
+    AnswerIndex(["what is it?"], [answer("first")], embedding, fingerprint, 1).save(tmp_path)
+    assert loader.check()
+    assert loader.lookup("what is it?", embedding[0])["red_response"] == "first"
+
+
+def test_start_without_an_index_runs_the_check_thread(tmp_path, monkeypatch):
+    checks = []
+    loader = AnswerIndexLoader(str(tmp_path), ["Red", "Blue"], None)
+    monkeypatch.setattr(loader, "check", lambda: checks.append(True) or loader.stop())
+    loader.start()
+    loader._stop.wait(1)
+    assert checks
@@ -0,0 +1,13 @@
+from starlette.testclient import TestClient
+
+import asgi_server
+
+
+def test_lifespan_starts_the_job_queue(monkeypatch):
+    started = []
+    monkeypatch.setattr(asgi_server.meme_jobs, "start", lambda: started.append(True))
+    with TestClient(asgi_server.create_app()) as client:
+        assert started == [True]
+        response = client.get("/jobs/no-such-job")
+    assert response.status_code == 404
+    assert "server-timing" in response.headers
@@ -0,0 +1,58 @@
+import requests
+
+from ingest import bulk_writer
+from ingest.bulk_writer import BulkWriter
+
+
+class Collection:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.ids = []
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        self.calls += 1
+        if callable(self.error):
+            self.error(ids)
+        elif self.error is not None:
+            raise self.error
+        self.ids.extend(ids)
+
+
+def embed(documents):
+    return [[1.0, 0.0] for _ in documents]
+
+
+def writer(collection, failed):
+    return BulkWriter(collection, embed, max_docs=8, on_failed=lambda item, error: failed.append(item))
+
+
+def fill(writer):
+    for i in range(8):
+        writer.add(f"doc-{i}", f"document {i}", {"source": str(i)}, item=i)
+
+
+def test_bad_document_is_isolated():
+    def reject(ids):
+        if "doc-5" in ids:
+            raise ValueError("Expected metadata value to be a str")
+
+    failed = []
+    collection = Collection(reject)
+    fill(writer(collection, failed))
+    assert failed == [5]
+    assert sorted(collection.ids) == [f"doc-{i}" for i in range(8) if i != 5]
+
+
+def test_outage_fails_the_batch_without_bisecting(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(bulk_writer.time, "sleep", sleeps.append)
+    failed = []
+    collection = Collection(requests.exceptions.ConnectionError("refused"))
+    w = writer(collection, failed)
+    fill(w)
+    assert failed == list(range(8))
+    assert w.stats()["failed"] == 8
+    # one batch's retries, not one per bisection node
+    assert collection.calls == w.retries + 1
+    assert len(sleeps) == w.retries
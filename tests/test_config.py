@@ -0,0 +1,53 @@
+import socket
+import threading
+import time
+
+import chromadb
+import pytest
+import requests
+from chromadb.config import Settings
+
+import config
+
+
+# a server that accepts connections and never answers
+@pytest.fixture
+def silent_server():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    yield server.getsockname()[1]
+    server.close()
+
+
+def test_bound_timeout_applies_to_chroma_requests(silent_server):
+    client = chromadb.HttpClient(host='127.0.0.1', port=silent_server, settings=Settings())
+    config._bound_timeout(client, 0.2)
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        client.heartbeat()
+    assert time.monotonic() - start < 2
+
+
+def test_slow_collection_lookup_does_not_block_others(monkeypatch):
+    release = threading.Event()
+
+    class Client:
+        def get_collection(self, name, embedding_function):
+            if name == 'slow':
+                release.wait(5)
+            return name
+
+    monkeypatch.setattr(config, '_client', Client())
+    monkeypatch.setattr(config, '_embedding_function', object())
+    monkeypatch.setattr(config, '_collections', {})
+    slow = threading.Thread(target=config.get_collection, args=('slow',))
+    slow.start()
+    try:
+        start = time.monotonic()
+        assert config.get_collection('fast') == 'fast'
+        assert time.monotonic() - start < 1
+    finally:
+        release.set()
+        slow.join()
+    assert config.get_collection('slow') == 'slow'
@@ -0,0 +1,18 @@
+from services import embeddings
+from services.embeddings import EmbeddingCache, embed_queries
+
+
+def test_case_and_punctuation_variants_share_one_embedding(monkeypatch):
+    embedded = []
+
+    def model(texts):
+        embedded.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+    monkeypatch.setattr(embeddings, "embedding_cache", EmbeddingCache(16))
+    monkeypatch.setattr(embeddings, "get_embedding_function", lambda: model)
+    vectors = embed_queries(["What is  the Tax Plan?", "what is the tax plan"])
+    vectors += embed_queries(["WHAT IS THE TAX PLAN!"])
+    assert embedded == ["What is the Tax Plan?"]
+    assert vectors[0] == vectors[1] == vectors[2]
+    assert embeddings.embedding_cache.stats()["hits"] == 1
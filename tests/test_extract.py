@@ -0,0 +1,59 @@
+import glob
+import os
+
+import pytest
+
+from ingest.extract import extract_article
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench', 'fixtures')
+
+
+def test_unclosed_marked_container_ends_with_its_parent():
+    with open(os.path.join(FIXTURES, 'unclosed_div_related.html'), 'rb') as f:
+        text = extract_article(f.read())
+    assert "More on energy" not in text
+    assert "battery and solar factories" in text
+    assert "household energy bills" in text
+
+
+def test_nested_tag_inside_skipped_region_does_not_end_it():
+    html = ("<section><aside class='promo'><section>Subscribe for deals</section><p>Promo copy here</p></aside>"
+            "<p>Article text.</p></section>")
+    assert extract_article(html) == "Article text."
+
+
+def test_short_paragraphs_are_kept():
+    html = "<p>Long enough paragraph of article text to keep.</p><p>“No.”</p><p>He left.</p>"
+    assert extract_article(html) == "Long enough paragraph of article text to keep. “No.” He left."
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(FIXTURES, '*.html'))))
+def test_stream_finds_text_in_every_fixture(path):
+    with open(path, 'rb') as f:
+        assert extract_article(f.read())
+
+
+def test_declared_charset_is_used_for_non_utf8_pages():
+    with open(os.path.join(FIXTURES, 'cp1252_meta_charset.html'), 'rb') as f:
+        html = f.read()
+    text = extract_article(html)
+    assert "The Café de Flore — a fixture" in text
+    assert "“nonsense”" in text
+    assert text == extract_article(html, 'strainer')
+
+
+def test_undeclared_non_utf8_falls_back_to_windows_1252():
+    html = "<p>Señor “Smith” spoke.</p>".encode('cp1252')
+    assert extract_article(html) == "Señor “Smith” spoke."
+
+
+@pytest.mark.parametrize('marker', ['ad-free-article', 'ads-container', 'header-ad-slot', 'loaded'])
+def test_ad_words_only_match_whole_tokens(marker):
+    html = f"<div class='{marker}'><p>The article text inside the wrapper.</p></div>"
+    assert extract_article(html) == "The article text inside the wrapper."
+
+
+@pytest.mark.parametrize('marker', ['ad', 'ads', 'advert', 'advertisement'])
+def test_ad_containers_are_skipped(marker):
+    html = f"<div class='{marker}'><p>Buy now.</p></div><p>The article text.</p>"
+    assert extract_article(html) == "The article text."
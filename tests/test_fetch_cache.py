@@ -0,0 +1,84 @@
+import pytest
+import requests
+
+from ingest.fetch_cache import FetchCache, OfflineMiss
+
+
+class Response:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}")
+
+
+class Session:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers, timeout):
+        self.requests.append((url, headers))
+        return self.responses.pop(0)
+
+
+def cache_with(tmp_path, session, **kwargs):
+    cache = FetchCache(str(tmp_path), **kwargs)
+    cache._session = lambda url: session
+    return cache
+
+
+def test_unchanged_page_is_revalidated_with_a_conditional_get(tmp_path):
+    session = Session(
+        Response(200, b'<p>article</p>', {'ETag': '"v1"', 'Last-Modified': 'Tue, 01 Oct 2024 00:00:00 GMT'}),
+        Response(304)
+    )
+    cache = cache_with(tmp_path, session)
+    assert cache.fetch("https://example.com/story") == b'<p>article</p>'
+    assert cache.fetch("https://www.example.com/story/?utm_source=x") == b'<p>article</p>'
+    assert session.requests[0][1] == {}
+    assert session.requests[1][1] == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Tue, 01 Oct 2024 00:00:00 GMT'}
+    assert cache.stats() == {"hits": 0, "revalidated": 1, "downloads": 1, "bytes_downloaded": 14}
+
+
+def test_changed_page_is_downloaded_again(tmp_path):
+    session = Session(Response(200, b'old', {'ETag': '"v1"'}), Response(200, b'new', {'ETag': '"v2"'}),
+                      Response(304))
+    cache = cache_with(tmp_path, session)
+    cache.fetch("https://example.com/story")
+    assert cache.fetch("https://example.com/story") == b'new'
+    assert cache.fetch("https://example.com/story") == b'new'
+    assert session.requests[2][1] == {'If-None-Match': '"v2"'}
+
+
+def test_pages_within_max_age_are_served_without_a_request(tmp_path):
+    session = Session(Response(200, b'body'))
+    cache = cache_with(tmp_path, session, max_age=60)
+    cache.fetch("https://example.com/story")
+    assert cache.fetch("https://example.com/story") == b'body'
+    assert len(session.requests) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_http_errors_raise_and_are_not_cached(tmp_path):
+    session = Session(Response(500), Response(200, b'body'))
+    cache = cache_with(tmp_path, session)
+    with pytest.raises(requests.HTTPError):
+        cache.fetch("https://example.com/story")
+    assert cache.fetch("https://example.com/story") == b'body'
+    assert session.requests[1][1] == {}
+
+
+def test_offline_mode_replays_the_cache_and_never_requests(tmp_path):
+    cache_with(tmp_path, Session(Response(200, b'body', {'ETag': '"v1"'}))).fetch("https://example.com/story")
+
+    session = Session()
+    offline = cache_with(tmp_path, session, offline=True)
+    assert offline.fetch("http://example.com/story#top") == b'body'
+    with pytest.raises(OfflineMiss):
+        offline.fetch("https://example.com/other")
+    assert session.requests == []
+    assert list(offline.iter_pages()) == [("https://example.com/story", b'body')]
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import requests
+
+from services.glif_client import GlifClient
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, output):
+        self.output = output
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"output": self.output}
+
+
+def client(post, **kwargs):
+    glif = GlifClient(["a", "b"], "glif", **kwargs)
+    glif.session.post = post
+    return glif
+
+
+def test_deadline_cut_timeouts_leave_the_key_closed():
+    def post(url, json, headers, timeout):
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    glif = client(post, failure_threshold=3)
+    for _ in range(3):
+        assert glif.generate("context", "query", deadline=time.time() + 0.3) is None
+    stats = glif.stats()["keys"]
+    assert stats["key_1"]["state"] == "closed"
+    assert stats["key_1"]["failures"] == 0
+    assert stats["key_1"]["cut_short"] >= 1
+
+
+def test_full_read_timeouts_still_open_the_breaker():
+    def post(url, json, headers, timeout):
+        raise requests.exceptions.ReadTimeout("read timed out")
+
+    glif = client(post, failure_threshold=1)
+    assert glif.generate("context", "query") is None
+    assert glif.stats()["keys"]["key_1"]["state"] == "open"
+
+
+def test_hedge_win_is_not_a_failover():
+    release = threading.Event()
+
+    def post(url, json, headers, timeout):
+        if headers["Authorization"] == "Bearer a":
+            release.wait(2)
+            return Response("slow")
+        return Response("fast")
+
+    glif = client(post, hedge_after=0.05)
+    try:
+        assert glif.generate("context", "query") == "fast"
+    finally:
+        release.set()
+    assert glif.stats()["hedges"] == 1
+    assert glif.stats()["failovers"] == 0
+
+
+def test_success_after_a_failed_key_is_a_failover():
+    def post(url, json, headers, timeout):
+        if headers["Authorization"] == "Bearer a":
+            raise requests.exceptions.ConnectionError("refused")
+        return Response("url")
+
+    glif = client(post)
+    assert glif.generate("context", "query") == "url"
+    assert glif.stats()["failovers"] == 1
@@ -0,0 +1,104 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from services import jobs
+from services.jobs import JobQueue, JobStore, check_callback_url
+
+
+@pytest.mark.parametrize('url', [
+    "http://127.0.0.1/hook",
+    "http://[::1]:8080/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.5/hook",
+    "https://192.168.1.10/hook",
+    "http://172.16.0.1/hook",
+    "ftp://8.8.8.8/hook",
+    "file:///etc/passwd",
+    "javascript:alert(1)",
+    "http:///no-host",
+])
+def test_callback_url_rejects_non_public_or_non_http(url):
+    with pytest.raises(ValueError):
+        check_callback_url(url)
+
+
+def test_callback_url_checks_every_resolved_address(monkeypatch):
+    def resolve(host, port, proto=0):
+        return [(socket.AF_INET, socket.SOCK_STREAM, proto, '', (address, port)) for address in ("8.8.8.8", "127.0.0.1")]
+
+    monkeypatch.setattr(jobs.socket, "getaddrinfo", resolve)
+    with pytest.raises(ValueError):
+        check_callback_url("https://rebind.example/hook")
+
+
+def test_callback_url_accepts_public_addresses():
+    check_callback_url("https://8.8.8.8/hook")
+
+
+def test_callback_url_allow_list():
+    check_callback_url("http://hooks.internal/done", allowed_hosts=["hooks.internal"])
+    check_callback_url("http://HOOKS.internal/done", allowed_hosts=["hooks.internal"])
+    with pytest.raises(ValueError):
+        check_callback_url("https://8.8.8.8/hook", allowed_hosts=["hooks.internal"])
+    with pytest.raises(ValueError):
+        check_callback_url("ftp://hooks.internal/done", allowed_hosts=["hooks.internal"])
+
+
+def test_expired_leases_are_taken_over(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    now = time.time()
+    dead = store.create("q", "red", "blue", now + 60, owner="dead", lease_until=now - 1)
+    alive = store.create("q", "red", "blue", now + 60, owner="alive", lease_until=now + 60)
+    finished = store.create("q", "red", "blue", now + 60, owner="dead", lease_until=now - 1)
+    store.update(finished['id'], "done", result={"meme": "url"})
+
+    assert store.claim_expired("new", now + 30) == [dead['id']]
+    assert store.get(dead['id'])['owner'] == "new"
+    assert store.get(alive['id'])['owner'] == "alive"
+    assert store.get(finished['id'])['owner'] == "dead"
+
+
+def test_renew_extends_only_the_owners_unfinished_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    now = time.time()
+    mine = store.create("q", "red", "blue", now + 60, owner="me", lease_until=now + 1)
+    theirs = store.create("q", "red", "blue", now + 60, owner="them", lease_until=now + 1)
+    store.renew("me", now + 100)
+    assert store.get(mine['id'])['lease_until'] == now + 100
+    assert store.get(theirs['id'])['lease_until'] == now + 1
+    # a renewed lease isn't taken over
+    assert store.claim_expired("other", now + 30) == []
+
+
+def test_queue_heartbeat_keeps_its_jobs(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    release = threading.Event()
+
+    def worker(query, red_context, blue_context, deadline):
+        release.wait(5)
+        return {"meme": "https://example.com/meme.png"}
+
+    owner = JobQueue(JobStore(path), worker, lease=0.3)
+    job = owner.submit("q", "red", "blue")
+    time.sleep(0.6) # past the first lease, but the heartbeat renewed it
+    other = JobQueue(JobStore(path), worker, lease=0.3)
+    other._recover()
+    assert other.store.get(job['id'])['owner'] == owner.owner
+    release.set()
+
+
+def test_queue_resumes_a_job_whose_owner_died(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path)
+    orphan = store.create("q", "red", "blue", time.time() + 60, owner="dead", lease_until=time.time() - 1)
+    queue = JobQueue(JobStore(path), lambda *args: {"meme": "https://example.com/meme.png"})
+    queue._recover()
+    for _ in range(50):
+        if store.get(orphan['id'])['status'] == "done":
+            break
+        time.sleep(0.05)
+    assert store.get(orphan['id'])['status'] == "done"
+    assert store.get(orphan['id'])['owner'] == queue.owner
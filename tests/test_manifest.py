@@ -0,0 +1,91 @@
+import pytest
+
+from ingest.manifest import Manifest, canonicalize_url, dedupe_links, doc_id
+
+
+@pytest.mark.parametrize('url, canonical', [
+    ("HTTPS://WWW.Example.COM/News/Story", "https://example.com/News/Story"),
+    ("http://example.com/story", "https://example.com/story"),
+    ("https://example.com:443/story", "https://example.com/story"),
+    ("http://example.com:80/story", "https://example.com/story"),
+    ("https://example.com:8443/story", "https://example.com:8443/story"),
+    ("https://example.com/story?utm_source=x&fbclid=y&id=2&a=1", "https://example.com/story?a=1&id=2"),
+    ("https://example.com/story#comments", "https://example.com/story"),
+    ("https://example.com/story/", "https://example.com/story"),
+    ("https://example.com", "https://example.com/"),
+    ("  https://example.com/story  ", "https://example.com/story"),
+    ("example.com/story", "https://example.com/story"),
+    ("www.example.com:8080/story", "https://example.com:8080/story"),
+    ("//example.com/story", "https://example.com/story"),
+])
+def test_canonicalize_url(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+@pytest.mark.parametrize('url', ["", "/just/a/path", "https:///story"])
+def test_canonicalize_url_rejects_urls_without_a_host(url):
+    with pytest.raises(ValueError):
+        canonicalize_url(url)
+
+
+def test_dedupe_links_keeps_the_first_spelling():
+    links = ["https://www.example.com/story?utm_medium=social", "http://example.com/story/", "example.com/other",
+             "not a url"]
+    assert dedupe_links(links) == [
+        ("https://example.com/story", "https://www.example.com/story?utm_medium=social"),
+        ("https://example.com/other", "example.com/other"),
+    ]
+
+
+def test_manifest_keeps_one_row_per_collection_and_url(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.db"))
+    url = canonicalize_url("https://example.com/story")
+    manifest.mark("Red", url, "failed", error="timeout")
+    manifest.mark("Red", url, "stored", content_hash="abc", doc_id=doc_id(url))
+    manifest.mark("Red", url, "skipped")
+    manifest.mark("Blue", url, "stored", content_hash="abc", doc_id=doc_id(url))
+
+    row = manifest.get("Red", url)
+    assert row["status"] == "skipped"
+    # a later mark without a hash or id keeps the stored ones
+    assert row["content_hash"] == "abc"
+    assert row["doc_id"] == doc_id(url)
+    assert row["error"] is None
+    assert manifest.counts() == {"Red/skipped": 1, "Blue/stored": 1}
+
+
+class Collection:
+    def __init__(self, rows):
+        self.rows = dict(rows)
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, include, limit, offset):
+        page = list(self.rows.items())[offset:offset + limit]
+        return {"ids": [row_id for row_id, _ in page], "documents": [row[0] for _, row in page],
+                "metadatas": [row[1] for _, row in page], "embeddings": [row[2] for _, row in page]}
+
+    def upsert(self, ids, documents, metadatas, embeddings):
+        for row in zip(ids, documents, metadatas, embeddings):
+            self.rows[row[0]] = row[1:]
+
+    def delete(self, ids):
+        for row_id in ids:
+            del self.rows[row_id]
+
+
+def test_migration_collapses_uuid_rows_per_url(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.db"))
+    collection = Collection({
+        "uuid-1": ("summary", {"source": "https://www.example.com/story"}, [1.0]),
+        "uuid-2": ("summary again", {"source": "http://example.com/story/"}, [1.0]),
+        "uuid-3": ("other", {"source": "https://example.com/other"}, [0.0]),
+    })
+    assert manifest.migrate_collection("Red", collection) == {"rewritten": 2, "deleted": 1}
+    story, other = canonicalize_url("example.com/story"), canonicalize_url("example.com/other")
+    assert set(collection.rows) == {doc_id(story), doc_id(other)}
+    assert manifest.get("Red", story)["status"] == "stored"
+    # once per collection
+    collection.rows["uuid-4"] = ("late", {"source": "https://example.com/late"}, [0.5])
+    assert manifest.migrate_collection("Red", collection) == {"rewritten": 0, "deleted": 0}
@@ -0,0 +1,44 @@
+import os
+
+from services import meme_cache
+from services.meme_cache import BlobStore
+
+
+def blob(i, size=100):
+    return bytes([i]) * size
+
+
+def stored_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(directory) for name in files)
+
+
+def test_put_does_not_rescan_the_directory_every_time(tmp_path, monkeypatch):
+    scans = []
+    walk = os.walk
+    monkeypatch.setattr(meme_cache.os, "walk", lambda directory: scans.append(directory) or walk(directory))
+    store = BlobStore(str(tmp_path), max_bytes=10_000)
+    for i in range(20):
+        store.put(blob(i))
+    assert len(scans) == 1
+
+
+def test_trim_evicts_least_recently_used(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=350)
+    digests = [store.put(blob(i)) for i in range(3)]
+    os.utime(store._path(digests[0]), (0, 0))
+    os.utime(store._path(digests[1]), (1, 1))
+    store.put(blob(3))
+    assert stored_bytes(tmp_path) <= 350
+    assert store.get(digests[0]) is None
+    assert store.get(digests[2]) == blob(2)
+
+
+def test_get_tolerates_a_blob_evicted_mid_read(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path))
+    digest = store.put(blob(1))
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(meme_cache.os, "utime", evicted)
+    assert store.get(digest) == blob(1)
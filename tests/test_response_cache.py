@@ -0,0 +1,16 @@
+import time
+
+from services.response_cache import MemoryCache, SqliteCache, TieredCache
+
+
+def test_promotion_keeps_the_remaining_ttl(tmp_path):
+    memory = MemoryCache(ttl=3600)
+    sqlite = SqliteCache(str(tmp_path / "cache.db"), ttl=3600)
+    sqlite.set("key", "answer", ttl=0.2)
+    cache = TieredCache(memory, sqlite)
+
+    assert cache.get("key") == "answer"
+    assert memory.get_with_expiry("key")[1] <= time.time() + 0.2
+    time.sleep(0.3)
+    assert cache.get("key") is None
+    assert memory.get("key") is None
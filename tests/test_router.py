@@ -0,0 +1,47 @@
+import threading
+import time
+
+from flask import Flask
+
+import router
+from services.jobs import JobStore
+
+
+class Queue:
+    def __init__(self, store):
+        self.store = store
+
+
+def test_job_events_see_a_job_finished_by_another_worker(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path)
+    monkeypatch.setattr(router, "meme_jobs", Queue(store))
+    app = Flask(__name__)
+    router.setup_routes(app)
+    job = store.create("query", "red", "blue", time.time() + 60)
+
+    # a separate store on the same file, as another worker process would have
+    other = JobStore(path)
+    threading.Timer(0.3, other.update, (job['id'], "done", {"meme": "https://example.com/meme.png"})).start()
+
+    start = time.monotonic()
+    body = app.test_client().get(f"/jobs/{job['id']}/events").get_data(as_text=True)
+    assert "event: done" in body
+    assert time.monotonic() - start < 5
+
+
+def test_job_events_end_when_the_job_is_pruned(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.db")
+    store = JobStore(path)
+    monkeypatch.setattr(router, "meme_jobs", Queue(store))
+    app = Flask(__name__)
+    router.setup_routes(app)
+    job = store.create("query", "red", "blue", time.time() + 60)
+
+    def prune():
+        store._conn.execute("DELETE FROM jobs WHERE id = ?", (job['id'],))
+
+    threading.Timer(0.3, prune).start()
+    body = app.test_client().get(f"/jobs/{job['id']}/events").get_data(as_text=True)
+    assert body.rstrip().endswith('"error": "No such job"}')
+    assert "event: gone" in body
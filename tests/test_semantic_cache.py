@@ -0,0 +1,52 @@
+import time
+
+import numpy as np
+
+from services.semantic_cache import SemanticCache
+
+
+def vector(*values):
+    return np.array(values, dtype=np.float32)
+
+
+def test_hit_only_at_or_above_the_threshold():
+    cache = SemanticCache(capacity=4, threshold=0.9)
+    cache.put(vector(1, 0), "answer")
+    # cosine 0.95 and 0.8 against (1, 0); vectors needn't be unit length
+    assert cache.get(vector(0.95, np.sqrt(1 - 0.95 ** 2)) * 3) == "answer"
+    assert cache.get(vector(0.8, 0.6)) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_nearest_entry_wins():
+    cache = SemanticCache(capacity=4, threshold=0.5)
+    cache.put(vector(1, 0), "x")
+    cache.put(vector(0, 1), "y")
+    assert cache.get(vector(0.2, 1)) == "y"
+
+
+def test_expired_entries_miss_and_their_slot_is_reused():
+    cache = SemanticCache(capacity=1, threshold=0.9, ttl=0.1)
+    cache.put(vector(1, 0), "old")
+    time.sleep(0.15)
+    assert cache.get(vector(1, 0)) is None
+    assert cache.stats()["size"] == 0
+    cache.put(vector(0, 1), "new")
+    assert cache.stats()["evictions"] == 0
+    assert cache.get(vector(0, 1)) == "new"
+
+
+def test_full_cache_evicts_the_least_recently_used():
+    cache = SemanticCache(capacity=2, threshold=0.9)
+    cache.put(vector(1, 0), "a")
+    time.sleep(0.01)
+    cache.put(vector(0, 1), "b")
+    time.sleep(0.01)
+    assert cache.get(vector(1, 0)) == "a" # b is now the least recently used
+    time.sleep(0.01)
+    cache.put(vector(1, 1), "c")
+    assert cache.stats() == {"hits": 1, "misses": 0, "evictions": 1, "size": 2}
+    assert cache.get(vector(1, 0)) == "a"
+    assert cache.get(vector(0, 1)) is None
+    assert cache.get(vector(1, 1)) == "c"
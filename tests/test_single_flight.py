@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def run_followers(flight, key, func, count, **kwargs):
+    results = []
+
+    def follow():
+        try:
+            results.append(flight.do(key, func, **kwargs))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=follow) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_followers_share_the_leaders_result():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return "answer"
+
+    leader, leader_result = run_followers(flight, "key", compute, 1)
+    started.wait(1)
+    followers, results = run_followers(flight, "key", compute, 3)
+    time.sleep(0.1)
+    release.set()
+    for thread in leader + followers:
+        thread.join(2)
+    assert leader_result == ["answer"]
+    assert results == ["answer"] * 3
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_followers_get_the_leaders_exception_and_the_key_is_released():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(2)
+        raise ValueError("upstream said no")
+
+    leader, leader_result = run_followers(flight, "key", fail, 1)
+    started.wait(1)
+    followers, results = run_followers(flight, "key", fail, 2)
+    time.sleep(0.1)
+    release.set()
+    for thread in leader + followers:
+        thread.join(2)
+    assert all(isinstance(result, ValueError) for result in leader_result + results)
+    assert flight.stats()["in_flight"] == 0
+    # the next call runs again rather than replaying the error
+    assert flight.do("key", lambda: "fresh") == "fresh"
+
+
+def test_follower_gives_up_after_its_own_timeout():
+    flight = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+        return "late"
+
+    leader, leader_result = run_followers(flight, "key", slow, 1)
+    started.wait(1)
+    with pytest.raises(TimeoutError):
+        flight.do("key", slow, timeout=0.1)
+    release.set()
+    leader[0].join(2)
+    assert leader_result == ["late"]
+
+
+def test_leader_timeout_abandons_and_a_follower_takes_over():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def compute(label, seconds):
+        calls.append(label)
+        await asyncio.sleep(seconds)
+        return label
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("key", compute, "leader", 1, timeout=0.1))
+        await asyncio.sleep(0.02)
+        follower = asyncio.ensure_future(flight.do_async("key", compute, "follower", 0.05, timeout=2))
+        with pytest.raises(asyncio.TimeoutError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "follower"
+    assert calls == ["leader", "follower"]
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_leader_abandons_and_a_follower_takes_over():
+    flight = SingleFlight("test")
+
+    async def compute(label):
+        await asyncio.sleep(0.1)
+        return label
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("key", compute, "leader"))
+        await asyncio.sleep(0.02)
+        follower = asyncio.ensure_future(flight.do_async("key", compute, "follower"))
+        await asyncio.sleep(0.02)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "follower"
+    assert flight.stats()["leaders"] == 2
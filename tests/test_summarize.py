@@ -0,0 +1,85 @@
+from ingest.summarize import MapReduceSummarizer, REDUCE_PROMPT, chunk_text
+
+
+def sentence(i, words=10):
+    return ' '.join([f"word{i}"] * (words - 1)) + f" end{i}."
+
+
+def test_chunks_break_on_sentences_within_budget_without_overlap():
+    text = ' '.join(sentence(i) for i in range(40))
+    chunks = chunk_text(text, max_tokens=50)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.endswith('.') for chunk in chunks)
+    # every sentence lands in exactly one chunk, in order
+    assert ' '.join(chunks) == text
+
+
+def test_long_sentence_is_split_on_words_and_a_huge_word_by_characters():
+    long_sentence = ' '.join(['word'] * 100)
+    chunks = chunk_text(long_sentence, max_tokens=10)
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert ' '.join(chunks) == long_sentence
+
+    chunks = chunk_text('x' * 100, max_tokens=10)
+    assert chunks == ['x' * 40, 'x' * 40, 'x' * 20]
+
+
+def test_short_and_empty_text():
+    assert chunk_text("One sentence. Two sentences.", max_tokens=100) == ["One sentence. Two sentences."]
+    assert chunk_text("   ") == []
+
+
+class Llm:
+    def __init__(self, answer=lambda system_message, user_message: f"summary of {user_message[:12]}"):
+        self.answer = answer
+        self.prompts = []
+
+    def __call__(self, system_message, user_message):
+        self.prompts.append((system_message, user_message))
+        return self.answer(system_message, user_message)
+
+
+def test_single_chunk_is_one_call_without_reduce():
+    llm = Llm()
+    summary, chunk_summaries = MapReduceSummarizer(llm, chunk_tokens=100).summarize("Short article.", "summarize")
+    assert summary == "summary of Short articl"
+    assert chunk_summaries == []
+    assert llm.prompts == [("summarize", "Short article.")]
+
+
+def test_empty_article_is_still_one_call():
+    llm = Llm(lambda system_message, user_message: "N/A")
+    summary, chunk_summaries = MapReduceSummarizer(llm).summarize("", "summarize")
+    assert (summary, chunk_summaries) == ("N/A", [])
+    assert len(llm.prompts) == 1
+
+
+def test_long_article_maps_then_reduces_once():
+    llm = Llm()
+    summarizer = MapReduceSummarizer(llm, chunk_tokens=50)
+    text = ' '.join(sentence(i) for i in range(12))
+    summary, chunk_summaries = summarizer.summarize(text, "summarize")
+    reduce_calls = [user for system, user in llm.prompts if system == REDUCE_PROMPT]
+    assert len(chunk_summaries) == len(chunk_text(text, 50))
+    assert reduce_calls == ['\n\n'.join(chunk_summaries)]
+    assert summary == llm.answer(REDUCE_PROMPT, reduce_calls[0])
+
+
+def test_all_empty_chunk_summaries_skip_the_reduce():
+    llm = Llm(lambda system_message, user_message: "N/A.")
+    summary, chunk_summaries = MapReduceSummarizer(llm, chunk_tokens=50).summarize(
+        ' '.join(sentence(i) for i in range(12)), "summarize")
+    assert summary == "N/A"
+    assert all(system != REDUCE_PROMPT for system, _ in llm.prompts)
+
+
+def test_reduce_of_one_summary_makes_no_call_and_over_budget_summaries_reduce_in_rounds():
+    llm = Llm(lambda system_message, user_message: "merged")
+    summarizer = MapReduceSummarizer(llm, chunk_tokens=10)
+    assert summarizer.reduce(["only one"]) == "only one"
+    assert llm.prompts == []
+
+    assert summarizer.reduce(["x" * 30, "y" * 30, "z" * 30]) == "merged"
+    # three groups in the first round, then one over their merged outputs
+    assert len(llm.prompts) == 4